@@ -65,6 +65,10 @@ def get_public_scripts_dir():
     ][0]
 
 
+# The scripts already found, by name and PATH
+_scripts_found = {}
+
+
 def find_script(name):
     """Return the absoulute path of a pgxn script.
 
@@ -73,9 +77,14 @@ def find_script(name):
 
     Return `None` if the script is not found.
     """
-    path = os.environ.get('PATH', '').split(os.pathsep)
+    key = (name, os.environ.get('PATH', ''))
+    if key in _scripts_found:
+        return _scripts_found[key]
+
+    path = key[1].split(os.pathsep)
     path[0:0] = get_scripts_dirs()
     for p in path:
         fn = os.path.join(p, name)
         if os.path.isfile(fn):
+            _scripts_found[key] = fn
             return fn
@@ -0,0 +1,102 @@
+"""
+pgxnclient -- asyncio wrapper of the API
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+import functools
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    asyncio = None
+
+from pgxnclient import network
+from pgxnclient.i18n import _
+from pgxnclient.api import DEFAULT_MIRROR, get_api
+from pgxnclient.errors import PgxnClientException
+from pgxnclient.utils.semver import SemVer
+
+
+class AsyncApi(object):
+    """
+    An asyncio interface to the PGXN API.
+
+    The methods take the same arguments of the `~pgxnclient.api.Api` ones
+    and return awaitables. The requests are performed by the synchronous
+    `!Api` *api*, or by one talking to *mirror*, run in a pool of at most
+    *concurrency* threads: the results and the errors raised are the same of
+    the synchronous interface. Connections are not pooled: as in `!Api`,
+    every request opens its own connection. For example::
+
+        api = AsyncApi()
+        try:
+            dists = await asyncio.gather(*[api.dist(n) for n in names])
+        finally:
+            api.close()
+
+    `download()` differs from `!Api.download()` as it saves the archive
+    instead of returning an open file, whose reading would block the loop.
+    """
+
+    def __init__(self, mirror=DEFAULT_MIRROR, api=None, concurrency=8):
+        if asyncio is None:
+            raise PgxnClientException(
+                _("asyncio is not available on this Python version")
+            )
+        if api is None:
+            api = get_api(mirror)
+        self.api = api
+        self._executor = ThreadPoolExecutor(concurrency)
+
+    def close(self):
+        """Wait for the running requests to finish and release the threads."""
+        self._executor.shutdown(wait=True)
+
+    def dist(self, dist, version=''):
+        return self._run(self.api.dist, dist, version and SemVer(version))
+
+    def ext(self, ext):
+        return self._run(self.api.ext, ext)
+
+    def meta(self, dist, version, as_json=True):
+        return self._run(self.api.meta, dist, SemVer(version), as_json)
+
+    def readme(self, dist, version):
+        return self._run(self.api.readme, dist, SemVer(version))
+
+    def download(self, dist, version, target='.'):
+        """
+        Download the archive of a distribution into *target*.
+
+        Return the name of the file saved, as `network.download()`.
+        """
+        return self._run(self._download, dist, SemVer(version), target)
+
+    def _download(self, dist, version, target):
+        with self.api.download(dist, version) as f:
+            return network.download(f, target)
+
+    def mirrors(self):
+        return self._run(self.api.mirrors)
+
+    def search(self, where, query):
+        return self._run(self.api.search, where, query)
+
+    def stats(self, arg):
+        return self._run(self.api.stats, arg)
+
+    def user(self, username):
+        return self._run(self.api.user, username)
+
+    def _run(self, f, *args):
+        try:
+            loop = asyncio.get_running_loop()
+        except (AttributeError, RuntimeError):
+            # Python < 3.7, or not called from a coroutine
+            loop = asyncio.get_event_loop()
+        f = functools.partial(f, *args)
+        return loop.run_in_executor(self._executor, f)
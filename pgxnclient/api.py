@@ -6,29 +6,95 @@ pgxnclient -- client API stub
 
 # This file is part of the PGXN client
 
-from six.moves.urllib.parse import urlencode
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+from six.moves.urllib.parse import urlencode, unquote
+from six.moves.urllib.request import pathname2url
 
 from pgxnclient import network
-from pgxnclient.utils import load_json
-from pgxnclient.errors import NetworkError, NotFound, ResourceNotFound
+from pgxnclient.i18n import _
+from pgxnclient.utils import load_json, load_jsons
+from pgxnclient.errors import PgxnException, NetworkError, NotFound
+from pgxnclient.errors import NotCached, ResourceNotFound
 from pgxnclient.utils.uri import expand_template
+from pgxnclient.utils.cache import TEMP_PREFIX, get_cache_dir
+
+logger = logging.getLogger('pgxnclient.api')
+
+# The PGXN API server, also providing the list of the mirrors
+DEFAULT_MIRROR = 'https://api.pgxn.org/'
+
+# The value of --mirror to use the fastest mirror available
+AUTO_MIRROR = 'auto'
+
+
+def get_api(mirror, offline=False):
+    """
+    Return the `Api` to talk to *mirror*, possibly `AUTO_MIRROR`.
+
+    The data fetched are saved in the `ApiCache`. If *offline*, return an
+    `OfflineApi` reading them from there instead.
+    """
+    if offline:
+        return OfflineApi()
+    elif mirror == AUTO_MIRROR:
+        return AutoApi(cache=ApiCache())
+    else:
+        return Api(mirror=mirror, cache=ApiCache())
 
 
 class Api(object):
-    def __init__(self, mirror):
+    """
+    Access to the PGXN API on *mirror*.
+
+    The distributions, META and extensions data returned are memoized for
+    `MEMO_TTL` seconds, so they are fetched only once, even if requested
+    concurrently by many threads, but long-running processes still see the
+    new releases. The objects returned are shared and should not be
+    modified.
+
+    If *cache* is an `ApiCache`, the data fetched are also saved there.
+    """
+
+    # Seconds the data fetched are reused
+    MEMO_TTL = 60
+
+    def __init__(self, mirror, cache=None):
         self.mirror = mirror
+        self.cache = cache
+        self._init_memo()
+
+    def _init_memo(self):
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+        self._flights = {}
 
     def dist(self, dist, version=''):
+        if version:
+            try:
+                return self.meta(dist, version)
+            except ResourceNotFound:
+                raise NotFound("distribution '%s' not found" % dist)
+
+        return self._memoized(('dist', dist), self._dist, dist)
+
+    def _dist(self, dist):
         try:
-            with self.call(
-                version and 'meta' or 'dist',
-                {'dist': dist, 'version': version},
-            ) as f:
+            with self.call('dist', {'dist': dist}) as f:
                 return load_json(f)
         except ResourceNotFound:
             raise NotFound("distribution '%s' not found" % dist)
 
     def ext(self, ext):
+        return self._memoized(('ext', ext), self._ext, ext)
+
+    def _ext(self, ext):
         try:
             with self.call('extension', {'extension': ext}) as f:
                 return load_json(f)
@@ -36,11 +102,91 @@ class Api(object):
             raise NotFound("extension '%s' not found" % ext)
 
     def meta(self, dist, version, as_json=True):
+        if as_json:
+            key = ('meta', dist, str(version))
+            return self._memoized(key, self._meta, dist, version)
+
         with self.call('meta', {'dist': dist, 'version': version}) as f:
-            if as_json:
-                return load_json(f)
-            else:
-                return f.read().decode('utf-8')
+            return f.read().decode('utf-8')
+
+    def _meta(self, dist, version):
+        with self.call('meta', {'dist': dist, 'version': version}) as f:
+            return load_json(f)
+
+    def prefetch(self, releases, parallel=8):
+        """
+        Fetch the data of many distributions concurrently.
+
+        *releases* is a list of pairs (dist, version): fetch the META of the
+        release, or the distribution data if version is empty. The data are
+        memoized, so later requests for them don't hit the network.
+
+        Return a list with the data of each release, `!None` for the ones
+        that couldn't be fetched.
+        """
+
+        def fetch(release):
+            dist, version = release
+            try:
+                return self.dist(dist, version)
+            except PgxnException as e:
+                logger.debug("prefetching %s %s failed: %s", dist, version, e)
+
+        releases = list(releases)
+        if not releases:
+            return []
+
+        pool = ThreadPool(min(len(releases), parallel))
+        try:
+            return pool.map(fetch, releases, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _memoized(self, key, f, *args):
+        """
+        Return `!f(*args)`, calling it only once for the same *key*.
+
+        If the result is being computed by another thread, wait for it
+        instead of calling *f* again. Errors are not memoized.
+        """
+        with self._memo_lock:
+            if key in self._memo:
+                t, rv = self._memo[key]
+                if time.time() - t < self.MEMO_TTL:
+                    return rv
+                del self._memo[key]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            return flight.wait()
+
+        try:
+            rv = f(*args)
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            flight.result = rv
+            with self._memo_lock:
+                self._prune_memo()
+                self._memo[key] = (time.time(), rv)
+            return rv
+        finally:
+            with self._memo_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _prune_memo(self):
+        # Drop the expired data, which would be fetched again anyway
+        now = time.time()
+        for key, (t, rv) in list(self._memo.items()):
+            if now - t >= self.MEMO_TTL:
+                del self._memo[key]
 
     def readme(self, dist, version):
         with self.call('readme', {'dist': dist, 'version': version}) as f:
@@ -51,6 +197,19 @@ class Api(object):
         version = version.lower()
         return self.call('download', {'dist': dist, 'version': version})
 
+    def download_name(self, dist, version):
+        """Return the file name of the archive of a distribution."""
+        args = {'dist': dist.lower(), 'version': version.lower()}
+        return unquote(self.get_path('download', args)).rsplit('/', 1)[-1]
+
+    def download_urls(self, dist, version):
+        """Return the URLs of a distribution on all the mirrors, best first."""
+        args = {'dist': dist.lower(), 'version': version.lower()}
+        return [
+            self.get_url('download', args, mirror=m)
+            for m in self.get_mirrors()
+        ]
+
     def mirrors(self):
         with self.call('mirrors') as f:
             return load_json(f)
@@ -77,9 +236,8 @@ class Api(object):
             return load_json(f)
 
     def call(self, meth, args=None, query=None):
-        url = self.get_url(meth, args, query)
         try:
-            return network.get_file(url)
+            return self._call(meth, args, query)
         except ResourceNotFound:
             # check if it is one of the broken URLs as reported in
             # https://groups.google.com/group/pgxn-users/browse_thread/thread/e41fbc202680c92c
@@ -89,18 +247,36 @@ class Api(object):
 
             args = args.copy()
             args['version'] = str(version).replace('-', '', 1)
-            url = self.get_url(meth, args, query)
-            return network.get_file(url)
+            return self._call(meth, args, query)
+
+    def _call(self, meth, args, query):
+        # The archives are already compressed
+        compress = meth != 'download'
+        url = self.get_url(meth, args, query)
+        f = network.get_file(url, compress=compress)
+        if self.cache is None or meth not in ApiCache.METHODS:
+            return f
+
+        with f:
+            data = f.read()
+        self.cache.save(self.get_path(meth, args), data)
+        return BytesIO(data)
+
+    def get_mirrors(self):
+        """Return the URLs of the mirrors available, best first."""
+        return [self.mirror]
 
-    def get_url(self, meth, args=None, query=None):
-        tmpl = self.get_template(meth)
-        url = expand_template(tmpl, args or {})
-        url = self.mirror.rstrip('/') + url
+    def get_url(self, meth, args=None, query=None, mirror=None):
+        url = (mirror or self.mirror).rstrip('/') + self.get_path(meth, args)
         if query is not None:
             url = url + '?' + urlencode(query)
 
         return url
 
+    def get_path(self, meth, args=None):
+        """Return the path of the resource of an API method on a mirror."""
+        return expand_template(self.get_template(meth), args or {})
+
     def get_template(self, meth):
         return self.get_index()[meth]
 
@@ -110,9 +286,289 @@ class Api(object):
         if self._api_index is None:
             url = self.mirror.rstrip('/') + '/index.json'
             try:
-                with network.get_file(url) as f:
-                    self._api_index = load_json(f)
+                with network.get_file(url, compress=True) as f:
+                    data = f.read()
             except ResourceNotFound:
                 raise NetworkError("API index not found at '%s'" % url)
 
+            self.set_index(data)
+
         return self._api_index
+
+    def set_index(self, data):
+        """Use *data*, the content of an ``index.json``, as the API index."""
+        self._api_index = load_jsons(data.decode('utf-8'))
+        if self.cache is not None:
+            self.cache.save('/index.json', data)
+
+
+class OfflineApi(Api):
+    """
+    An `Api` only returning the data found in an `ApiCache`.
+
+    Requesting anything missing from the cache raises `NotCached` instead
+    of accessing the network.
+    """
+
+    def __init__(self, cache=None):
+        if cache is None:
+            cache = ApiCache()
+        try:
+            url = cache.get_url()
+        except (IOError, OSError) as e:
+            raise NotCached(_("the local cache is not available: %s") % e)
+        super(OfflineApi, self).__init__(url)
+        self.source = cache
+
+    def call(self, meth, args=None, query=None):
+        if meth not in ApiCache.METHODS:
+            raise NotCached(_("'%s' data is not available offline") % meth)
+
+        try:
+            return super(OfflineApi, self).call(meth, args, query)
+        except ResourceNotFound:
+            raise NotCached(
+                _("%s not found in the local cache")
+                % unquote(self.get_path(meth, args))
+            )
+
+    def get_index(self):
+        try:
+            return super(OfflineApi, self).get_index()
+        except NetworkError:
+            raise NotCached(_("API index not found in the local cache"))
+
+
+class ApiCache(object):
+    """
+    A local copy of the data fetched from the API, in the layout of a mirror.
+
+    The data can be used offline by an `OfflineApi`. The cache directory is
+    only created when first used: if it can't be, nothing is saved.
+    """
+
+    # The API methods whose results are cached
+    METHODS = frozenset(['dist', 'meta', 'readme', 'extension'])
+
+    def __init__(self, root=None):
+        self._root = root
+
+    @property
+    def root(self):
+        """The cache directory. Raise `OSError` if it can't be created."""
+        if self._root is None:
+            self._root = get_cache_dir('api')
+        return self._root
+
+    def get_url(self):
+        """Return the URL to use the cache as a mirror."""
+        return 'file://' + pathname2url(self.root)
+
+    def get_filename(self, path):
+        """Return the file name for an URL path, `!None` if invalid."""
+        path = unquote(path)
+        fn = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+        if fn.startswith(self.root + os.sep):
+            return fn
+
+    def save(self, path, data):
+        """Save *data* as the content of the URL *path*."""
+        from pgxnclient.mirror import save_stream
+
+        try:
+            fn = self.get_filename(path)
+            if fn is None:
+                logger.debug("not caching bad path %s", path)
+                return
+
+            save_stream(BytesIO(data), fn)
+        except (IOError, OSError) as e:
+            # The cache is not essential: no problem if we can't write it
+            logger.debug("cannot write cache file for %s: %s", path, e)
+
+
+class _Flight(object):
+    """A request in progress, whose result is awaited by other threads."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class AutoApi(Api):
+    """
+    An `Api` talking to the fastest of the known PGXN mirrors.
+
+    The mirrors listed by the *origin* API server are ranked by the time
+    taken to request their index, probing them concurrently. The ranking is
+    stored in the cache and reused for *ttl* seconds. If a request to a
+    mirror fails for a network error it is retried on the next one in the
+    ranking.
+
+    The search is not available on the mirrors, so it is always performed on
+    the *origin* server. The data fetched are saved in *cache*, as in `Api`.
+    """
+
+    # Seconds a mirrors ranking is valid
+    RANKING_TTL = 24 * 60 * 60
+
+    # Seconds to wait for a mirror to reply
+    PROBE_TIMEOUT = 5
+
+    def __init__(self, origin=DEFAULT_MIRROR, ttl=RANKING_TTL, cache=None):
+        self._init_memo()
+        self.origin = origin
+        self.cache = cache
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._ranking = None
+        self._mirrors = None
+
+    @property
+    def mirror(self):
+        return self.get_mirrors()[0]
+
+    def get_mirrors(self):
+        """Return the healthy mirrors URLs, fastest first."""
+        with self._lock:
+            if self._mirrors is None:
+                data = self.load_ranking()
+                if data is None:
+                    t = time.time()
+                    data = {'time': t, 'ranking': self.rank_mirrors()}
+                    self.save_ranking(data)
+
+                self._ranking = data
+                self._mirrors = [r[0] for r in data['ranking']]
+                if not self._mirrors:
+                    self._mirrors.append(self.origin)
+                logger.debug("using mirror %s", self._mirrors[0])
+
+            return list(self._mirrors)
+
+    def call(self, meth, args=None, query=None):
+        if meth == 'search':
+            return self.get_origin_api().call(meth, args, query)
+
+        while 1:
+            mirror = self.mirror
+            try:
+                return super(AutoApi, self).call(meth, args, query)
+            except ResourceNotFound:
+                raise
+            except NetworkError as e:
+                if not self.failover(mirror, e):
+                    raise
+
+    def failover(self, mirror, error):
+        """
+        Stop using *mirror*, failed with *error*.
+
+        Return `!False` if there is no other mirror to use.
+        """
+        with self._lock:
+            if mirror in self._mirrors:
+                if len(self._mirrors) == 1:
+                    return False
+
+                self._mirrors.remove(mirror)
+                self._api_index = None
+                logger.warning(
+                    _("mirror %s failed: %s; switching to %s"),
+                    mirror,
+                    error,
+                    self._mirrors[0],
+                )
+
+                # don't pick this mirror again until the next ranking
+                ranking = self._ranking['ranking']
+                ranking[:] = [r for r in ranking if r[0] != mirror]
+                self.save_ranking(self._ranking)
+
+            return True
+
+    _origin_api = None
+
+    def get_origin_api(self):
+        if self._origin_api is None:
+            self._origin_api = Api(mirror=self.origin)
+        return self._origin_api
+
+    def rank_mirrors(self):
+        """
+        Probe the known mirrors concurrently.
+
+        Return a list of (url, seconds) of the mirrors replying, fastest
+        first.
+        """
+        urls = [self.origin]
+        try:
+            for m in self.get_origin_api().mirrors():
+                if m['uri'] not in urls:
+                    urls.append(m['uri'])
+        except NetworkError as e:
+            logger.warning(_("cannot get the list of mirrors: %s"), e)
+
+        logger.info(_("probing %d mirrors"), len(urls))
+
+        def probe(url):
+            url = url.rstrip('/') + '/index.json'
+            return network.probe(url, timeout=self.PROBE_TIMEOUT)
+
+        pool = ThreadPool(min(len(urls), 8))
+        try:
+            times = pool.map(probe, urls, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        rv = [(u, t) for u, t in zip(urls, times) if t is not None]
+        rv.sort(key=lambda r: r[1])
+        return rv
+
+    def get_ranking_filename(self):
+        return os.path.join(get_cache_dir(), 'mirrors.json')
+
+    def load_ranking(self):
+        """
+        Return the stored ranking, `!None` if missing or expired.
+
+        The ranking is a dict with the ``time`` it was created and the
+        ``ranking`` list as returned by `rank_mirrors()`.
+        """
+        try:
+            with open(self.get_ranking_filename()) as f:
+                data = load_jsons(f.read())
+            if data['origin'] != self.origin:
+                return None
+            if not (0 <= time.time() - data['time'] < self.ttl):
+                return None
+            data['ranking'] = [tuple(r) for r in data['ranking']]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+        return data
+
+    def save_ranking(self, data):
+        data = dict(data, origin=self.origin)
+        try:
+            fn = self.get_ranking_filename()
+            f = tempfile.NamedTemporaryFile(
+                mode='w',
+                prefix=TEMP_PREFIX,
+                dir=os.path.dirname(fn),
+                delete=False,
+            )
+            with f:
+                json.dump(data, f)
+            os.rename(f.name, fn)
+        except (IOError, OSError) as e:
+            # The ranking is just a cache: no problem if we can't write it
+            logger.debug("cannot write mirrors ranking: %s", e)
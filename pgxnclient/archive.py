@@ -7,26 +7,54 @@ pgxnclient -- archives handling
 # This file is part of the PGXN client
 
 import os
+import json
+import tempfile
 
 from pgxnclient.i18n import _
-from pgxnclient.utils import load_jsons
+from pgxnclient.utils import load_jsons, sha1
 from pgxnclient.errors import PgxnClientException
+from pgxnclient.utils.cache import (
+    TEMP_PREFIX,
+    get_cache_dir,
+    sweep_temp_files,
+)
+
+import logging
+
+logger = logging.getLogger('pgxnclient.archive')
 
 
 def from_spec(spec):
-    """Return an `Archive` instance to handle the file requested by *spec*"""
+    """Return an `Archive` instance to handle the file requested by *spec*
+
+    The content of local files is indexed: see `ArchiveIndex`.
+    """
     assert spec.is_file()
-    return from_file(spec.filename)
+    return from_file(spec.filename, indexed=True)
+
 
+def from_file(filename, indexed=False):
+    """Return an `Archive` instance to handle the file *filename*
 
-def from_file(filename):
-    """Return an `Archive` instance to handle the file *filename*"""
+    If *indexed*, use the `ArchiveIndex` of the file if available and create
+    it the first time the archive content is inspected.
+    """
     from pgxnclient.zip import ZipArchive
     from pgxnclient.tar import TarArchive
 
-    for cls in (ZipArchive, TarArchive):
+    classes = (ZipArchive, TarArchive)
+    if indexed:
+        index = ArchiveIndex(filename)
+        if index.load():
+            for cls in classes:
+                if cls.type == index.data['type']:
+                    return cls(filename, index=index)
+
+    for cls in classes:
         a = cls(filename)
         if a.can_open():
+            if indexed:
+                a.index = index
             return a
 
     raise PgxnClientException(
@@ -37,8 +65,12 @@ def from_file(filename):
 class Archive(object):
     """Base class to handle archives."""
 
-    def __init__(self, filename):
+    # Name of the archive type, as stored in the `ArchiveIndex`
+    type = None
+
+    def __init__(self, filename, index=None):
         self.filename = filename
+        self.index = index
 
     def can_open(self):
         """Return `!True` if the `!filename` can be opened by the obect."""
@@ -63,10 +95,21 @@ class Archive(object):
         """Return a file's data from the archive."""
         raise NotImplementedError
 
+    def get_unpacked_size(self):
+        """Return the size in bytes of the archive content once unpacked.
+
+        The size may be estimated: return `!None` if it can't be known
+        without unpacking the archive.
+        """
+        raise NotImplementedError
+
     def unpack(self, destdir):
         raise NotImplementedError
 
     def get_meta(self):
+        if self.index is not None and self.index.data:
+            return self.index.data['meta']
+
         filename = self.filename
 
         self.open()
@@ -74,26 +117,138 @@ class Archive(object):
             # Return the first file with the expected name
             for fn in self.list_files():
                 if fn.endswith('META.json'):
-                    return load_jsons(self.read(fn).decode('utf8'))
+                    meta = load_jsons(self.read(fn).decode('utf8'))
+                    break
             else:
                 raise PgxnClientException(
                     _("file 'META.json' not found in archive '%s'") % filename
                 )
+
+            if self.index is not None:
+                self.index.save({'type': self.type, 'meta': meta})
+
+            return meta
         finally:
             self.close()
 
     def _find_work_directory(self, destdir):
-        """
-        Choose the directory where to work.
+        return find_work_directory(destdir)
 
-        Because we are mostly a wrapper for pgxs, let's look for a makefile.
-        The tar should contain a single base directory, so return the first
-        dir we found containing a Makefile, alternatively just return the
-        unpacked dir
-        """
-        for dir in os.listdir(destdir):
-            for fn in ('Makefile', 'makefile', 'GNUmakefile', 'configure'):
-                if os.path.exists(os.path.join(destdir, dir, fn)):
-                    return os.path.join(destdir, dir)
 
-        return destdir
+def find_work_directory(destdir):
+    """
+    Choose the directory where to work.
+
+    Because we are mostly a wrapper for pgxs, let's look for a makefile.
+    The tar should contain a single base directory, so return the first
+    dir we found containing a Makefile, alternatively just return the
+    unpacked dir
+    """
+    for dir in os.listdir(destdir):
+        for fn in ('Makefile', 'makefile', 'GNUmakefile', 'configure'):
+            if os.path.exists(os.path.join(destdir, dir, fn)):
+                return os.path.join(destdir, dir)
+
+    return destdir
+
+
+class ArchiveIndex(object):
+    """
+    The cached content of a local archive.
+
+    The index records the archive type and the parsed content of its
+    ``META.json`` file, so that commands run again on the same file don't
+    need to open it again.
+
+    The index is stored in the client cache and is identified by the archive
+    path, size, modification time and inode: it is ignored as soon as the
+    archive file changes.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.data = None
+
+    def get_key(self):
+        st = os.stat(self.filename)
+        return {
+            'path': self.filename,
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'inode': st.st_ino,
+        }
+
+    @classmethod
+    def get_index_dir(self):
+        return get_cache_dir('archives')
+
+    def get_index_filename(self):
+        name = sha1(self.filename.encode('utf8')).hexdigest()
+        return os.path.join(self.get_index_dir(), name + '.json')
+
+    @classmethod
+    def gc(self):
+        """Delete the indexes of archives changed or no more existing.
+
+        Return the list of paths deleted.
+        """
+        dir = self.get_index_dir()
+        rv = sweep_temp_files(dir)
+        for name in os.listdir(dir):
+            if name.startswith(TEMP_PREFIX) or not name.endswith('.json'):
+                continue
+            fn = os.path.join(dir, name)
+            try:
+                with open(fn) as f:
+                    path = load_jsons(f.read())['key']['path']
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                path = None
+
+            if path is None or not ArchiveIndex(path).load():
+                logger.debug("deleting %s", fn)
+                try:
+                    os.unlink(fn)
+                except OSError:
+                    continue
+                rv.append(fn)
+
+        return rv
+
+    def load(self):
+        """Load the index, if valid. Return `!True` if loaded."""
+        try:
+            with open(self.get_index_filename()) as f:
+                data = load_jsons(f.read())
+            key = self.get_key()
+        except (IOError, OSError, ValueError):
+            return False
+
+        if data.get('key') != key:
+            logger.debug("archive index for '%s' is stale", self.filename)
+            return False
+
+        logger.debug("using archive index for '%s'", self.filename)
+        self.data = data
+        return True
+
+    def save(self, data):
+        """Store *data* as the index content."""
+        try:
+            fn = self.get_index_filename()
+            data = dict(data, key=self.get_key())
+            f = tempfile.NamedTemporaryFile(
+                mode='w',
+                prefix=TEMP_PREFIX,
+                dir=os.path.dirname(fn),
+                delete=False,
+            )
+            with f:
+                json.dump(data, f)
+            os.rename(f.name, fn)
+        except (IOError, OSError) as e:
+            # The index is just a cache: no problem if we can't write it
+            logger.debug(
+                "cannot write the index of '%s': %s", self.filename, e
+            )
+        else:
+            self.data = data
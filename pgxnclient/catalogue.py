@@ -0,0 +1,145 @@
+"""
+pgxnclient -- fast lookup of the releases of distributions
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+from bisect import bisect_left, bisect_right
+
+from pgxnclient.spec import Spec
+from pgxnclient.utils.semver import SemVer
+
+
+class VersionIndex(object):
+    """
+    A sorted set of versions supporting search by comparison operators.
+
+    Lookups are binary searches on the versions keys (see `SemVer.key`).
+    """
+
+    def __init__(self, versions=()):
+        byk = {}
+        for v in versions:
+            v = SemVer(v)
+            byk.setdefault(v.key, v)
+
+        self.keys = sorted(byk)
+        self.versions = [byk[k] for k in self.keys]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.versions)
+
+    def find(self, op, ver):
+        """
+        Return the range of the versions *v* satisfying *v* *op* *ver*.
+
+        The range is returned as a pair of indexes (lo, hi), meaning the
+        slice ``versions[lo:hi]``, possibly empty. *op* is one of the
+        `Spec` operators (``==``, ``<``, ``<=``, ``>``, ``>=``), or `!None`
+        to select all the versions.
+        """
+        n = len(self.keys)
+        if op is None:
+            return 0, n
+
+        key = SemVer(ver).key
+        if op == '==':
+            return bisect_left(self.keys, key), bisect_right(self.keys, key)
+        elif op == '<':
+            return 0, bisect_left(self.keys, key)
+        elif op == '<=':
+            return 0, bisect_right(self.keys, key)
+        elif op == '>':
+            return bisect_right(self.keys, key), n
+        elif op == '>=':
+            return bisect_left(self.keys, key), n
+        else:
+            raise ValueError("bad operator: %r" % op)
+
+    def best(self, spec):
+        """Return the highest version accepted by *spec*, or `!None`."""
+        if not spec.constraints:
+            return self.versions and self.versions[-1] or None
+
+        # Look for the highest version in each interval, from the top one
+        keys = self.keys
+        for lo, hi in reversed(spec.range.intervals):
+            if hi is None:
+                ihi = len(keys)
+            elif hi[1]:
+                ihi = bisect_right(keys, hi[0])
+            else:
+                ihi = bisect_left(keys, hi[0])
+
+            if lo is None:
+                ilo = 0
+            elif lo[1]:
+                ilo = bisect_left(keys, lo[0])
+            else:
+                ilo = bisect_right(keys, lo[0])
+
+            if ihi > ilo:
+                return self.versions[ihi - 1]
+
+
+class Catalogue(object):
+    """
+    The releases of a distribution, indexed by release status.
+
+    *releases* is the ``releases`` object of the distribution data returned
+    by the API, mapping each release status to a list of objects with a
+    ``version`` member.
+    """
+
+    def __init__(self, releases):
+        self.indexes = [VersionIndex() for i in range(len(Spec.STATUS))]
+        for status, rels in releases.items():
+            self.indexes[Spec.STATUS[status]] = VersionIndex(
+                r['version'] for r in rels
+            )
+
+    def best_by_status(self, spec):
+        """
+        Return the highest version accepted by *spec* at each status.
+
+        Return a list indexed by status, with `!None` where no version is
+        found.
+        """
+        return [idx.best(spec) for idx in self.indexes]
+
+    def best(self, spec, status=Spec.STABLE):
+        """
+        Return the highest version accepted by *spec* at least at *status*.
+
+        Return `!None` if no such version exists.
+        """
+        vs = [v for v in self.best_by_status(spec)[status:] if v is not None]
+        if vs:
+            return max(vs, key=lambda v: v.key)
+
+
+def best_versions(dists, specs, status=Spec.STABLE):
+    """
+    Return the best version for many specifications.
+
+    *dists* maps the distribution names to the data returned by the API
+    (with a ``releases`` member). Return a list with, for each `Spec` in
+    *specs*, the highest version at least at release *status*, or `!None`
+    if the distribution is unknown or no version satisfies the spec.
+    """
+    catalogues = {}
+    rv = []
+    for spec in specs:
+        if spec.name not in catalogues:
+            data = dists.get(spec.name)
+            catalogues[spec.name] = data and Catalogue(data['releases'])
+
+        cat = catalogues[spec.name]
+        rv.append(cat and cat.best(spec, status))
+
+    return rv
@@ -8,30 +8,43 @@ pgxnclient -- command line entry point
 
 import os
 import sys
+import socket
+import logging
 
-from pgxnclient import find_script
+from pgxnclient import find_script, get_scripts_dirs
 from pgxnclient.i18n import _
 from pgxnclient.utils import emit
 from pgxnclient.errors import PgxnException, UserAbort
+from pgxnclient.commands import COMMANDS
 from pgxnclient.commands import get_option_parser, load_commands, run_command
 
 
-def main(argv=None):
+def main(argv=None, session=None):
     """
     The program main function.
 
     The function is still relatively self contained: it can be called with
     arguments and raises whatever exception, so it's the best entry point
     for whole system testing.
+
+    If *session* is specified, the command shares its state with the other
+    commands run in the same `~pgxnclient.commands.Session`.
     """
     if argv is None:
         argv = sys.argv[1:]
 
-    load_commands()
-    parser = get_option_parser()
+    # Only load the command to run, if known: the entire parser is only
+    # needed to print the general help or to report an error.
+    if argv and argv[0] in COMMANDS:
+        names = [argv[0]]
+    else:
+        names = None
+
+    load_commands(names)
+    parser = get_option_parser(names)
     opt = parser.parse_args(argv)
     if hasattr(opt, 'cmd'):
-        run_command(opt, parser)
+        run_command(opt, parser, session=session)
     else:
         parser.print_help()
 
@@ -40,19 +53,8 @@ def script():
     """
     Execute the program as a script.
 
-    Set up logging, invoke main() using the user-provided arguments and handle
-    any exception raised.
+    The command to run may be implied by the script name (``pgxn-cmd``).
     """
-    # Setup logging
-    import logging
-
-    logging.basicConfig(
-        format="%(levelname)s: %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-        stream=sys.stderr,
-    )
-    logger = logging.getLogger()
-
     # Dispatch to the command according to the script name
     script = sys.argv[0]
     args = sys.argv[1:]
@@ -61,35 +63,69 @@ def script():
         # for help print
         sys.argv[0] = os.path.join(os.path.dirname(script), 'pgxn')
 
-    # Execute the script
+    run_script(args)
+
+
+def run_script(args):
+    """
+    Run main() with arguments *args* as the program script would do.
+
+    Set up logging, invoke main() and handle any exception raised, exiting
+    the process in case of error.
+    """
+    setup_logging()
+    try:
+        rv = run_main(args)
+    except BaseException:
+        # ctrl-c
+        rv = 1
+
+    if rv:
+        sys.exit(rv)
+
+
+def setup_logging():
+    logging.basicConfig(
+        format="%(levelname)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        stream=sys.stderr,
+    )
+
+
+def run_main(args, session=None):
+    """
+    Run main() with arguments *args*, return the exit status.
+
+    Errors are logged instead of being raised. `!KeyboardInterrupt` and other
+    exceptions not subclassing `!Exception` are propagated.
+    """
+    logger = logging.getLogger()
     try:
-        main(args)
+        main(args, session=session)
 
     # Different ways to fail
     except UserAbort as e:
         # The user replied "no" to some question
         logger.info("%s", e)
-        sys.exit(1)
+        return 1
 
     except PgxnException as e:
         # An regular error from the program
         logger.error("%s", e)
-        sys.exit(1)
+        return 1
 
     except SystemExit as e:
         # Usually the arg parser bailing out.
         if isinstance(getattr(e, 'code', None), int):
-            sys.exit(e.code)
+            return e.code
         else:
-            sys.exit(1)
+            return 1
 
     except Exception:
         logger.exception(_("unexpected error"))
-        sys.exit(1)
+        return 1
 
-    except BaseException:
-        # ctrl-c
-        sys.exit(1)
+    return 0
 
 
 def command_dispatch(argv=None):
@@ -98,6 +134,9 @@ def command_dispatch(argv=None):
 
     Upon invocation of a command ``pgxn cmd --arg``, locate pgxn-cmd and
     execute it with --arg arguments.
+
+    The builtin commands, whose scripts would only call `script()`, are run
+    in the current process instead, saving the start of a new interpreter.
     """
     if argv is None:
         argv = sys.argv[1:]
@@ -105,14 +144,19 @@ def command_dispatch(argv=None):
     # Assume the first arg after the option is the command to run
     for icmd, cmd in enumerate(argv):
         if not cmd.startswith('-'):
-            argv = [_get_exec(cmd)] + argv[:icmd] + argv[icmd + 1 :]
+            fn = _get_exec(cmd)
+            args = argv[:icmd] + argv[icmd + 1 :]
+            if cmd in COMMANDS and os.path.dirname(fn) in get_scripts_dirs():
+                rv = _call_server([cmd] + args)
+                if rv is not None:
+                    sys.exit(rv)
+                return run_script([cmd] + args)
+
+            argv = [fn] + args
             break
     else:
-        # No command specified: dispatch to the pgxnclient script
-        # to print basic help, main command etc.
-        argv = [
-            os.path.join(os.path.dirname(sys.argv[0]), 'pgxnclient')
-        ] + argv
+        # No command specified: print basic help, main command etc.
+        return run_script(argv)
 
     if not os.access(argv[0], os.X_OK):
         # This is our friend setuptools' job: the script have lost the
@@ -123,6 +167,34 @@ def command_dispatch(argv=None):
     os.execv(argv[0], argv)
 
 
+def _call_server(args):
+    """
+    Run a command on the server specified by :envvar:`PGXN_SOCKET`, if any.
+
+    Return the command exit status, or `!None` if the command was not run.
+    """
+    path = os.environ.get('PGXN_SOCKET')
+    if not path or args[0] == 'serve':
+        return None
+
+    from pgxnclient import server
+
+    try:
+        return server.call(path, args)
+    except server.ServerError as e:
+        emit(
+            "pgxn: the server at '%s' failed: %s" % (path, e),
+            file=sys.stderr,
+        )
+        return 1
+    except (socket.error, PgxnException) as e:
+        emit(
+            "pgxn: can't use the server at '%s': %s" % (path, e),
+            file=sys.stderr,
+        )
+        return None
+
+
 def _get_exec(cmd):
     fn = find_script('pgxn-' + cmd)
     if not fn:
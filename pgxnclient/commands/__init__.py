@@ -15,6 +15,8 @@ import sys
 import shlex
 import logging
 import argparse
+import operator
+import threading
 from subprocess import Popen, PIPE
 
 import six
@@ -25,10 +27,12 @@ from pgxnclient import __version__
 from pgxnclient import network
 from pgxnclient import Spec, SemVer
 from pgxnclient import archive
-from pgxnclient.api import Api
+from pgxnclient.api import DEFAULT_MIRROR, get_api
+from pgxnclient.catalogue import Catalogue
 from pgxnclient.i18n import _, gettext
 from pgxnclient.errors import (
     BadSpecError,
+    NotCached,
     NotFound,
     PgxnClientException,
     ProcessError,
@@ -39,13 +43,37 @@ from pgxnclient.utils.temp import temp_dir
 
 logger = logging.getLogger('pgxnclient.commands')
 
-
-def get_option_parser():
+_semver_key = operator.attrgetter('key')
+
+
+# The builtin commands, with the name of the module implementing them.
+# Only the modules required to run a command are imported, so keep this
+# mapping in sync with the commands implemented.
+COMMANDS = {
+    'batch': 'batch',
+    'cache': 'cache',
+    'check': 'install',
+    'download': 'install',
+    'fetch': 'install',
+    'help': 'help',
+    'info': 'info',
+    'install': 'install',
+    'load': 'install',
+    'mirror': 'info',
+    'search': 'info',
+    'serve': 'serve',
+    'uninstall': 'install',
+    'unload': 'install',
+}
+
+
+def get_option_parser(names=None):
     """
     Return an option parser populated with the available commands.
 
     The parser is populated with all the options defined by the implemented
-    commands.  Only commands defining a ``name`` attribute are added.
+    commands.  Only commands defining a ``name`` attribute are added. If
+    *names* is specified, only add the subparsers of these commands.
     The function relies on the `Command` subclasses being already
     created: call `load_commands()` before calling this function.
     """
@@ -81,7 +109,11 @@ def get_option_parser():
         ),
     )
 
-    clss = [cls for cls in CommandType.subclasses if cls.name]
+    clss = [
+        cls
+        for cls in CommandType.subclasses
+        if cls.name and (names is None or cls.name in names)
+    ]
     clss.sort(key=lambda c: c.name)
     for cls in clss:
         cls.customize_parser(parser, subparsers)
@@ -89,21 +121,23 @@ def get_option_parser():
     return parser
 
 
-def load_commands():
+def load_commands(names=None):
     """
-    Load all the commands known by the program.
+    Load the commands known by the program.
 
-    Currently commands are read from modules into the `pgxnclient.commands`
-    package.
+    Commands are read from the modules into the `pgxnclient.commands`
+    package listed in `COMMANDS`. If *names* is specified, only import
+    the modules implementing these commands.
 
     Importing the package causes the `Command` classes to be created: they
     register themselves thanks to the `CommandType` metaclass.
     """
-    pkgdir = os.path.dirname(__file__)
-    for fn in os.listdir(pkgdir):
-        if fn.startswith('_'):
-            continue
-        modname = __name__ + '.' + os.path.splitext(fn)[0]
+    if names is None:
+        names = COMMANDS
+
+    modnames = sorted(set(COMMANDS[n] for n in names if n in COMMANDS))
+    for modname in modnames:
+        modname = __name__ + '.' + modname
 
         # skip already imported modules
         if modname in sys.modules:
@@ -120,15 +154,52 @@ def load_commands():
             )
 
 
-def run_command(opts, parser):
-    """Run the command specified by options parsed on the command line."""
+def run_command(opts, parser, session=None):
+    """Run the command specified by options parsed on the command line.
+
+    If *session* is specified, the command uses the state cached there by
+    other commands, instead of starting from scratch.
+    """
     # setup the logging
     logging.getLogger().setLevel(
         opts.verbose and logging.DEBUG or logging.INFO
     )
+    opts.session = session
     return opts.cmd(opts, parser=parser).run()
 
 
+def positive_int(s):
+    """Parse a command line argument as a positive integer."""
+    try:
+        rv = int(s)
+    except ValueError:
+        rv = 0
+    if rv < 1:
+        raise argparse.ArgumentTypeError(_("not a positive integer: '%s'") % s)
+    return rv
+
+
+class Session(object):
+    """
+    State shared by many commands run in the same process.
+
+    Commands run in the same session use the same `Api` objects, so the API
+    index and other data fetched from the network are only downloaded once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._apis = {}
+
+    def get_api(self, mirror, offline=False):
+        """Return the `Api` object to talk to *mirror*, or to work offline."""
+        key = (mirror, offline)
+        with self._lock:
+            if key not in self._apis:
+                self._apis[key] = get_api(mirror, offline=offline)
+            return self._apis[key]
+
+
 class CommandType(type):
     """
     Metaclass for the Command class.
@@ -218,8 +289,20 @@ class Command(six.with_metaclass(CommandType, object)):
         glb.add_argument(
             "--mirror",
             metavar="URL",
-            default='https://api.pgxn.org/',
-            help=_("the mirror to interact with [default: %(default)s]"),
+            default=DEFAULT_MIRROR,
+            help=_(
+                "the mirror to interact with, or 'auto' to use the fastest"
+                " one [default: %(default)s]"
+            ),
+        )
+        glb.add_argument(
+            "--offline",
+            action='store_true',
+            default=os.environ.get('PGXN_OFFLINE', '') not in ('', '0'),
+            help=_(
+                "only use the data in the local cache, without accessing the"
+                " network [default: true if $PGXN_OFFLINE is set]"
+            ),
         )
         glb.add_argument(
             "--verbose", action='store_true', help=_("print more information")
@@ -236,13 +319,24 @@ class Command(six.with_metaclass(CommandType, object)):
     def api(self):
         """Return an `Api` instance to communicate with PGXN.
 
-        Use the value provided with ``--mirror`` to decide where to connect.
+        Use the value provided with ``--mirror`` to decide where to connect,
+        or only use the local cache with ``--offline``.
         """
         if self._api is None:
-            self._api = Api(mirror=self.opts.mirror)
+            offline = self.opts.offline
+            session = getattr(self.opts, 'session', None)
+            if session is not None:
+                self._api = session.get_api(self.opts.mirror, offline)
+            else:
+                self._api = get_api(self.opts.mirror, offline)
 
         return self._api
 
+    def check_online(self):
+        """Raise `NotCached` if the command is running with ``--offline``."""
+        if self.opts.offline:
+            raise NotCached(_("cannot access the network in offline mode"))
+
     def confirm(self, prompt):
         """Prompt an user confirmation.
 
@@ -254,7 +348,11 @@ class Command(six.with_metaclass(CommandType, object)):
             return True
 
         while 1:
-            ans = six.moves.input(_("%s [y/N] ") % prompt)
+            try:
+                ans = six.moves.input(_("%s [y/N] ") % prompt)
+            except EOFError:
+                # no terminal to reply from
+                raise UserAbort(_("operation interrupted on user request"))
             if _('no').startswith(ans.lower()):
                 raise UserAbort(_("operation interrupted on user request"))
             elif _('yes').startswith(ans.lower()):
@@ -288,13 +386,20 @@ class WithSpec(Command):
 
     @classmethod
     def customize_parser(
-        self, parser, subparsers, with_status=True, epilog=None, **kwargs
+        self,
+        parser,
+        subparsers,
+        with_status=True,
+        spec_nargs=None,
+        epilog=None,
+        **kwargs
     ):
         """
         Add the SPEC related options to the parser.
 
         If *with_status* is true, options ``--stable``, ``--testing``,
-        ``--unstable`` are also handled.
+        ``--unstable`` are also handled. *spec_nargs* is the number of SPEC
+        arguments accepted, as in `!argparse`, by default exactly one.
         """
         epilog = (
             _(
@@ -313,6 +418,7 @@ indications, for instance 'pkgname=1.0', or 'pkgname>=2.1'.
         subp.add_argument(
             'spec',
             metavar='SPEC',
+            nargs=spec_nargs,
             help=_("name and optional version of the package"),
         )
 
@@ -377,15 +483,8 @@ indications, for instance 'pkgname=1.0', or 'pkgname>=2.1'.
         Raise `ResourceNotFound` if no version is found with the provided
         specification and options.
         """
-        drels = data['releases']
-
         # Get the maximum version for each release status satisfying the spec
-        vers = [None] * len(Spec.STATUS)
-        for n, d in drels.items():
-            vs = list(filter(spec.accepted, [SemVer(r['version']) for r in d]))
-            if vs:
-                vers[Spec.STATUS[n]] = max(vs)
-
+        vers = Catalogue(data['releases']).best_by_status(spec)
         return self._get_best_version(vers, spec, quiet)
 
     def get_best_version_from_ext(self, data, spec):
@@ -407,7 +506,7 @@ indications, for instance 'pkgname=1.0', or 'pkgname>=2.1'.
 
         # for each rel status only take the max one.
         for i in range(len(vers)):
-            vers[i] = vers[i] and max(vers[i]) or None
+            vers[i] = vers[i] and max(vers[i], key=_semver_key) or None
 
         ev = self._get_best_version(vers, spec, quiet=False)
         return vmap[ev]
@@ -420,7 +519,7 @@ indications, for instance 'pkgname=1.0', or 'pkgname>=2.1'.
             if lvl >= self.opts.status and v is not None
         ]
         if want:
-            ver = max(want)
+            ver = max(want, key=_semver_key)
             if not quiet:
                 logger.info(_("best version: %s %s"), spec.name, ver)
             return ver
@@ -475,6 +574,7 @@ indications, for instance 'pkgname=1.0', or 'pkgname>=2.1'.
             return arc.get_meta()
 
         elif spec.is_url():
+            self.check_online()
             with network.get_file(spec.url) as fin:
                 with temp_dir() as dir:
                     fn = network.download(fin, dir)
@@ -541,6 +641,44 @@ SPEC may also be an url specifying a protocol such as 'http://' or 'https://'.
         return super(WithSpecUrl, self).get_spec(**kwargs)
 
 
+class WithHedging(object):
+    """
+    Mixin to implement commands downloading distributions from many mirrors.
+    """
+
+    @classmethod
+    def customize_parser(self, parser, subparsers, **kwargs):
+        """
+        Add the ``--hedge-after`` and ``--hedge-rate`` options.
+        """
+        subp = super(WithHedging, self).customize_parser(
+            parser, subparsers, **kwargs
+        )
+
+        subp.add_argument(
+            '--hedge-after',
+            metavar='SECS',
+            type=float,
+            help=_(
+                "if a download is slow after SECS seconds, start downloading"
+                " from another mirror too, keeping the first finished."
+                " Only useful with --mirror auto"
+            ),
+        )
+        subp.add_argument(
+            '--hedge-rate',
+            metavar='KBPS',
+            type=float,
+            default=100,
+            help=_(
+                "the rate, in KB/s, below which a download is slow"
+                " [default: %(default)s]"
+            ),
+        )
+
+        return subp
+
+
 class WithPgConfig(object):
     """
     Mixin to implement commands that should query :program:`pg_config`.
@@ -570,12 +708,15 @@ class WithPgConfig(object):
     def call_pg_config(self, what, _cache={}):
         """
         Call :program:`pg_config` and return its output.
+
+        The results are cached for the whole process, by executable.
         """
-        if what in _cache:
-            return _cache[what]
+        pg_config = self.get_pg_config()
+        if (pg_config, what) in _cache:
+            return _cache[pg_config, what]
 
         logger.debug("running pg_config --%s", what)
-        cmdline = [self.get_pg_config(), "--%s" % what]
+        cmdline = [pg_config, "--%s" % what]
         p = self.popen(cmdline, stdout=PIPE)
         out, err = p.communicate()
         if p.returncode:
@@ -584,7 +725,7 @@ class WithPgConfig(object):
             )
 
         out = out.rstrip().decode('utf-8')
-        rv = _cache[what] = out
+        rv = _cache[pg_config, what] = out
         return rv
 
     def get_pg_config(self):
@@ -668,14 +809,16 @@ class WithMake(WithPgConfig):
                 % (p.returncode, ' '.join(cmdline))
             )
 
-    def get_make(self, _cache=[]):
+    _make = None
+
+    def get_make(self):
         """
         Return the path of the make binary.
         """
-        # the cache is not for performance but to return a consistent value
-        # even if the cwd is changed
-        if _cache:
-            return _cache[0]
+        # the value is stored not for performance but to return a consistent
+        # value even if the cwd is changed
+        if self._make is not None:
+            return self._make
 
         make = self.opts.make
 
@@ -698,7 +841,7 @@ class WithMake(WithPgConfig):
                     _("make executable not found: %s") % make
                 )
 
-        _cache.append(make)
+        self._make = make
         return make
 
     @classmethod
@@ -0,0 +1,126 @@
+"""
+pgxnclient -- batch command implementation
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+import sys
+import shlex
+import logging
+from multiprocessing.pool import ThreadPool
+
+from pgxnclient.i18n import _, N_
+from pgxnclient.errors import PgxnClientException
+from pgxnclient.commands import Command, Session
+
+logger = logging.getLogger('pgxnclient.commands')
+
+
+class Batch(Command):
+    name = 'batch'
+    description = N_("run many commands read from a file")
+
+    @classmethod
+    def customize_parser(self, parser, subparsers, **kwargs):
+        subp = super(Batch, self).customize_parser(
+            parser, subparsers, **kwargs
+        )
+
+        subp.add_argument(
+            '--parallel',
+            metavar='N',
+            type=int,
+            default=1,
+            help=_(
+                "run up to N commands at the same time: only use it if the"
+                " commands are independent [default: %(default)s]"
+            ),
+        )
+        subp.add_argument(
+            'filename',
+            metavar='FILE',
+            help=_(
+                "the file containing the commands to run, one per line,"
+                " or '-' to read from stdin"
+            ),
+        )
+
+        return subp
+
+    def run(self):
+        cmds = self.read_commands()
+        session = self.opts.session
+        if session is None:
+            session = Session()
+
+        def run_one(cmd):
+            from pgxnclient.cli import run_main
+
+            lineno, args = cmd
+            logger.debug("running line %s: %s", lineno, args)
+            return run_main(args, session=session)
+
+        if self.opts.parallel > 1:
+            pool = ThreadPool(self.opts.parallel)
+            try:
+                rvs = pool.map(run_one, cmds, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            rvs = list(map(run_one, cmds))
+
+        nerr = 0
+        for (lineno, args), rv in zip(cmds, rvs):
+            if rv:
+                logger.error(
+                    _("line %s failed with status %s: %s"),
+                    lineno,
+                    rv,
+                    ' '.join(args),
+                )
+                nerr += 1
+
+        if nerr:
+            raise PgxnClientException(
+                _("%d of %d commands failed") % (nerr, len(cmds))
+            )
+
+    def read_commands(self):
+        """
+        Return the commands to run as a list of (line number, args).
+
+        Empty lines and lines starting with ``#`` are skipped.
+        """
+        fn = self.opts.filename
+        if fn == '-':
+            lines = sys.stdin.readlines()
+        else:
+            try:
+                with open(fn) as f:
+                    lines = f.readlines()
+            except (IOError, OSError) as e:
+                raise PgxnClientException(
+                    _("cannot read commands file: %s") % e
+                )
+
+        rv = []
+        for lineno, line in enumerate(lines, 1):
+            try:
+                args = shlex.split(line, comments=True)
+            except ValueError as e:
+                raise PgxnClientException(
+                    _("error parsing line %s: %s") % (lineno, e)
+                )
+            if not args:
+                continue
+            if args[0] in ('batch', 'serve'):
+                raise PgxnClientException(
+                    _("command '%s' not allowed at line %s")
+                    % (args[0], lineno)
+                )
+            rv.append((lineno, args))
+
+        return rv
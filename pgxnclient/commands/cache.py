@@ -0,0 +1,70 @@
+"""
+pgxnclient -- local cache management commands
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+import os
+import shutil
+import logging
+
+from pgxnclient.i18n import _, N_
+from pgxnclient.store import ArchiveStore, TreeStore
+from pgxnclient.archive import ArchiveIndex
+from pgxnclient.commands import Command
+from pgxnclient.utils.temp import sweep_trash, get_scratch_roots
+from pgxnclient.utils.cache import get_cache_dir
+
+logger = logging.getLogger('pgxnclient.commands')
+
+
+class Cache(Command):
+    name = 'cache'
+    description = N_("manage the local cache")
+
+    @classmethod
+    def customize_parser(self, parser, subparsers, **kwargs):
+        subp = super(Cache, self).customize_parser(
+            parser, subparsers, **kwargs
+        )
+
+        subp.add_argument(
+            'action',
+            metavar='ACTION',
+            choices=('gc', 'clear'),
+            help=_(
+                "the operation to perform: 'gc' deletes the files left by"
+                " interrupted or background operations, 'clear' deletes the"
+                " entire cache content"
+            ),
+        )
+
+        return subp
+
+    def run(self):
+        return getattr(self, 'run_' + self.opts.action)()
+
+    def run_gc(self):
+        deleted = []
+        for root in get_scratch_roots():
+            deleted.extend(sweep_trash(root))
+        deleted.extend(TreeStore().gc())
+        deleted.extend(ArchiveStore().gc())
+        deleted.extend(ArchiveIndex.gc())
+
+        for fn in deleted:
+            logger.debug(_("deleted %s"), fn)
+        logger.info(_("%d items deleted"), len(deleted))
+
+    def run_clear(self):
+        dir = get_cache_dir()
+        self.confirm(_("Delete the content of the directory %s?") % dir)
+        logger.info(_("clearing %s"), dir)
+        for name in os.listdir(dir):
+            fn = os.path.join(dir, name)
+            if os.path.isdir(fn) and not os.path.islink(fn):
+                shutil.rmtree(fn, ignore_errors=True)
+            else:
+                os.unlink(fn)
@@ -11,7 +11,7 @@ import os
 from pgxnclient import get_scripts_dirs, get_public_scripts_dir
 from pgxnclient.i18n import _, N_
 from pgxnclient.utils import emit
-from pgxnclient.commands import Command
+from pgxnclient.commands import Command, get_option_parser, load_commands
 
 
 class Help(Command):
@@ -40,9 +40,6 @@ class Help(Command):
             help=_("the command to get help about"),
         )
 
-        # To print the basic help
-        self._parser = parser
-
         return subp
 
     def run(self):
@@ -55,7 +52,12 @@ class Help(Command):
         elif self.opts.libexec:
             self.print_libexec()
         else:
-            self._parser.print_help()
+            self.print_help()
+
+    def print_help(self):
+        # The parser we were invoked by only knows about this command
+        load_commands()
+        get_option_parser().print_help()
 
     def print_all_commands(self):
         cmds = self.find_all_commands()
@@ -6,6 +6,7 @@ pgxnclient -- informative commands implementation
 
 # This file is part of the PGXN client
 
+import os
 import re
 import logging
 import textwrap
@@ -38,18 +39,64 @@ class Mirror(Command):
             metavar="URI",
             help=_(
                 "return detailed info about this mirror."
-                " If not specified return a list of mirror URIs"
+                " If not specified return a list of mirror URIs."
+                " If 'sync', copy the mirror into DIR."
+                " If 'serve', serve the local mirror DIR over HTTP"
             ),
         )
+        subp.add_argument(
+            'dest',
+            nargs='?',
+            metavar="DIR",
+            help=_("the directory of the local mirror"),
+        )
         subp.add_argument(
             '--detailed',
             action="store_true",
             help=_("return full details for each mirror"),
         )
+        subp.add_argument(
+            '--parallel',
+            metavar='N',
+            type=int,
+            default=4,
+            help=_(
+                "download up to N files at the same time in sync"
+                " [default: %(default)s]"
+            ),
+        )
+        subp.add_argument(
+            '--bind',
+            metavar='ADDR',
+            default='localhost',
+            help=_("the address to serve on [default: %(default)s]"),
+        )
+        subp.add_argument(
+            '--port',
+            metavar='PORT',
+            type=int,
+            default=8000,
+            help=_("the port to serve on [default: %(default)s]"),
+        )
+        subp.add_argument(
+            '--pull-through',
+            action='store_true',
+            help=_(
+                "in serve, download the files missing in DIR from the mirror"
+                " specified by --mirror"
+            ),
+        )
 
         return subp
 
     def run(self):
+        if self.opts.uri == 'sync':
+            return self.run_sync()
+        elif self.opts.uri == 'serve':
+            return self.run_serve()
+        elif self.opts.dest:
+            self.parser.error(_("unexpected argument: %s") % self.opts.dest)
+
         data = self.api.mirrors()
         if self.opts.uri:
             detailed = True
@@ -73,6 +120,48 @@ class Mirror(Command):
 
                 emit()
 
+    def run_sync(self):
+        from pgxnclient.mirror import MirrorSync
+
+        if not self.opts.dest:
+            self.parser.error(_("no target directory specified"))
+
+        sync = MirrorSync(self.api, self.opts.dest, self.opts.parallel)
+        stats = sync.sync()
+        logger.info(
+            _("mirror synced: %d files written, %d unchanged"),
+            stats['written'],
+            stats['unchanged'],
+        )
+
+    def run_serve(self):
+        from pgxnclient.mirror import MirrorServer
+
+        if not self.opts.dest:
+            self.parser.error(_("no mirror directory specified"))
+        if not os.path.isdir(self.opts.dest):
+            raise ResourceNotFound(
+                _("mirror directory not found: %s") % self.opts.dest
+            )
+
+        server = MirrorServer(
+            (self.opts.bind, self.opts.port),
+            self.opts.dest,
+            upstream=self.opts.pull_through and self.api.mirror or None,
+        )
+        logger.info(
+            _("serving %s on http://%s:%s/"),
+            self.opts.dest,
+            self.opts.bind,
+            server.server_address[1],
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info(_("server stopped"))
+        finally:
+            server.server_close()
+
 
 class Search(Command):
     name = 'search'
@@ -108,13 +197,36 @@ class Search(Command):
             help=_("search in extensions"),
         )
         subp.add_argument(
-            'query', metavar='TERM', nargs='+', help=_("a string to search")
+            '--update-index',
+            metavar='DIR',
+            help=_(
+                "add the new releases found in the local mirror DIR to the"
+                " local index"
+            ),
+        )
+        subp.add_argument(
+            'query', metavar='TERM', nargs='*', help=_("a string to search")
         )
 
         return subp
 
     def run(self):
-        data = self.api.search(self.opts.where, self.opts.query)
+        if self.opts.update_index:
+            n = self.get_search_index().update(self.opts.update_index)
+            logger.info(_("%d distributions indexed"), n)
+            if not self.opts.query:
+                return
+
+        if not self.opts.query:
+            self.parser.error(_("no search term specified"))
+
+        # The server is not available offline: use the local index instead
+        if self.opts.offline:
+            data = self.get_search_index().search(
+                self.opts.where, self.opts.query
+            )
+        else:
+            data = self.api.search(self.opts.where, self.opts.query)
 
         for hit in data['hits']:
             emit("%s %s" % (hit['dist'], hit['version']))
@@ -125,6 +237,11 @@ class Search(Command):
                     emit("    " + line)
                 emit()
 
+    def get_search_index(self):
+        from pgxnclient.search import SearchIndex
+
+        return SearchIndex()
+
     def clean_excerpt(self, excerpt):
         """Clean up the excerpt returned in the json result for output."""
         # replace ellipsis with three dots, as there's no chance
@@ -248,7 +365,7 @@ class Info(WithSpec, Command):
             for d in ds
         ]
         vs = [(v, s) for v, s in vs if spec.accepted(v)]
-        vs.sort(reverse=True)
+        vs.sort(key=lambda vs: (vs[0].key, vs[1]), reverse=True)
         for v, s in vs:
             emit("%s %s %s" % (name, v, s))
 
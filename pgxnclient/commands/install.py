@@ -8,33 +8,42 @@ pgxnclient -- installation/loading commands implementation
 
 import os
 import re
+import sys
 import shutil
 import difflib
 import logging
 import tempfile
 from subprocess import PIPE
+from multiprocessing.pool import ThreadPool
 
 import six
 
-from pgxnclient import SemVer
+from pgxnclient import Spec, SemVer
 from pgxnclient import archive
 from pgxnclient import network
 from pgxnclient.i18n import _, N_
-from pgxnclient.utils import sha1
+from pgxnclient.utils import file_sha1
 from pgxnclient.errors import (
     BadChecksum,
+    BadSpecError,
+    NotCached,
+    PgxnException,
     PgxnClientException,
     InsufficientPrivileges,
+    ResourceNotFound,
 )
-from pgxnclient.commands import Command, WithDatabase, WithMake, WithPgConfig
+from pgxnclient.commands import Command, Session
+from pgxnclient.commands import WithDatabase, WithMake, WithPgConfig
 from pgxnclient.commands import WithSpecUrl, WithSpecLocal, WithSudo
-from pgxnclient.utils.temp import temp_dir
+from pgxnclient.commands import WithHedging, WithSpec, positive_int
+from pgxnclient.store import ArchiveStore, TreeStore
+from pgxnclient.utils.temp import temp_dir, get_scratch_root, PROCESS, SYNC
 from pgxnclient.utils.strings import Identifier
 
 logger = logging.getLogger('pgxnclient.commands')
 
 
-class Download(WithSpecUrl, Command):
+class Download(WithHedging, WithSpecUrl, Command):
     name = 'download'
     description = N_("download a distribution from the network")
 
@@ -60,7 +69,17 @@ class Download(WithSpecUrl, Command):
             return self._run_url(spec)
 
         data = self.get_meta(spec)
+        return self.download_dist(data)
 
+    def download_dist(self, data, target=None):
+        """Download the distribution described by the META *data*.
+
+        Save it into *target*, by default the ``--target`` option value.
+
+        Return the name of the file saved, after verifying its checksum. The
+        archive is copied from the `ArchiveStore` if available, otherwise it
+        is downloaded and added to the store.
+        """
         try:
             chk = data['sha1']
         except KeyError:
@@ -68,13 +87,48 @@ class Download(WithSpecUrl, Command):
                 "sha1 missing from the distribution meta"
             )
 
-        with self.api.download(data['name'], SemVer(data['version'])) as fin:
-            fn = network.download(fin, self.opts.target)
+        if target is None:
+            target = self.opts.target
+
+        name, version = data['name'], SemVer(data['version'])
+        store = ArchiveStore()
+        if store.has(chk):
+            fn = target
+            if os.path.isdir(fn):
+                fn = os.path.join(fn, self.api.download_name(name, version))
+            return store.materialize(chk, network.get_unique_file_name(fn))
+        elif self.opts.offline:
+            raise NotCached(
+                _("archive of %s %s not found in the local cache")
+                % (name, version)
+            )
+
+        fn = self._download_dist(name, version, chk, target)
+        store.add(chk, fn)
+        return fn
+
+    def _download_dist(self, name, version, chk, target):
+        urls = ()
+        if self.opts.hedge_after:
+            urls = self.api.download_urls(name, version)
+        if len(urls) > 1:
+            # the checksum is verified on download
+            return network.download_hedged(
+                urls,
+                target,
+                chk,
+                after=self.opts.hedge_after,
+                min_rate=self.opts.hedge_rate * 1024,
+            )
+
+        with self.api.download(name, version) as fin:
+            fn = network.download(fin, target)
 
         self.verify_checksum(fn, chk)
         return fn
 
     def _run_url(self, spec):
+        self.check_online()
         with network.get_file(spec.url) as fin:
             fn = network.download(fin, self.opts.target)
 
@@ -82,51 +136,282 @@ class Download(WithSpecUrl, Command):
 
     def verify_checksum(self, fn, chk):
         """Verify that a downloaded file has the expected sha1."""
-        sha = sha1()
         logger.debug(_("checking sha1 of '%s'"), fn)
-        f = open(fn, "rb")
-        try:
-            while 1:
-                data = f.read(8192)
-                if not data:
-                    break
-                sha.update(data)
-        finally:
-            f.close()
-
-        sha = sha.hexdigest()
+        sha = file_sha1(fn)
         if sha != chk:
             os.unlink(fn)
             logger.error(_("file %s has sha1 %s instead of %s"), fn, sha, chk)
             raise BadChecksum(_("bad sha1 in downloaded file"))
 
 
-class InstallUninstall(WithMake, WithSpecUrl, WithSpecLocal, Command):
+class Fetch(WithHedging, WithSpec, Command):
+    name = 'fetch'
+    description = N_("download distributions into the local cache")
+
+    @classmethod
+    def customize_parser(self, parser, subparsers, **kwargs):
+        subp = super(Fetch, self).customize_parser(
+            parser, subparsers, spec_nargs='*', **kwargs
+        )
+        subp.add_argument(
+            '-r',
+            '--requirements',
+            metavar='FILE',
+            action='append',
+            default=[],
+            help=_(
+                "fetch the packages listed in FILE, one SPEC per line, or"
+                " read from stdin if '-'. Can be specified more than once"
+            ),
+        )
+        subp.add_argument(
+            '--parallel',
+            metavar='N',
+            type=positive_int,
+            default=4,
+            help=_(
+                "fetch up to N packages at the same time"
+                " [default: %(default)s]"
+            ),
+        )
+
+        return subp
+
+    def run(self):
+        self.check_online()
+        specs = self.get_specs()
+        if not specs:
+            self.parser.error(_("no package specified"))
+
+        # Share the Api with the Download commands fetching the archives
+        if getattr(self.opts, 'session', None) is None:
+            self.opts.session = Session()
+
+        # Get all the distributions data in a few round trips
+        self.api.prefetch([(s.name, '') for s in specs], self.opts.parallel)
+
+        pool = ThreadPool(min(len(specs), self.opts.parallel))
+        try:
+            rvs = pool.map(self.fetch_spec, specs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        nerr = rvs.count(False)
+        if nerr:
+            raise PgxnClientException(
+                _("%d of %d packages failed") % (nerr, len(specs))
+            )
+
+    def fetch_spec(self, spec):
+        """
+        Store the META, README and archive of *spec* in the local cache.
+
+        Return `!False` in case of error.
+        """
+        try:
+            data = self.get_meta(spec)
+            name, version = data['name'], SemVer(data['version'])
+            try:
+                self.api.readme(name, version)
+            except ResourceNotFound:
+                logger.debug("%s %s has no readme", name, version)
+
+            chk = data.get('sha1')
+            if not chk:
+                raise PgxnClientException(
+                    _("sha1 missing from the distribution meta")
+                )
+            if not ArchiveStore().has(chk):
+                with temp_dir() as dir:
+                    Download(self.opts).download_dist(data, target=dir)
+        except (PgxnException, EnvironmentError) as e:
+            logger.error(_("cannot fetch %s: %s"), spec, e)
+            return False
+
+        logger.info(_("fetched %s %s"), name, version)
+        return True
+
+    def get_specs(self):
+        """
+        Return the `Spec` objects of the packages to fetch.
+
+        The packages are the ones on the command line followed by the ones
+        in the requirements files. Empty lines and lines starting with ``#``
+        in the files are skipped.
+        """
+        rv = [self.parse_spec(s) for s in self.opts.spec]
+        for fn in self.opts.requirements:
+            for lineno, line in enumerate(self.read_requirements(fn), 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                try:
+                    rv.append(self.parse_spec(line))
+                except PgxnClientException as e:
+                    raise PgxnClientException(
+                        _("error at line %s of %s: %s") % (lineno, fn, e)
+                    )
+
+        return rv
+
+    def read_requirements(self, fn):
+        if fn == '-':
+            return sys.stdin.readlines()
+
+        try:
+            with open(fn) as f:
+                return f.readlines()
+        except (IOError, OSError) as e:
+            raise PgxnClientException(
+                _("cannot read requirements file: %s") % e
+            )
+
+    def parse_spec(self, spec):
+        try:
+            rv = Spec.parse(spec)
+        except (ValueError, BadSpecError) as e:
+            raise PgxnClientException(
+                _("cannot parse package '%s': %s") % (spec, e)
+            )
+
+        if not rv.is_name():
+            raise PgxnClientException(
+                _("only distributions on PGXN can be fetched: %s") % spec
+            )
+
+        return rv
+
+
+class InstallUninstall(
+    WithMake, WithHedging, WithSpecUrl, WithSpecLocal, Command
+):
     """
     Base class to implement the ``install`` and ``uninstall`` commands.
     """
 
+    @classmethod
+    def customize_parser(self, parser, subparsers, **kwargs):
+        subp = super(InstallUninstall, self).customize_parser(
+            parser, subparsers, **kwargs
+        )
+
+        subp.add_argument(
+            '--async-cleanup',
+            action='store_true',
+            help=_(
+                "delete the build directory in background, without waiting"
+                " for it"
+            ),
+        )
+        subp.add_argument(
+            '--workdir',
+            metavar='DIR',
+            default=os.environ.get('PGXN_WORKDIR'),
+            help=_(
+                "build the distribution into DIR [default: $PGXN_WORKDIR or"
+                " a RAM-backed filesystem if large enough, else the"
+                " system temp dir]"
+            ),
+        )
+
+        return subp
+
     def run(self):
-        with temp_dir() as dir:
+        with self.temp_dir() as dir:
             return self._run(dir)
 
+    def temp_dir(self, root=None):
+        """Return a context manager creating a temp dir into *root*."""
+        cleanup = self.opts.async_cleanup and PROCESS or SYNC
+        return temp_dir(cleanup=cleanup, dir=root)
+
     def _run(self, dir):
         spec = self.get_spec()
         if spec.is_dir():
-            pdir = os.path.abspath(spec.dirname)
-        elif spec.is_file():
-            pdir = archive.from_file(spec.filename).unpack(dir)
-        elif not spec.is_local():
+            return self._build(os.path.abspath(spec.dirname))
+
+        chk = None
+        if spec.is_file():
+            fn = spec.filename
+        elif spec.is_url():
             self.opts.target = dir
             fn = Download(self.opts).run()
-            pdir = archive.from_file(fn).unpack(dir)
+        elif spec.is_name():
+            # If the tree is already known we can skip the download
+            data = self.get_meta(spec)
+            chk = data.get('sha1')
+            store = self.get_tree_store()
+            if chk and store is not None and store.has(chk):
+                fn = None
+            else:
+                self.opts.target = dir
+                fn = Download(self.opts).download_dist(data)
         else:
             assert False
 
-        self.maybe_run_configure(pdir)
+        with self.temp_dir(self.get_build_root(fn, chk)) as bdir:
+            pdir = self.unpack(fn, bdir, chk=chk)
+            return self._build(pdir)
 
+    def _build(self, pdir):
+        self.maybe_run_configure(pdir)
         self._inun(pdir)
 
+    def get_build_root(self, fn, chk=None):
+        """
+        Return the directory where to build the archive *fn*.
+
+        Use the directory specified by ``--workdir`` if any, otherwise a
+        RAM-backed filesystem if the unpacked archive is small enough to be
+        built there. `!None` means the system temp directory.
+        """
+        if self.opts.workdir:
+            return self.opts.workdir
+
+        store = self.get_tree_store()
+        if chk and store is not None and store.has(chk):
+            size = store.get_size(chk)
+        else:
+            try:
+                size = archive.from_file(fn).get_unpacked_size()
+            except PgxnClientException as e:
+                logger.debug("can't tell the archive size: %s", e)
+                size = None
+
+        return get_scratch_root(size)
+
+    def unpack(self, fn, dir, chk=None):
+        """
+        Unpack the archive *fn* into *dir*, return the work directory.
+
+        The unpacked tree is stored in the `TreeStore` so that other commands
+        working on the same archive (identified by its sha1 *chk*) can reuse
+        it instead of unpacking it again.
+        """
+        store = self.get_tree_store()
+        if store is None:
+            return archive.from_file(fn).unpack(dir)
+
+        if chk is None:
+            chk = file_sha1(fn)
+
+        if store.has(chk):
+            store.materialize(chk, dir)
+            return archive.find_work_directory(dir)
+
+        pdir = archive.from_file(fn).unpack(dir)
+        store.add(chk, dir)
+        return pdir
+
+    def get_tree_store(self):
+        """Return the `TreeStore`, `!None` if the cache is not available."""
+        try:
+            return TreeStore()
+        except OSError as e:
+            # The store is only an optimization: work without it
+            logger.debug(_("cannot use the tree store: %s"), e)
+
     def _inun(self, pdir):
         """Run the specific command, implemented in the subclass."""
         raise NotImplementedError
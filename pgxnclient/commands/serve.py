@@ -0,0 +1,51 @@
+"""
+pgxnclient -- command server implementation
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+import logging
+
+from pgxnclient.i18n import _, N_
+from pgxnclient.server import Server
+from pgxnclient.commands import Command, Session
+
+logger = logging.getLogger('pgxnclient.commands')
+
+
+class Serve(Command):
+    name = 'serve'
+    description = N_("run commands on behalf of other pgxn processes")
+
+    @classmethod
+    def customize_parser(self, parser, subparsers, **kwargs):
+        subp = super(Serve, self).customize_parser(
+            parser, subparsers, **kwargs
+        )
+
+        subp.add_argument(
+            '--socket',
+            metavar='PATH',
+            required=True,
+            help=_(
+                "the Unix socket to listen on. Setting the PGXN_SOCKET"
+                " environment variable to PATH, other pgxn invocations will"
+                " run their command in the server"
+            ),
+        )
+
+        return subp
+
+    def run(self):
+        session = self.opts.session
+        if session is None:
+            session = Session()
+
+        server = Server(self.opts.socket, session=session)
+        server.bind()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info(_("server stopped"))
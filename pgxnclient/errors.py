@@ -39,6 +39,10 @@ class NotFound(PgxnException):
     """Something requested by the user not found on PGXN"""
 
 
+class NotCached(NotFound):
+    """Something requested in offline mode not found in the local cache."""
+
+
 class NetworkError(PgxnClientException):
     """An error from the other side of the wire."""
 
@@ -0,0 +1,479 @@
+"""
+pgxnclient -- local copy of a PGXN mirror and its server
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+import os
+import re
+import stat
+import time
+import shutil
+import string
+import logging
+import tempfile
+import mimetypes
+import threading
+from io import BytesIO
+from gzip import GzipFile
+from multiprocessing.pool import ThreadPool
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from six.moves.urllib.parse import quote, unquote, urljoin, urlsplit
+
+from pgxnclient import __version__, network
+from pgxnclient.i18n import _
+from pgxnclient.utils import sha1, file_sha1, load_jsons
+from pgxnclient.errors import (
+    PgxnException,
+    PgxnClientException,
+    BadChecksum,
+    ResourceNotFound,
+)
+from pgxnclient.utils.uri import expand_template
+from pgxnclient.utils.cache import TEMP_PREFIX
+from pgxnclient.utils.semver import SemVer
+
+logger = logging.getLogger('pgxnclient.mirror')
+
+
+class MirrorSync(object):
+    """
+    Create or update a complete local copy of a PGXN mirror.
+
+    The files are downloaded from the mirror of the `Api` *api* and saved in
+    the directory *dest* using the layout of the API URL templates, so that
+    the directory can be used as mirror using a ``file://`` URL or served by
+    any static HTTP server.
+
+    The files of a release (META, README, archive) never change, so they are
+    not downloaded again if already present: an interrupted sync can be
+    resumed running it again. The other files are downloaded again but only
+    written if their content changed. All the files are written atomically.
+    """
+
+    def __init__(self, api, dest, parallel=4):
+        self.api = api
+        self.dest = os.path.abspath(dest)
+        self.parallel = parallel
+
+        self._lock = threading.Lock()
+        self.stats = {'written': 0, 'unchanged': 0, 'failed': 0}
+
+    def sync(self):
+        """Sync the mirror. Return a dict with the number of files synced."""
+        self.sync_index()
+
+        users = set()
+        for data in self.map(self.sync_userlist, string.ascii_lowercase):
+            users.update(u['user'] for u in data or ())
+
+        dists = set()
+        for data in self.map(self.sync_user, sorted(users)):
+            dists.update(data and data.get('releases') or ())
+
+        releases = []
+        for data in self.map(self.sync_dist, sorted(dists)):
+            for rels in (data and data.get('releases') or {}).values():
+                releases.extend((data['name'], r['version']) for r in rels)
+
+        exts = set()
+        for data in self.map(self.sync_release, releases):
+            exts.update(data and data.get('provides') or ())
+
+        self.map(self.sync_extension, sorted(exts))
+
+        if self.stats['failed']:
+            raise PgxnClientException(
+                _("%d files failed to sync") % self.stats['failed']
+            )
+
+        return self.stats
+
+    def map(self, f, items):
+        """
+        Call *f* on all the *items*, in parallel.
+
+        Return the list of results, with `!None` for the failed calls.
+        """
+
+        def call(item):
+            try:
+                return f(item)
+            except (PgxnException, IOError, OSError) as e:
+                logger.error(_("error syncing %s: %s"), item, e)
+                self._count('failed')
+
+        items = list(items)
+        if self.parallel > 1 and len(items) > 1:
+            pool = ThreadPool(self.parallel)
+            try:
+                return pool.map(call, items, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            return list(map(call, items))
+
+    def sync_index(self):
+        url = self.api.mirror.rstrip('/') + '/index.json'
+        with network.get_file(url, compress=True) as f:
+            data = f.read()
+
+        # Use the templates of the mirror we are reading from
+        self.api.set_index(data)
+        self.save(os.path.join(self.dest, 'index.json'), data)
+
+        # not all the mirrors have it
+        self.sync_file('mirrors', {}, optional=True)
+
+    def sync_userlist(self, char):
+        return self.sync_file('userlist', {'char': char}, optional=True)
+
+    def sync_user(self, user):
+        return self.sync_file('user', {'user': user})
+
+    def sync_dist(self, dist):
+        return self.sync_file('dist', {'dist': dist.lower()})
+
+    def sync_extension(self, ext):
+        return self.sync_file('extension', {'extension': ext.lower()})
+
+    def sync_release(self, release):
+        """Sync the files of a (dist, version) release. Return its META."""
+        dist, version = release
+        args = {'dist': dist.lower(), 'version': SemVer(version.lower())}
+        meta = self.sync_file('meta', args, immutable=True)
+        self.sync_file('readme', args, immutable=True, optional=True)
+        self.sync_archive(args, meta['sha1'])
+        return meta
+
+    def sync_file(self, meth, args, immutable=False, optional=False):
+        """
+        Sync the file returned by the API method *meth*.
+
+        Return the file content, parsed if JSON, or `!None` if the file is
+        *optional* and missing on the mirror.
+        """
+        fn = self.get_filename(meth, args)
+        if immutable and os.path.exists(fn):
+            self._count('unchanged')
+            with open(fn, 'rb') as f:
+                data = f.read()
+        else:
+            try:
+                with self.api.call(meth, args) as f:
+                    data = f.read()
+            except ResourceNotFound:
+                if not optional:
+                    raise
+                logger.debug("%s not found on the mirror", fn)
+                return None
+
+            self.save(fn, data)
+
+        if fn.endswith('.json'):
+            return load_jsons(data.decode('utf-8'))
+        else:
+            return data
+
+    def sync_archive(self, args, chk):
+        """Download a release archive unless a copy with sha1 *chk* exists."""
+        fn = self.get_filename('download', args)
+        if os.path.exists(fn) and file_sha1(fn) == chk:
+            self._count('unchanged')
+            return
+
+        with self.api.call('download', args) as fin:
+            save_stream(fin, fn, chk)
+
+        logger.info(_("saved %s"), fn)
+        self._count('written')
+
+    def get_filename(self, meth, args):
+        """Return the local file name for the resource of an API method."""
+        path = unquote(expand_template(self.api.get_template(meth), args))
+        fn = os.path.normpath(os.path.join(self.dest, path.lstrip('/')))
+        if not fn.startswith(self.dest + os.sep):
+            raise PgxnClientException(
+                _("bad path for the mirror file: %s") % path
+            )
+        return fn
+
+    def save(self, fn, data):
+        """Write *data* into *fn* atomically, unless it is unchanged."""
+        if os.path.exists(fn) and file_sha1(fn) == sha1(data).hexdigest():
+            self._count('unchanged')
+            return
+
+        save_stream(BytesIO(data), fn)
+        logger.info(_("saved %s"), fn)
+        self._count('written')
+
+    def _count(self, what):
+        with self._lock:
+            self.stats[what] += 1
+
+
+def save_stream(fin, fn, chk=None):
+    """
+    Save the content of the file *fin* into *fn* atomically.
+
+    If *chk* is specified, raise `BadChecksum` if the content doesn't have
+    such sha1, leaving *fn* untouched.
+    """
+    dir = os.path.dirname(fn)
+    if not os.path.isdir(dir):
+        try:
+            os.makedirs(dir)
+        except OSError:
+            # maybe created by a concurrent thread
+            if not os.path.isdir(dir):
+                raise
+
+    f = tempfile.NamedTemporaryFile(prefix=TEMP_PREFIX, dir=dir, delete=False)
+    try:
+        with f:
+            sha = sha1()
+            while 1:
+                data = fin.read(8192)
+                if not data:
+                    break
+                sha.update(data)
+                f.write(data)
+
+        if chk is not None and sha.hexdigest() != chk:
+            raise BadChecksum(
+                _("file %s has sha1 %s instead of %s")
+                % (fn, sha.hexdigest(), chk)
+            )
+
+        # the files must be readable by the web server
+        os.chmod(f.name, 0o644)
+        os.rename(f.name, fn)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
+class MirrorServer(ThreadingMixIn, HTTPServer):
+    """
+    Serve the files of a local mirror over HTTP.
+
+    The files in *root* are served with the same URLs of the PGXN API, so the
+    server can be used as ``--mirror`` by other clients. If *upstream* is
+    specified, the files missing are downloaded from that mirror and saved
+    into *root* before being served: concurrent requests for the same file
+    only download it once. The files of a release never change, so they are
+    kept forever; the other files (the index, the distributions, the users...)
+    are checked again upstream if not checked in the last `REVALIDATE_TTL`
+    seconds.
+    """
+
+    daemon_threads = True
+
+    REVALIDATE_TTL = 5 * 60
+
+    # /dist/{dist}/{version}/{file}: META, README and archive of a release
+    _release_file = re.compile(r'^/dist/[^/]+/[^/]+/[^/]+$')
+
+    def __init__(self, addr, root, upstream=None):
+        # HTTPServer is an old-style class on Python 2: no super()
+        HTTPServer.__init__(self, addr, MirrorRequestHandler)
+        self.root = os.path.abspath(root)
+        self.upstream = upstream and upstream.rstrip('/')
+
+        self._lock = threading.Lock()
+        self._fetching = {}
+        self._checked = {}
+
+    def get_filename(self, path):
+        """Return the file to serve for an URL path, `!None` if invalid."""
+        path = unquote(path)
+        if not path.startswith('/') or '..' in path or '@' in path:
+            return None
+        fn = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+        if fn.startswith(self.root + os.sep):
+            return fn
+
+    def get_upstream_url(self, fn):
+        """Return the URL of the upstream file to save into *fn*."""
+        path = os.path.relpath(fn, self.root).replace(os.sep, '/')
+        url = urljoin(self.upstream + '/', quote(path))
+        if urlsplit(url)[:2] != urlsplit(self.upstream)[:2]:
+            raise PgxnClientException(
+                _("bad path for the upstream mirror: %s") % path
+            )
+        return url
+
+    def is_immutable(self, path):
+        """Return `!True` if the resource at *path* can never change."""
+        return self._release_file.match(unquote(path)) is not None
+
+    def is_fresh(self, path, fn):
+        """Return `!True` if *fn* can be served without asking upstream."""
+        if not os.path.isfile(fn):
+            return False
+        if self.is_immutable(path):
+            return True
+
+        checked = self._checked.get(fn)
+        if checked is None:
+            checked = os.path.getmtime(fn)
+        return time.time() - checked < self.REVALIDATE_TTL
+
+    def fetch(self, path, fn):
+        """
+        Download *path* from the upstream mirror into *fn* if needed.
+
+        If *fn* is not fresh (see `is_fresh()`) it is downloaded again and
+        replaced if changed. If upstream can't be reached the stale copy is
+        kept and served.
+        """
+        with self._lock:
+            lock = self._fetching.get(fn)
+            if lock is None:
+                lock = self._fetching[fn] = threading.Lock()
+
+        with lock:
+            try:
+                if not self.is_fresh(path, fn):
+                    self._fetch(path, fn)
+            finally:
+                with self._lock:
+                    self._fetching.pop(fn, None)
+
+    def _fetch(self, path, fn):
+        url = self.get_upstream_url(fn)
+        compress = fn.endswith('.json')
+        if not os.path.isfile(fn):
+            with network.get_file(url, compress=compress) as fin:
+                save_stream(fin, fn)
+            logger.info(_("saved %s"), fn)
+            self._checked[fn] = time.time()
+            return
+
+        try:
+            with network.get_file(url, compress=compress) as fin:
+                data = fin.read()
+        except ResourceNotFound:
+            raise
+        except (PgxnException, IOError, OSError) as e:
+            logger.warning(
+                _("error revalidating %s, serving the stored copy: %s"),
+                path,
+                e,
+            )
+            # don't ask upstream again at every request
+            self._checked[fn] = time.time()
+            return
+
+        # Don't touch the file if unchanged, so that its ETag stays valid
+        if file_sha1(fn) != sha1(data).hexdigest():
+            save_stream(BytesIO(data), fn)
+            logger.info(_("saved %s"), fn)
+        self._checked[fn] = time.time()
+
+
+class MirrorRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'pgxnclient/%s' % __version__
+
+    def do_GET(self):
+        self.send_file()
+
+    def do_HEAD(self):
+        self.send_file(head=True)
+
+    def send_file(self, head=False):
+        # The dynamic resources (e.g. search) can't be served by a mirror
+        if '?' in self.path:
+            return self.send_error(404)
+
+        fn = self.server.get_filename(self.path)
+        if fn is None:
+            return self.send_error(404)
+
+        if self.server.upstream:
+            try:
+                self.server.fetch(self.path, fn)
+            except ResourceNotFound:
+                return self.send_error(404)
+            except (PgxnException, IOError, OSError) as e:
+                logger.error(_("error fetching %s: %s"), self.path, e)
+                return self.send_error(502)
+
+        try:
+            f = open(fn, 'rb')
+        except (IOError, OSError):
+            return self.send_error(404)
+
+        with f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                return self.send_error(404)
+
+            # JSON files are compressed if the client accepts it
+            is_json = fn.endswith('.json')
+            gz = is_json and 'gzip' in self.headers.get('Accept-Encoding', '')
+
+            etag = '"%x-%x%s"' % (
+                int(st.st_mtime),
+                st.st_size,
+                gz and '-gz' or '',
+            )
+            inm = self.headers.get('If-None-Match')
+            if inm and (
+                inm.strip() == '*'
+                or etag in [t.strip() for t in inm.split(',')]
+            ):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+            if gz:
+                body = BytesIO()
+                z = GzipFile(fileobj=body, mode='wb', mtime=st.st_mtime)
+                with z:
+                    shutil.copyfileobj(f, z)
+                body = body.getvalue()
+                length = len(body)
+            else:
+                length = st.st_size
+
+            self.send_response(200)
+            self.send_header(
+                'Content-Type',
+                mimetypes.guess_type(fn)[0] or 'application/octet-stream',
+            )
+            self.send_header('Content-Length', str(length))
+            self.send_header('ETag', etag)
+            self.send_header(
+                'Last-Modified', self.date_time_string(st.st_mtime)
+            )
+            if is_json:
+                self.send_header('Vary', 'Accept-Encoding')
+            if gz:
+                self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+
+            if head:
+                return
+            if gz:
+                self.wfile.write(body)
+            else:
+                self.copy_file(f)
+
+    def copy_file(self, f):
+        # Send the file with the sendfile(2) where available (Python 3)
+        sendfile = getattr(self.connection, 'sendfile', None)
+        if sendfile is not None:
+            self.wfile.flush()
+            sendfile(f)
+        else:
+            shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
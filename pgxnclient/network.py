@@ -7,16 +7,28 @@ pgxnclient -- network interaction
 # This file is part of the PGXN client
 
 import os
-from six.moves.urllib.request import build_opener
+import time
+import errno
+import random
+import zlib
+import socket
+import tempfile
+import threading
+from six.moves import queue, http_client
+from six.moves.urllib.request import build_opener, Request
 from six.moves.urllib.error import HTTPError, URLError
 from six.moves.urllib.parse import urlsplit
 from itertools import count
 from contextlib import closing
+from email.utils import parsedate_tz, mktime_tz
 
 from pgxnclient import __version__
 from pgxnclient.i18n import _
+from pgxnclient.utils import sha1
+from pgxnclient.utils.cache import TEMP_PREFIX
 from pgxnclient.errors import (
     PgxnClientException,
+    BadChecksum,
     NetworkError,
     ResourceNotFound,
     BadRequestError,
@@ -27,27 +39,272 @@ import logging
 logger = logging.getLogger('pgxnclient.network')
 
 
-def get_file(url):
-    opener = build_opener()
-    opener.addheaders = [('User-agent', 'pgxnclient/%s' % __version__)]
-    logger.debug('opening url: %s', url)
-    try:
-        return closing(opener.open(url))
-    except HTTPError as e:
+_opener = None
+
+
+def get_opener():
+    """Return the URL opener shared by the whole process."""
+    global _opener
+    if _opener is None:
+        opener = build_opener()
+        opener.addheaders = [('User-agent', 'pgxnclient/%s' % __version__)]
+        _opener = opener
+
+    return _opener
+
+
+# The HTTP statuses meaning a transient error, worth retrying
+RETRY_CODES = frozenset([429, 500, 502, 503, 504])
+
+# The socket errors meaning a transient error, worth retrying
+RETRY_ERRNOS = frozenset(
+    [errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE, errno.ETIMEDOUT]
+)
+
+# Default number of retries and total time, in seconds, of a request
+RETRIES = 3
+RETRY_TIME = 60
+
+# Base and maximum time, in seconds, to wait between attempts
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 10
+
+
+def get_file(url, retries=None, max_time=None, compress=False):
+    """Open an URL and return a file-like object to read it.
+
+    If *compress* is true, ask the server to compress the response, and
+    decompress it while reading. Don't use it for already compressed files.
+
+    The requests failed for errors likely to be transient (timeouts,
+    connections reset, server errors) are retried up to *retries* times,
+    waiting a randomized, exponentially increasing time between attempts, or
+    the time requested by the server in the ``Retry-After`` header. Other
+    errors, such as a host not found, are not retried. A new attempt is not
+    made if more than *max_time* seconds would have passed since the first
+    one. The defaults can be set by the :envvar:`PGXN_RETRIES` and
+    :envvar:`PGXN_RETRY_TIME` environment variables.
+    """
+    if retries is None:
+        retries = _get_env_number('PGXN_RETRIES', int, RETRIES)
+    if max_time is None:
+        max_time = _get_env_number('PGXN_RETRY_TIME', float, RETRY_TIME)
+
+    req = url
+    if compress:
+        req = Request(url, headers={'Accept-Encoding': 'gzip, deflate'})
+
+    opener = get_opener()
+    t0 = time.time()
+    for attempt in count():
+        logger.debug('opening url: %s', url)
+        wait = None
+        try:
+            f = opener.open(req)
+            if compress:
+                encoding = f.info().get('Content-Encoding')
+                if encoding in ('gzip', 'deflate'):
+                    f = DecodedFile(f, encoding)
+            return closing(f)
+        except HTTPError as e:
+            if e.code not in RETRY_CODES:
+                raise _get_error(url, e)
+            error = e
+            wait = _get_retry_after(e)
+        except URLError as e:
+            # a missing file on a file:// mirror
+            if getattr(e.reason, 'errno', None) == errno.ENOENT:
+                raise ResourceNotFound(_("resource not found: '%s'") % url)
+            if not _is_transient(e.reason):
+                raise _get_error(url, e)
+            error = e
+        except (socket.error, http_client.BadStatusLine) as e:
+            # raised reading the response, e.g. on timeout
+            if not _is_transient(e):
+                raise _get_error(url, e)
+            error = e
+
+        backoff = min(RETRY_BACKOFF * pow(2, attempt), RETRY_BACKOFF_MAX)
+        delay = random.uniform(0, backoff)
+        if wait is not None:
+            delay = max(delay, wait)
+        if attempt >= retries or time.time() - t0 + delay > max_time:
+            raise _get_error(url, error)
+
+        logger.debug(
+            "attempt %d on %s failed: %s; retrying in %.1f sec",
+            attempt + 1,
+            url,
+            error,
+            delay,
+        )
+        time.sleep(delay)
+
+
+class DecodedFile(object):
+    """
+    Wrap a response compressed with *encoding* and decompress it on read.
+
+    The ``deflate`` encoding should be a zlib stream, but many servers send
+    raw deflate data instead: both are accepted.
+    """
+
+    def __init__(self, f, encoding):
+        self._f = f
+        self.url = f.url
+        self._buf = bytearray()
+        self._eof = False
+        self._started = False
+        self._encoding = encoding
+        if encoding == 'gzip':
+            wbits = 16 + zlib.MAX_WBITS
+        else:
+            wbits = zlib.MAX_WBITS
+        self._z = zlib.decompressobj(wbits)
+
+    def read(self, n=-1):
+        while (n < 0 or len(self._buf) < n) and not self._eof:
+            data = self._f.read(8192)
+            try:
+                if data:
+                    self._buf += self._decompress(data)
+                else:
+                    self._buf += self._z.flush()
+                    self._eof = True
+            except zlib.error as e:
+                raise NetworkError(
+                    _("error decoding data from '%s': %s") % (self.url, e)
+                )
+
+            # 'eof' is not available on Python 2: trust the stream there
+            if self._eof and not getattr(self._z, 'eof', True):
+                raise NetworkError(
+                    _("incomplete data received from '%s'") % self.url
+                )
+
+        if n < 0:
+            rv = bytes(self._buf)
+            del self._buf[:]
+        else:
+            rv = bytes(self._buf[:n])
+            del self._buf[:n]
+        return rv
+
+    def _decompress(self, data):
+        if self._started or self._encoding != 'deflate':
+            return self._z.decompress(data)
+
+        self._started = True
+        try:
+            return self._z.decompress(data)
+        except zlib.error:
+            logger.debug("decoding raw deflate data from '%s'", self.url)
+            self._z = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._z.decompress(data)
+
+    def close(self):
+        self._f.close()
+
+    def __getattr__(self, attr):
+        return getattr(self._f, attr)
+
+
+def _get_error(url, e):
+    """Return the exception to raise for the failed request to *url*."""
+    if isinstance(e, HTTPError):
         if e.code == 404:
-            raise ResourceNotFound(_("resource not found: '%s'") % e.url)
+            return ResourceNotFound(_("resource not found: '%s'") % e.url)
         elif e.code == 400:
-            raise BadRequestError(_("bad request on '%s'") % e.url)
+            return BadRequestError(_("bad request on '%s'") % e.url)
         elif e.code == 500:
-            raise NetworkError(_("server error"))
+            return NetworkError(_("server error"))
         elif e.code == 503:
-            raise NetworkError(_("service unavailable"))
+            return NetworkError(_("service unavailable"))
         else:
-            raise NetworkError(
+            return NetworkError(
                 _("unexpected response %d for '%s'") % (e.code, e.url)
             )
-    except URLError as e:
-        raise NetworkError(_("network error: %s") % e.reason)
+    elif isinstance(e, URLError):
+        return NetworkError(_("network error: %s") % e.reason)
+    else:
+        return NetworkError(_("network error: %s") % e)
+
+
+def _is_transient(e):
+    """Return `!True` if the network error *e* is worth retrying."""
+    if isinstance(e, (socket.timeout, http_client.BadStatusLine)):
+        # BadStatusLine is raised if the server closes the connection
+        return True
+    return getattr(e, 'errno', None) in RETRY_ERRNOS
+
+
+# The environment variables found invalid, to warn only once
+_bad_env = set()
+
+
+def _get_env_number(name, type, default):
+    """
+    Return the value of the environment variable *name* converted to *type*.
+
+    Return *default* if the variable is not set, or, with a warning, if it is
+    not a valid non-negative number.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+
+    try:
+        rv = type(value)
+        if not rv >= 0:
+            raise ValueError(value)
+    except ValueError:
+        if (name, value) not in _bad_env:
+            _bad_env.add((name, value))
+            logger.warning(
+                _("bad value for %s: '%s'; using %s"), name, value, default
+            )
+        return default
+
+    return rv
+
+
+def _get_retry_after(e):
+    """Return the seconds to wait requested by a server, `!None` if unknown."""
+    value = e.info() and e.info().get('Retry-After')
+    if not value:
+        return None
+
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+
+    # it may be an HTTP date
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, mktime_tz(date) - time.time())
+
+
+def probe(url, timeout=5):
+    """
+    Return the time in seconds taken by a HEAD request to *url*.
+
+    Return `!None` if the request fails or takes longer than *timeout*.
+    """
+    req = Request(url)
+    req.get_method = lambda: 'HEAD'
+    t0 = time.time()
+    try:
+        with closing(get_opener().open(req, timeout=timeout)):
+            pass
+    except (URLError, socket.error) as e:
+        logger.debug("probing %s failed: %s", url, e)
+        return None
+
+    rv = time.time() - t0
+    logger.debug("probing %s took %.3f sec", url, rv)
+    return rv
 
 
 def get_local_file_name(target, url):
@@ -65,6 +322,23 @@ def get_local_file_name(target, url):
     return os.path.abspath(fn)
 
 
+def get_unique_file_name(fn):
+    """
+    Return a name for a new file *fn*.
+
+    If the file exists, add a suffix ``-1``, ``-2``... before the extension.
+    """
+    if os.path.exists(fn):
+        base, ext = os.path.splitext(fn)
+        for i in count(1):
+            logger.debug(_("file %s exists"), fn)
+            fn = "%s-%d%s" % (base, i, ext)
+            if not os.path.exists(fn):
+                break
+
+    return fn
+
+
 def download(f, fn, rename=True):
     """Download a file locally.
 
@@ -79,13 +353,7 @@ def download(f, fn, rename=True):
         fn = get_local_file_name(fn, f.url)
 
     if rename:
-        if os.path.exists(fn):
-            base, ext = os.path.splitext(fn)
-            for i in count(1):
-                logger.debug(_("file %s exists"), fn)
-                fn = "%s-%d%s" % (base, i, ext)
-                if not os.path.exists(fn):
-                    break
+        fn = get_unique_file_name(fn)
 
     logger.info(_("saving %s"), fn)
     try:
@@ -104,3 +372,180 @@ def download(f, fn, rename=True):
         fout.close()
 
     return fn
+
+
+def download_hedged(urls, target, chk, after, min_rate=0):
+    """Download a file from the fastest of many mirrors.
+
+    :param urls: the URLs of the same file on different mirrors, best first
+    :param target: name of the file to write. If a dir, save into it.
+    :param chk: the sha1 the file must have
+    :param after: seconds after which a slow download is hedged
+    :param min_rate: the rate (in bytes/sec) below which a download is slow
+
+    Start downloading from the first URL. If after *after* seconds the
+    download is not complete and its rate is below *min_rate*, start a new
+    download from the next URL, and so on. The first download completed with
+    the right checksum is kept and the others are cancelled. A failed
+    download is immediately replaced by one from the next URL. If a file
+    *target* exists the file is renamed as in `download()`.
+
+    Return the name of the file saved.
+    """
+    if os.path.isdir(target):
+        dir = target
+    else:
+        dir = os.path.dirname(os.path.abspath(target))
+
+    done = queue.Queue()
+    race_over = threading.Event()
+    attempts = []
+    failures = 0
+    winner = None
+
+    def start():
+        a = _Attempt(urls[len(attempts)], dir, chk, race_over, done)
+        attempts.append(a)
+        a.thread.start()
+
+    start()
+    try:
+        while 1:
+            try:
+                a = done.get(timeout=after)
+            except queue.Empty:
+                last = attempts[-1]
+                if len(attempts) < len(urls) and last.rate < min_rate:
+                    logger.info(
+                        _("download from %s too slow (%d KB/s): trying %s"),
+                        last.url,
+                        last.rate // 1024,
+                        urls[len(attempts)],
+                    )
+                    start()
+                continue
+
+            if a.error is None:
+                winner = a
+                break
+
+            logger.warning(_("download from %s failed: %s"), a.url, a.error)
+            failures += 1
+            if len(attempts) < len(urls):
+                start()
+            elif failures == len(attempts):
+                # every attempt reported its failure: nothing else to wait
+                raise a.error
+    finally:
+        # Don't wait for the losers: the ones still running stop and clean
+        # up by themselves.
+        race_over.set()
+        for a in attempts:
+            if a is winner:
+                continue
+            if a.finished:
+                a.cleanup()
+            else:
+                a.cancel()
+
+    fn = get_unique_file_name(get_local_file_name(target, winner.url))
+    logger.info(_("saving %s"), fn)
+    os.rename(winner.tmpname, fn)
+    return fn
+
+
+def _get_socket(f):
+    """Return the socket a HTTP response *f* is read from, if any."""
+    # py3: HTTPResponse -> BufferedReader -> SocketIO -> socket
+    # py2: addinfourl -> _fileobject -> socket
+    while f is not None and not isinstance(f, socket.socket):
+        for attr in ('fp', 'raw', '_sock'):
+            if getattr(f, attr, None) is not None:
+                f = getattr(f, attr)
+                break
+        else:
+            return None
+
+    return f
+
+
+class _Attempt(object):
+    """A download of a file from *url*, running in a thread."""
+
+    def __init__(self, url, dir, chk, race_over, done):
+        self.url = url
+        self.dir = dir
+        self.chk = chk
+        self.race_over = race_over
+        self.done = done
+
+        self.nbytes = 0
+        self.started = time.time()
+        self.finished = False
+        self.error = None
+        self.tmpname = None
+        self._fin = None
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    @property
+    def rate(self):
+        """The download rate, in bytes/sec."""
+        return self.nbytes / max(time.time() - self.started, 0.001)
+
+    def run(self):
+        logger.debug("downloading %s", self.url)
+        try:
+            with get_file(self.url) as self._fin:
+                f = tempfile.NamedTemporaryFile(
+                    prefix=TEMP_PREFIX, dir=self.dir, delete=False
+                )
+                self.tmpname = f.name
+                sha = sha1()
+                with f:
+                    while not self.race_over.is_set():
+                        data = self._fin.read(8192)
+                        if not data:
+                            break
+                        self.nbytes += len(data)
+                        sha.update(data)
+                        f.write(data)
+
+            if not self.race_over.is_set() and sha.hexdigest() != self.chk:
+                raise BadChecksum(
+                    _("file %s has sha1 %s instead of %s")
+                    % (self.url, sha.hexdigest(), self.chk)
+                )
+        except Exception as e:
+            self.error = e
+
+        # Set before checking race_over: if the race ends after this point
+        # the file is deleted either here or by download_hedged().
+        self.finished = True
+
+        # the losers don't leave files around
+        if self.race_over.is_set() or self.error is not None:
+            self.cleanup()
+
+        self.done.put(self)
+
+    def cancel(self):
+        """Stop the download, if still running, without waiting for it.
+
+        Closing the file would wait for a blocked read to return: shut down
+        its socket instead, which makes the read return at once.
+        """
+        sock = _get_socket(self._fin)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError):
+                pass
+
+    def cleanup(self):
+        if self.tmpname is not None:
+            try:
+                os.unlink(self.tmpname)
+            except OSError:
+                pass
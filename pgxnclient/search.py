@@ -0,0 +1,218 @@
+"""
+pgxnclient -- local full-text search index
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+import os
+import glob
+import logging
+
+from pgxnclient.i18n import _
+from pgxnclient.utils import load_json
+from pgxnclient.errors import PgxnClientException
+from pgxnclient.utils.uri import expand_template
+from pgxnclient.utils.cache import get_cache_dir
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+logger = logging.getLogger('pgxnclient.search')
+
+# The searchable tables, by search scope, with the columns indexed
+SCOPES = {
+    'docs': ('title', 'body'),
+    'dists': ('name', 'abstract', 'description', 'tags'),
+    'extensions': ('extension', 'abstract'),
+}
+
+# Maximum number of results returned, as the PGXN server does
+SEARCH_LIMIT = 50
+
+
+class SearchIndex(object):
+    """
+    A full-text index of the PGXN catalogue, stored in a SQLite database.
+
+    The index is populated by `update()` reading the files of a local PGXN
+    mirror, and is queried by `search()`, which returns results in the same
+    format of `Api.search()`. Only the latest release of each distribution
+    is indexed.
+    """
+
+    def __init__(self, filename=None):
+        if sqlite3 is None:
+            raise PgxnClientException(
+                _("the sqlite3 module is required for the offline search")
+            )
+        if filename is None:
+            filename = os.path.join(get_cache_dir(), 'search.sqlite')
+        self.filename = filename
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filename)
+            try:
+                self._create_schema()
+            except sqlite3.OperationalError as e:
+                self._conn.close()
+                self._conn = None
+                raise PgxnClientException(
+                    _("cannot create the search index: %s") % e
+                )
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _create_schema(self):
+        with self._conn:
+            for table, cols in sorted(SCOPES.items()):
+                self._conn.execute(
+                    "create virtual table if not exists %s using fts5"
+                    "(dist unindexed, version unindexed, %s)"
+                    % (table, ', '.join(cols))
+                )
+            # The dist files already indexed, to update incrementally
+            self._conn.execute(
+                "create table if not exists indexed"
+                "(dist text primary key, version text, mtime real)"
+            )
+
+    def update(self, mirror):
+        """
+        Index the distributions found in the local mirror directory.
+
+        Only the distributions changed since the last update are read.
+        Return the number of distributions indexed.
+        """
+        fn = os.path.join(mirror, 'index.json')
+        try:
+            with open(fn, 'rb') as f:
+                templates = load_json(f)
+        except (IOError, OSError) as e:
+            raise PgxnClientException(
+                _("cannot read the mirror index: %s") % e
+            )
+
+        prefix, suffix = templates['dist'].split('{dist}', 1)
+        pattern = os.path.join(mirror, prefix.lstrip('/'), '*' + suffix)
+        cur = self.conn.execute("select dist, version, mtime from indexed")
+        known = dict((r[0], r[1:]) for r in cur)
+
+        n = 0
+        for fn in sorted(glob.glob(pattern)):
+            dist = os.path.basename(fn)[: -len(suffix) or None]
+            mtime = os.stat(fn).st_mtime
+            if dist in known and known[dist][1] == mtime:
+                continue
+
+            with open(fn, 'rb') as f:
+                data = load_json(f)
+
+            version = data['version']
+            if dist in known and known[dist][0] == version:
+                # touched but no new release
+                self._set_indexed(dist, version, mtime)
+                continue
+
+            logger.debug("indexing %s %s", dist, version)
+            self._index_dist(mirror, templates, dist, version)
+            self._set_indexed(dist, version, mtime)
+            n += 1
+
+        return n
+
+    def _set_indexed(self, dist, version, mtime):
+        with self.conn:
+            self.conn.execute(
+                "insert or replace into indexed values (?, ?, ?)",
+                (dist, version, mtime),
+            )
+
+    def _index_dist(self, mirror, templates, dist, version):
+        args = {'dist': dist.lower(), 'version': version.lower()}
+        meta = self._read(mirror, templates['meta'], args, json=True) or {}
+        readme = self._read(mirror, templates['readme'], args)
+
+        conn = self.conn
+        with conn:
+            for table in SCOPES:
+                conn.execute("delete from %s where dist = ?" % table, (dist,))
+
+            conn.execute(
+                "insert into dists values (?, ?, ?, ?, ?, ?)",
+                (
+                    dist,
+                    version,
+                    meta.get('name', dist),
+                    meta.get('abstract', ''),
+                    meta.get('description', ''),
+                    ' '.join(meta.get('tags', ())),
+                ),
+            )
+            for ext, data in sorted(meta.get('provides', {}).items()):
+                conn.execute(
+                    "insert into extensions values (?, ?, ?, ?)",
+                    (dist, version, ext, data.get('abstract', '')),
+                )
+            if readme:
+                conn.execute(
+                    "insert into docs values (?, ?, ?, ?)",
+                    (dist, version, "%s %s" % (dist, version), readme),
+                )
+
+    def _read(self, mirror, template, args, json=False):
+        fn = os.path.join(mirror, expand_template(template, args).lstrip('/'))
+        try:
+            with open(fn, 'rb') as f:
+                if json:
+                    return load_json(f)
+                else:
+                    return f.read().decode('utf-8', 'replace')
+        except (IOError, OSError):
+            logger.debug("file not found in the mirror: %s", fn)
+            return None
+
+    def search(self, where, query):
+        """Search into the index.
+
+        :param where: where to search: "docs", "dists", "extensions"
+        :param query: list of strings to search
+
+        Return the results in the format of `Api.search()`.
+        """
+        if where not in SCOPES:
+            raise ValueError("bad search scope: %r" % where)
+
+        # As on the server, any term can be found; each term is a phrase
+        q = ' OR '.join('"%s"' % s.replace('"', '""') for s in query)
+        # the excerpt is taken from the best matching column, formatted as
+        # the server does
+        excerpt = (
+            "snippet(%s, -1, '<strong>', '</strong>', '&#8230;', 32)" % where
+        )
+        try:
+            cur = self.conn.execute(
+                "select dist, version, %s from %s where %s match ?"
+                " order by rank limit %d"
+                % (excerpt, where, where, SEARCH_LIMIT),
+                (q,),
+            )
+            rows = cur.fetchall()
+        except sqlite3.OperationalError as e:
+            raise PgxnClientException(_("search failed: %s") % e)
+
+        hits = [
+            {'dist': dist, 'version': version, 'excerpt': excerpt}
+            for dist, version, excerpt in rows
+        ]
+        return {'hits': hits, 'count': len(hits)}
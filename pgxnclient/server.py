@@ -0,0 +1,258 @@
+"""
+pgxnclient -- server running commands on behalf of other processes
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+import os
+import sys
+import json
+import socket
+import struct
+import logging
+from array import array
+
+from pgxnclient.i18n import _
+from pgxnclient.errors import PgxnClientException
+
+logger = logging.getLogger('pgxnclient.server')
+
+# The standard streams passed by the client to the server
+STD_FDS = (0, 1, 2)
+
+
+class ServerError(PgxnClientException):
+    """The server failed after receiving a request.
+
+    The command may have been run already, so it should not be retried.
+    """
+
+
+def check_support():
+    """Raise `PgxnClientException` if the platform can't run the server."""
+    if not hasattr(socket, 'AF_UNIX') or not hasattr(socket.socket, 'sendmsg'):
+        raise PgxnClientException(
+            _("the command server is not supported on this platform")
+        )
+
+
+class Server(object):
+    """
+    Run the commands received on a Unix socket.
+
+    Every client sends a single request: the command line arguments, the
+    working directory and the environment to run the command with, together
+    with its standard file descriptors, so that the output of the command,
+    and of the programs it runs, goes straight to the client's streams. The
+    server replies with the exit status of the command.
+
+    Requests are served one at time: all the commands run in the same
+    `~pgxnclient.commands.Session`, so they reuse the data already fetched.
+    """
+
+    def __init__(self, path, session=None):
+        check_support()
+        self.path = os.path.abspath(path)
+        self.session = session
+        self.sock = None
+
+    def bind(self):
+        if os.path.exists(self.path):
+            if is_listening(self.path):
+                raise PgxnClientException(
+                    _("a server is already listening on %s") % self.path
+                )
+            # a leftover of a server not terminated cleanly
+            os.unlink(self.path)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Create the socket already accessible only by the user
+        oldmask = os.umask(0o177)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(oldmask)
+
+        self.sock.listen(5)
+        logger.info(_("listening on %s"), self.path)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        try:
+            while 1:
+                conn, addr = self.sock.accept()
+                try:
+                    self.handle(conn)
+                except Exception as e:
+                    logger.error(_("error handling request: %s"), e)
+                finally:
+                    conn.close()
+        finally:
+            self.close()
+
+    def handle(self, conn):
+        """Run the command requested on the connection *conn*."""
+        check_peer(conn)
+        data, fds = _recv_request(conn)
+        try:
+            req = json.loads(data.decode('utf-8'))
+            if len(fds) != len(STD_FDS):
+                raise PgxnClientException(
+                    _("bad number of file descriptors received: %s") % len(fds)
+                )
+            rv = self.run_request(req['argv'], req['cwd'], req['env'], fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+        conn.sendall(json.dumps({'exit': rv}).encode('utf-8') + b'\n')
+
+    def run_request(self, argv, cwd, env, fds):
+        """Run the command *argv* in the client context, return the status."""
+        from pgxnclient.cli import run_main
+
+        logger.debug("running command: %s", argv)
+        oldcwd = os.getcwd()
+        oldenv = os.environ.copy()
+        oldargv0 = sys.argv[0]
+        oldfds = [os.dup(fd) for fd in STD_FDS]
+        _flush()
+        try:
+            for fd, stdfd in zip(fds, STD_FDS):
+                os.dup2(fd, stdfd)
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(env)
+            sys.argv[0] = 'pgxn'
+
+            return run_main(argv, session=self.session)
+
+        finally:
+            _flush()
+            for fd, stdfd in zip(oldfds, STD_FDS):
+                os.dup2(fd, stdfd)
+                os.close(fd)
+            os.chdir(oldcwd)
+            os.environ.clear()
+            os.environ.update(oldenv)
+            sys.argv[0] = oldargv0
+
+
+def check_peer(conn):
+    """
+    Raise `PgxnClientException` if *conn* is not from the server's user.
+
+    The check is only performed where the platform supports it: elsewhere
+    only the socket permissions restrict who can connect.
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return
+
+    fmt = '3i'
+    creds = conn.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize(fmt)
+    )
+    pid, uid, gid = struct.unpack(fmt, creds)
+    if uid != os.getuid():
+        raise PgxnClientException(
+            _("connection refused from process %s of user %s") % (pid, uid)
+        )
+
+
+def call(path, argv):
+    """
+    Run the command *argv* on the server listening on *path*.
+
+    Return the exit status of the command. Raise `!socket.error` if the
+    server can't be contacted, so that the command can be run locally, or
+    `ServerError` if the request was sent but no result was received.
+    """
+    check_support()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        req = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        data = json.dumps(req).encode('utf-8') + b'\n'
+
+        _flush()
+        fds = array('i', STD_FDS)
+        n = sock.sendmsg(
+            [data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds.tobytes())]
+        )
+        if n < len(data):
+            sock.sendall(data[n:])
+
+        # The server may be running the command now: a failure from here on
+        # must not cause the command to run again.
+        try:
+            resp = _recv_line(sock)
+        except socket.error as e:
+            raise ServerError(_("error receiving the response: %s") % e)
+    finally:
+        sock.close()
+
+    if not resp:
+        raise ServerError(_("no response from the server"))
+
+    return json.loads(resp.decode('utf-8'))['exit']
+
+
+def is_listening(path):
+    """Return `!True` if a server is accepting connections on *path*."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    else:
+        return True
+    finally:
+        sock.close()
+
+
+def _flush():
+    for f in (sys.stdout, sys.stderr):
+        try:
+            f.flush()
+        except (IOError, OSError, ValueError):
+            pass
+
+
+def _recv_request(conn):
+    """Receive a request line and the file descriptors sent with it."""
+    fds = array('i')
+    size = socket.CMSG_LEN(len(STD_FDS) * fds.itemsize)
+    data, ancdata, flags, addr = conn.recvmsg(8192, size)
+    for level, type, cdata in ancdata:
+        if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+            cdata = cdata[: len(cdata) - (len(cdata) % fds.itemsize)]
+            fds.frombytes(cdata)
+
+    if not data.endswith(b'\n'):
+        data += _recv_line(conn)
+
+    return data, list(fds)
+
+
+def _recv_line(sock):
+    chunks = []
+    while 1:
+        chunk = sock.recv(8192)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b'\n'):
+            break
+
+    return b''.join(chunks)
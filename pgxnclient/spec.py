@@ -10,7 +10,7 @@ pgxnclient -- specification object
 import os
 import re
 from six.moves.urllib.parse import unquote_plus
-import operator as _op
+from bisect import bisect_right
 
 from pgxnclient.i18n import _
 from pgxnclient.errors import BadSpecError, ResourceNotFound
@@ -20,7 +20,12 @@ from pgxnclient.utils.strings import Term
 
 
 class Spec(object):
-    """A name together with a range of versions."""
+    """A name together with a range of versions.
+
+    The range is expressed by a list of *constraints*, pairs (operator,
+    version) which must all be satisfied. For compatibility, *op* and *ver*
+    are the first constraint of the list.
+    """
 
     # Available release statuses.
     # Order matters.
@@ -38,10 +43,17 @@ class Spec(object):
         dirname=None,
         filename=None,
         url=None,
+        constraints=None,
     ):
         self.name = name and name.lower()
-        self.op = op
-        self.ver = ver
+        if constraints is None:
+            constraints = op is not None and [(op, ver)] or []
+        self.constraints = constraints
+        if constraints:
+            self.op, self.ver = constraints[0]
+        else:
+            self.op = self.ver = None
+        self._range = None
 
         # point to local files or specific resources
         self.dirname = dirname
@@ -65,10 +77,9 @@ class Spec(object):
 
     def __str__(self):
         name = self.name or self.filename or self.dirname or self.url or "???"
-        if self.op is None:
-            return name
-        else:
-            return "%s%s%s" % (name, self.op, self.ver)
+        return name + ','.join(
+            "%s%s" % (op, ver) for op, ver in self.constraints
+        )
 
     @classmethod
     def parse(self, spec):
@@ -99,37 +110,123 @@ class Spec(object):
 
         # so we think it's a PGXN spec
 
-        # split operator/version and name
-        m = re.match(r'(.+?)(?:(==|=|>=|>|<=|<)(.*))?$', spec)
+        # split operator/version and name. Many comma-separated constraints
+        # may be specified, e.g. 'foo>=1.2,<2.0,!=1.5.0'
+        m = re.match(r'(.+?)(?:(==|=|!=|>=|>|<=|<)(.*))?$', spec)
         if m is None:
             raise BadSpecError(
                 _("bad format for version specification: '%s'"), spec
             )
 
         name = Term(m.group(1))
-        op = m.group(2)
-        if op == '=':
-            op = '=='
+        constraints = []
+        if m.group(2) is not None:
+            for bit in (m.group(2) + m.group(3)).split(','):
+                m1 = re.match(r'\s*(==|=|!=|>=|>|<=|<)(.*)$', bit)
+                if m1 is None:
+                    raise BadSpecError(
+                        _("bad format for version specification: '%s'") % spec
+                    )
+                op = m1.group(1)
+                if op == '=':
+                    op = '=='
+                constraints.append((op, SemVer(SemVer.clean(m1.group(2)))))
+
+        return Spec(name, constraints=constraints)
+
+    @property
+    def range(self):
+        """The `VersionRange` of the versions accepted by the spec."""
+        if self._range is None:
+            self._range = VersionRange(self.constraints)
+        return self._range
+
+    def accepted(self, version):
+        """Return True if the given version is accepted in the spec."""
+        if not self.constraints:
+            return True
+        return version in self.range
+
+
+class VersionRange(object):
+    """
+    The set of versions satisfying a list of (operator, version) constraints.
+
+    The constraints are compiled into a sorted list of disjoint `!intervals`
+    of version keys (see `SemVer.key`). Each interval is a pair (low, high)
+    of bounds: each bound is `!None` if unbounded, otherwise a pair (key,
+    inclusive).
+    """
+
+    def __init__(self, constraints=()):
+        intervals = [(None, None)]
+        for op, ver in constraints:
+            k = SemVer(ver).key
+            if op == '==':
+                new = [((k, True), (k, True))]
+            elif op == '!=':
+                new = [(None, (k, False)), ((k, False), None)]
+            elif op == '<':
+                new = [(None, (k, False))]
+            elif op == '<=':
+                new = [(None, (k, True))]
+            elif op == '>':
+                new = [((k, False), None)]
+            elif op == '>=':
+                new = [((k, True), None)]
+            else:
+                raise ValueError("bad operator: %r" % op)
+
+            intervals = [
+                iv
+                for iv in (_intersect(i, j) for i in intervals for j in new)
+                if iv is not None
+            ]
+
+        intervals.sort(key=lambda iv: _low_key(iv[0]))
+        self.intervals = intervals
+        self._lows = [_low_key(iv[0]) for iv in intervals]
+
+    def __contains__(self, version):
+        key = SemVer(version).key
+        i = bisect_right(self._lows, key) - 1
+        if i < 0:
+            return False
+
+        lo, hi = self.intervals[i]
+        if lo is not None and key == lo[0] and not lo[1]:
+            return False
+        if hi is not None and (key > hi[0] or (key == hi[0] and not hi[1])):
+            return False
+        return True
+
+    def is_empty(self):
+        return not self.intervals
+
+
+def _low_key(bound):
+    # the empty tuple sorts before any version key
+    if bound is None:
+        return ()
+    return bound[0]
+
+
+def _intersect(i1, i2):
+    """Return the intersection of two intervals, `!None` if empty."""
+    # the higher low bound; on equal keys the exclusive bound is stricter
+    lo = i1[0]
+    if lo is None or (
+        i2[0] is not None and (i2[0][0], not i2[0][1]) > (lo[0], not lo[1])
+    ):
+        lo = i2[0]
 
-        if op is not None:
-            ver = SemVer.clean(m.group(3))
-        else:
-            ver = None
+    # the lower high bound
+    hi = i1[1]
+    if hi is None or (i2[1] is not None and i2[1] < hi):
+        hi = i2[1]
 
-        return Spec(name, op, ver)
+    if lo is not None and hi is not None:
+        if lo[0] > hi[0] or (lo[0] == hi[0] and not (lo[1] and hi[1])):
+            return None
 
-    def accepted(
-        self,
-        version,
-        _map={
-            '==': _op.eq,
-            '<=': _op.le,
-            '<': _op.lt,
-            '>=': _op.ge,
-            '>': _op.gt,
-        },
-    ):
-        """Return True if the given version is accepted in the spec."""
-        if self.op is None:
-            return True
-        return _map[self.op](version, self.ver)
+    return lo, hi
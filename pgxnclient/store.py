@@ -0,0 +1,252 @@
+"""
+pgxnclient -- store of unpacked distributions
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+import os
+import stat
+import errno
+import shutil
+import tempfile
+
+from pgxnclient.i18n import _
+from pgxnclient.utils.cache import (
+    TEMP_PREFIX,
+    get_cache_dir,
+    sweep_temp_files,
+)
+
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('pgxnclient.store')
+
+# ioctl(2) request to share the data blocks of a file (Linux, btrfs/xfs)
+FICLONE = 0x40049409
+
+# errors meaning that a clone method is not supported between two paths
+_UNSUPPORTED = frozenset(
+    getattr(errno, n)
+    for n in 'EOPNOTSUPP ENOTSUP ENOTTY EINVAL EXDEV EPERM'.split()
+    if hasattr(errno, n)
+)
+
+_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+class TreeStore(object):
+    """
+    A collection of read-only unpacked archives, indexed by their SHA-1.
+
+    Commands working on the same archive can obtain a working copy of its
+    content from the store instead of unpacking it again. Working copies are
+    cloned from the stored tree using reflinks where supported by the
+    filesystem, falling back on a regular copy.
+
+    Hardlinks are not used: a build modifying a file in place, for instance
+    running as root, would corrupt the stored tree.
+    """
+
+    def __init__(self, root=None):
+        if root is None:
+            root = get_cache_dir('trees')
+        self.root = root
+
+    def get_path(self, chk):
+        """Return the path of the tree of the archive with sha1 *chk*."""
+        return os.path.join(self.root, chk)
+
+    def has(self, chk):
+        """Return `!True` if the tree for the sha1 *chk* is available."""
+        return os.path.isdir(self.get_path(chk))
+
+    def get_size(self, chk):
+        """Return the total size in bytes of the files in the tree *chk*."""
+        rv = 0
+        for dir, dirnames, filenames in os.walk(self.get_path(chk)):
+            for fn in filenames:
+                rv += os.lstat(os.path.join(dir, fn)).st_size
+        return rv
+
+    def add(self, chk, srcdir):
+        """Add the content of the directory *srcdir* to the store.
+
+        The tree is first cloned in a temporary directory and then moved in
+        place, so concurrent processes never see a partial tree.
+        """
+        if self.has(chk):
+            return
+
+        logger.debug("storing %s as %s", srcdir, chk)
+        tmpdir = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=self.root)
+        try:
+            clone_tree(srcdir, tmpdir, writable=False)
+            os.rename(tmpdir, self.get_path(chk))
+        except (IOError, OSError) as e:
+            # The store is a cache: failing to populate it is not an error
+            logger.debug(_("cannot store tree %s: %s"), chk, e)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def gc(self):
+        """Delete the leftovers of interrupted `add()`.
+
+        Return the list of paths deleted.
+        """
+        return sweep_temp_files(self.root)
+
+    def materialize(self, chk, destdir):
+        """Create a working copy of the tree *chk* into *destdir*."""
+        logger.info(_("using the cached tree of archive %s"), chk)
+        clone_tree(self.get_path(chk), destdir, writable=True)
+        return destdir
+
+
+class ArchiveStore(object):
+    """
+    A collection of distribution archives, indexed by their SHA-1.
+
+    The archives can be found from the distribution META without accessing
+    the network. The store directory is only created when first used: if it
+    can't be, the store is empty and nothing is added.
+    """
+
+    def __init__(self, root=None):
+        self._root = root
+
+    @property
+    def root(self):
+        """The store directory. Raise `OSError` if it can't be created."""
+        if self._root is None:
+            self._root = get_cache_dir('distributions')
+        return self._root
+
+    def get_path(self, chk):
+        """Return the path of the archive with sha1 *chk*."""
+        return os.path.join(self.root, chk)
+
+    def has(self, chk):
+        """Return `!True` if the archive with sha1 *chk* is available."""
+        try:
+            return os.path.isfile(self.get_path(chk))
+        except OSError as e:
+            logger.debug(_("cannot access the archive store: %s"), e)
+            return False
+
+    def add(self, chk, fn):
+        """Add a copy of the archive *fn* to the store.
+
+        The caller is responsible to verify that *chk* is the sha1 of *fn*.
+        """
+        if self.has(chk):
+            return
+
+        logger.debug("storing %s as %s", fn, chk)
+        f = None
+        try:
+            f = tempfile.NamedTemporaryFile(
+                prefix=TEMP_PREFIX, dir=self.root, delete=False
+            )
+            with f:
+                with open(fn, 'rb') as fin:
+                    shutil.copyfileobj(fin, f)
+            os.chmod(f.name, 0o444)
+            os.rename(f.name, self.get_path(chk))
+        except (IOError, OSError) as e:
+            # The store is a cache: failing to populate it is not an error
+            logger.debug(_("cannot store archive %s: %s"), chk, e)
+            if f is not None and os.path.exists(f.name):
+                os.unlink(f.name)
+
+    def gc(self):
+        """Delete the leftovers of interrupted `add()`.
+
+        Return the list of paths deleted.
+        """
+        return sweep_temp_files(self.root)
+
+    def materialize(self, chk, fn):
+        """Create a copy of the archive *chk* named *fn*."""
+        logger.info(_("using the cached archive %s"), chk)
+        FileCloner()(self.get_path(chk), fn, writable=True)
+        return fn
+
+
+def clone_tree(srcdir, destdir, writable=True):
+    """
+    Replicate the content of *srcdir* into *destdir*.
+
+    Files are cloned using a `FileCloner`. If not *writable*, the write
+    permission of the regular files cloned is removed.
+    """
+    cloner = FileCloner()
+    for dir, dirnames, filenames in os.walk(srcdir):
+        rel = os.path.relpath(dir, srcdir)
+        ddir = os.path.normpath(os.path.join(destdir, rel))
+        if not os.path.isdir(ddir):
+            os.makedirs(ddir)
+
+        # os.walk lists symlinks to dirs among dirs, but doesn't recurse
+        for fn in dirnames + filenames:
+            src = os.path.join(dir, fn)
+            dst = os.path.join(ddir, fn)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif os.path.isfile(src):
+                cloner(src, dst, writable=writable)
+
+
+class FileCloner(object):
+    """
+    Callable object cloning files with the cheapest method available.
+
+    Methods are tried in the order reflink, copy. Once a method fails
+    because not supported, it is not tried again by the same object.
+
+    Files are never hardlinked, so the clones don't share their mode and
+    content with the source.
+    """
+
+    def __init__(self):
+        self.methods = [self.reflink, self.copy]
+        if fcntl is None:
+            del self.methods[0]
+
+    def __call__(self, src, dst, writable=True):
+        while 1:
+            meth = self.methods[0]
+            try:
+                meth(src, dst)
+            except (IOError, OSError) as e:
+                if len(self.methods) == 1 or e.errno not in _UNSUPPORTED:
+                    raise
+                logger.debug(
+                    "%s not supported cloning %s: %s", meth.__name__, src, e
+                )
+                if os.path.lexists(dst):
+                    os.unlink(dst)
+                del self.methods[0]
+            else:
+                break
+
+        mode = stat.S_IMODE(os.stat(src).st_mode)
+        if not writable:
+            os.chmod(dst, mode & ~_WRITE_BITS)
+        else:
+            os.chmod(dst, mode | stat.S_IWUSR)
+
+    @staticmethod
+    def reflink(src, dst):
+        with open(src, 'rb') as fin:
+            with open(dst, 'wb') as fout:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+
+    @staticmethod
+    def copy(src, dst):
+        shutil.copyfile(src, dst)
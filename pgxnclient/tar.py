@@ -7,6 +7,7 @@ pgxnclient -- tar file utilities
 # This file is part of the PGXN client
 
 import os
+import struct
 import tarfile
 
 from pgxnclient.i18n import _
@@ -17,10 +18,14 @@ import logging
 
 logger = logging.getLogger('pgxnclient.tar')
 
+# Extraction filter, available from Python 3.12 and in some bugfix releases
+data_filter = getattr(tarfile, 'data_filter', None)
+
 
 class TarArchive(Archive):
     """Handle .tar archives"""
 
+    type = 'tar'
     _file = None
 
     def can_open(self):
@@ -48,25 +53,115 @@ class TarArchive(Archive):
         assert self._file, "archive not open"
         return self._file.extractfile(fn).read()
 
+    def get_unpacked_size(self):
+        # A gzip file stores the size of the uncompressed data (modulo 2^32)
+        # in its last 4 bytes, which is the size of the tar: a good enough
+        # estimate without decompressing the whole file.
+        with open(self.filename, 'rb') as f:
+            magic = f.read(6)
+            if magic[:2] == b'\x1f\x8b':
+                f.seek(-4, os.SEEK_END)
+                return struct.unpack('<I', f.read(4))[0]
+
+        # Other compressions would need a scan of the entire file
+        if magic[:3] == b'BZh' or magic == b'\xfd7zXZ\x00':
+            return None
+
+        self.open()
+        try:
+            return sum(m.size for m in self._file.getmembers())
+        finally:
+            self.close()
+
     def unpack(self, destdir):
         tarname = self.filename
         logger.info(_("unpacking: %s"), tarname)
         destdir = os.path.abspath(destdir)
         self.open()
         try:
-            for fn in self.list_files():
-                fname = os.path.abspath(os.path.join(destdir, fn))
-                if not fname.startswith(destdir):
-                    raise PgxnClientException(
-                        _("archive file '%s' trying to escape!") % fname
-                    )
-
-            self._file.extractall(path=destdir)
+            # Members are validated and extracted in a single pass on the
+            # file. Directories attributes are set at the end, as extractall
+            # does, so that files can be created in read-only dirs.
+            dirs = []
+            for member in self._file:
+                member = self._filter_member(member, destdir)
+                if member is None:
+                    continue
+
+                if member.isdir():
+                    path = os.path.join(destdir, member.name)
+                    if not os.path.isdir(path):
+                        os.makedirs(path)
+                    dirs.append(member)
+                    continue
+
+                logger.debug(_("saving: %s"), member.name)
+                if data_filter is not None:
+                    # already filtered
+                    self._file.extract(member, destdir, filter='fully_trusted')
+                else:
+                    self._file.extract(member, destdir)
+
+            dirs.sort(key=lambda m: m.name, reverse=True)
+            for member in dirs:
+                path = os.path.join(destdir, member.name)
+                try:
+                    self._file.utime(member, path)
+                    self._file.chmod(member, path)
+                except tarfile.ExtractError as e:
+                    logger.debug("can't set attributes of %s: %s", path, e)
         finally:
             self.close()
 
         return self._find_work_directory(destdir)
 
+    def _filter_member(self, member, destdir):
+        """
+        Validate a member before extracting it into *destdir*.
+
+        Return the member to extract, or `!None` if it should be skipped.
+        Raise `PgxnClientException` if the member is not safe to extract.
+        """
+        if not (
+            member.isreg()
+            or member.isdir()
+            or member.issym()
+            or member.islnk()
+        ):
+            logger.warning(
+                _("skipping special file in archive: %s"), member.name
+            )
+            return None
+
+        if data_filter is not None:
+            try:
+                return data_filter(member, destdir)
+            except tarfile.FilterError as e:
+                raise PgxnClientException(
+                    _("archive file '%s' trying to escape: %s")
+                    % (member.name, e)
+                )
+
+        # Fallback for Python versions without the extraction filters
+        fname = os.path.abspath(os.path.join(destdir, member.name))
+        if not fname.startswith(destdir + os.sep):
+            raise PgxnClientException(
+                _("archive file '%s' trying to escape!") % fname
+            )
+
+        if member.issym() or member.islnk():
+            if member.issym():
+                base = os.path.dirname(fname)
+            else:
+                base = destdir
+            target = os.path.abspath(os.path.join(base, member.linkname))
+            if not target.startswith(destdir + os.sep):
+                raise PgxnClientException(
+                    _("archive link '%s' trying to escape!") % fname
+                )
+
+        return member
+
 
 def unpack(filename, destdir):
     return TarArchive(filename).unpack(destdir)
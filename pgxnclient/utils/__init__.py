@@ -9,7 +9,14 @@ pgxnclient -- misc utilities package
 
 from __future__ import print_function
 
-__all__ = ['emit', 'load_json', 'load_jsons', 'sha1', 'find_executable']
+__all__ = [
+    'emit',
+    'load_json',
+    'load_jsons',
+    'sha1',
+    'file_sha1',
+    'find_executable',
+]
 
 
 import os
@@ -59,6 +66,19 @@ def load_jsons(data):
     return json.loads(data, object_pairs_hook=OrderedDict)
 
 
+def file_sha1(fn):
+    """Return the hex sha1 of the content of the file *fn*."""
+    sha = sha1()
+    with open(fn, "rb") as f:
+        while 1:
+            data = f.read(8192)
+            if not data:
+                break
+            sha.update(data)
+
+    return sha.hexdigest()
+
+
 def find_executable(name):
     """
     Find executable by ``name`` by inspecting PATH environment variable, return
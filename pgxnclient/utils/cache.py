@@ -0,0 +1,83 @@
+"""
+pgxnclient -- local cache location
+"""
+
+# Copyright (C) 2011-2021 Daniele Varrazzo
+
+# This file is part of the PGXN client
+
+import os
+import time
+import shutil
+
+import logging
+
+logger = logging.getLogger('pgxnclient.utils.cache')
+
+# Prefix of the files and dirs to be renamed into the cache once complete
+TEMP_PREFIX = '.tmp-'
+
+
+def get_cache_dir(*parts):
+    """
+    Return the absolute path of the client cache directory.
+
+    The directory can be specified using the :envvar:`PGXN_CACHE_DIR`
+    environment variable, otherwise it is the ``pgxnclient`` directory in the
+    XDG cache directory (usually ``~/.cache``). If *parts* are specified,
+    return the path of a directory inside the cache, which is created if
+    missing.
+    """
+    root = os.environ.get('PGXN_CACHE_DIR')
+    if not root:
+        root = os.path.join(
+            os.environ.get('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'),
+            'pgxnclient',
+        )
+
+    rv = os.path.abspath(os.path.join(root, *parts))
+    if not os.path.isdir(rv):
+        try:
+            os.makedirs(rv)
+        except OSError:
+            # maybe created by a concurrent process
+            if not os.path.isdir(rv):
+                raise
+
+    return rv
+
+
+def sweep_temp_files(dir, max_age=3600):
+    """
+    Delete the incomplete files left in the cache directory *dir*.
+
+    Only the temporary files older than *max_age* seconds are deleted, in
+    order to leave alone the ones still being written. Return the list of
+    paths deleted.
+    """
+    try:
+        names = os.listdir(dir)
+    except OSError:
+        return []
+
+    rv = []
+    now = time.time()
+    for name in names:
+        if not name.startswith(TEMP_PREFIX):
+            continue
+        fn = os.path.join(dir, name)
+        try:
+            if now - os.lstat(fn).st_mtime < max_age:
+                continue
+            logger.debug("deleting %s", fn)
+            if os.path.isdir(fn) and not os.path.islink(fn):
+                shutil.rmtree(fn)
+            else:
+                os.unlink(fn)
+        except OSError as e:
+            logger.debug("can't delete %s: %s", fn, e)
+        else:
+            rv.append(fn)
+
+    return rv
@@ -31,20 +31,93 @@ understand each other.
 # This file is part of the PGXN client
 
 import re
-import operator
+import threading
+from collections import namedtuple, OrderedDict
+
+import six
 
 from pgxnclient.i18n import _
 
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+
+class InternTable(object):
+    """
+    A thread-safe mapping holding up to *maxsize* items.
+
+    When full, the least recently used items are discarded.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value of *key*, or `!None` if not found."""
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except (KeyError, TypeError):
+                self.misses += 1
+                return None
+
+            # mark as most recently used
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(
+                self.hits, self.misses, self.maxsize, len(self._data)
+            )
+
 
 class SemVer(str):
     """A string representing a semantic version number.
 
     Non valid version numbers raise ValueError.
+
+    The `!key` attribute is a tuple ordered as the versions are: it can be
+    used to sort many versions faster than comparing the `!SemVer` objects.
     """
 
+    # Python 2 doesn't support non-empty slots for str subclasses
+    if six.PY3:
+        __slots__ = ('tuple', 'key')
+
+    # The same version numbers are parsed over and over: keep the instances
+    # most recently created and return them again, as they are immutable.
+    _interned = InternTable(10000)
+    _cleaned = InternTable(1000)
+
     def __new__(cls, value):
+        if cls is not SemVer:
+            return cls._create(value)
+        if type(value) is SemVer:
+            return value
+
+        self = cls._interned.get(value)
+        if self is None:
+            self = cls._create(value)
+            cls._interned.put(value, self)
+        return self
+
+    @classmethod
+    def _create(cls, value):
         self = str.__new__(cls, value)
-        self.tuple = SemVer.parse(value)
+        self.tuple = t = SemVer.parse(value)
+        # Versions with no trail come after the ones with the trail
+        self.key = t[:3] + (not t[3], t[3].lower())
         return self
 
     @property
@@ -66,54 +139,52 @@ class SemVer(str):
     def __repr__(self):
         return "%s(%r)" % (self.__class__.__name__, str(self))
 
-    def __eq__(self, other):
+    def _other_key(self, other):
         if isinstance(other, SemVer):
-            return (
-                self.tuple[:3] == other.tuple[:3]
-                and self.tuple[3].lower() == other.tuple[3].lower()
-            )
+            return other.key
         elif isinstance(other, str):
-            return self == SemVer(other)
+            return SemVer(other).key
         else:
+            return None
+
+    def __eq__(self, other):
+        key = self._other_key(other)
+        if key is None:
             return NotImplemented
+        return self.key == key
 
     def __ne__(self, other):
-        return not self == other
+        key = self._other_key(other)
+        if key is None:
+            return NotImplemented
+        return self.key != key
 
     def __hash__(self):
-        return hash(self.tuple[:3] + (self.tuple[3].lower(),))
+        return hash(self.key)
 
-    def _ltgt(self, other, op):
-        if isinstance(other, SemVer):
-            t1 = self.tuple[:3]
-            t2 = other.tuple[:3]
-            if t1 != t2:
-                return op(t1, t2)
-
-            s1 = self.tuple[3].lower()
-            s2 = other.tuple[3].lower()
-            if s1 == s2:
-                return False
-            if s1 and s2:
-                return op(s1, s2)
-            return op(bool(s2), bool(s1))
-
-        elif isinstance(other, str):
-            return op(self, SemVer(other))
-        else:
+    def __lt__(self, other):
+        key = self._other_key(other)
+        if key is None:
             return NotImplemented
-
-    def __lt__(self, other, op=operator.lt):
-        return self._ltgt(other, operator.lt)
+        return self.key < key
 
     def __gt__(self, other):
-        return self._ltgt(other, operator.gt)
+        key = self._other_key(other)
+        if key is None:
+            return NotImplemented
+        return self.key > key
 
     def __ge__(self, other):
-        return not self < other
+        key = self._other_key(other)
+        if key is None:
+            return NotImplemented
+        return self.key >= key
 
     def __le__(self, other):
-        return not other < self
+        key = self._other_key(other)
+        if key is None:
+            return NotImplemented
+        return self.key <= key
 
     @classmethod
     def parse(self, s):
@@ -136,6 +207,14 @@ class SemVer(str):
         """
         Convert an invalid but still recognizable version number into a SemVer.
         """
+        rv = self._cleaned.get(s)
+        if rv is None:
+            rv = self._clean(s)
+            self._cleaned.put(s, rv)
+        return rv
+
+    @classmethod
+    def _clean(self, s):
         m = re_clean.match(s.strip())
         if m is None:
             raise ValueError(_("bad version number: '%s' - can't clean") % s)
@@ -147,6 +226,20 @@ class SemVer(str):
         trail = trail and '-' + trail.strip() or ''
         return "%d.%d.%d%s" % (maj, min, patch, trail)
 
+    @classmethod
+    def cache_info(self):
+        """
+        Return statistics about the reuse of parsed versions.
+
+        Return a dict with keys ``parse`` and ``clean`` and `CacheInfo`
+        values, reporting about the `!SemVer` instances and the `clean()`
+        results respectively.
+        """
+        return {
+            'parse': self._interned.cache_info(),
+            'clean': self._cleaned.cache_info(),
+        }
+
 
 re_semver = re.compile(
     r"""
@@ -6,14 +6,275 @@ pgxnclient -- temp files utilities
 
 # This file is part of the PGXN client
 
+import os
+import re
+import sys
+import stat
 import shutil
+import getpass
 import tempfile
+import threading
 import contextlib
+import subprocess
+
+import six
+
+import logging
+
+logger = logging.getLogger('pgxnclient.utils.temp')
+
+# Name of the directory, sibling of the temp dirs, where to move the dirs to
+# delete asynchronously. The user id is appended, so that every user has its
+# own trash in shared temp dirs.
+TRASH_DIR = 'pgxn-trash'
+
+# How to remove the temp dirs
+SYNC = 'sync'  # in the current thread, before leaving the context
+THREAD = 'thread'  # in a background thread
+PROCESS = 'process'  # in a detached process, which may outlive us
+
+# Filesystem types whose content is kept in memory
+RAM_FS_TYPES = frozenset(['tmpfs', 'ramfs'])
+
+# Estimated ratio between the space used by a build and the unpacked size
+BUILD_SIZE_RATIO = 4
+
+# Maximum space a build can take on a RAM-backed filesystem, in MB
+RAM_BUILD_MAX = 1024
 
 
 @contextlib.contextmanager
-def temp_dir():
-    """Context manager to create a temp dir and delete after usage."""
-    dir = tempfile.mkdtemp()
-    yield dir
-    shutil.rmtree(dir)
+def temp_dir(cleanup=SYNC, dir=None):
+    """Context manager to create a temp dir and delete after usage.
+
+    :param cleanup: how to delete the directory: `SYNC`, `THREAD`, `PROCESS`.
+        In the asynchronous modes the directory is moved into a trash
+        directory and deleted in background.
+    :param dir: the directory where to create the temp dir. If not specified
+        use the system default.
+    """
+    dir = tempfile.mkdtemp(dir=dir)
+    try:
+        yield dir
+    finally:
+        remove_dir(dir, cleanup)
+
+
+def remove_dir(dir, cleanup=SYNC):
+    """Delete the directory *dir*, possibly in background."""
+    if cleanup == SYNC:
+        shutil.rmtree(dir)
+        return
+
+    try:
+        trash = get_trash_dir(os.path.dirname(dir))
+        dest = os.path.join(trash, os.path.basename(dir))
+        os.rename(dir, dest)
+    except OSError as e:
+        logger.debug("can't move %s to trash: %s", dir, e)
+        shutil.rmtree(dir)
+        return
+
+    logger.debug("deleting %s in background", dest)
+    if cleanup == THREAD:
+        t = threading.Thread(target=shutil.rmtree, args=(dest, True))
+        t.daemon = True
+        t.start()
+    elif cleanup == PROCESS:
+        _spawn_rmtree(dest)
+    else:
+        raise ValueError("bad cleanup mode: %r" % cleanup)
+
+
+def get_trash_name():
+    """Return the name of the trash directory of the current user."""
+    try:
+        user = os.getuid()
+    except AttributeError:
+        # Windows
+        user = getpass.getuser()
+    return '%s-%s' % (TRASH_DIR, user)
+
+
+def get_trash_dir(root):
+    """
+    Return the trash directory for the temp dirs created in *root*.
+
+    The directory is only accessible by the current user. Raise `OSError` if
+    it exists but it is not a directory owned by the user.
+    """
+    trash = os.path.join(root, get_trash_name())
+    try:
+        os.mkdir(trash, 0o700)
+    except OSError:
+        if not os.path.isdir(trash):
+            raise
+    _check_owned(trash)
+    return trash
+
+
+def _check_owned(path):
+    """Raise `OSError` unless *path* is a directory of the current user."""
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError("not a directory: %s" % path)
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise OSError("directory not owned by the user: %s" % path)
+
+
+def sweep_trash(root=None):
+    """
+    Delete what left in the trash directory of *root* by background cleanups.
+
+    If *root* is not specified use the default temp dir. Only the trash of
+    the current user is emptied. Return the list of paths deleted.
+    """
+    if root is None:
+        root = tempfile.gettempdir()
+    trash = os.path.join(root, get_trash_name())
+    try:
+        _check_owned(trash)
+        names = os.listdir(trash)
+    except OSError:
+        return []
+
+    rv = []
+    for name in names:
+        fn = os.path.join(trash, name)
+        logger.debug("deleting %s", fn)
+        shutil.rmtree(fn, ignore_errors=True)
+        rv.append(fn)
+
+    return rv
+
+
+def get_scratch_root(size):
+    """
+    Return the directory where to build a tree of *size* bytes.
+
+    Return a directory on a RAM-backed filesystem (such as ``/dev/shm``) if
+    there is one with enough free space and if the expected build size is
+    not larger than :envvar:`PGXN_RAMDISK_MAX` MB (default `RAM_BUILD_MAX`).
+    Otherwise return `!None`, meaning the default temp directory.
+    """
+    if size is None:
+        return None
+
+    need = size * BUILD_SIZE_RATIO
+    try:
+        limit = int(os.environ.get('PGXN_RAMDISK_MAX', RAM_BUILD_MAX))
+    except ValueError:
+        limit = RAM_BUILD_MAX
+    if need > limit * 1024 * 1024:
+        logger.debug("build of %d bytes too big to be done in RAM", size)
+        return None
+
+    for dir in get_ram_dirs():
+        st = os.statvfs(dir)
+        if need <= st.f_bavail * st.f_frsize:
+            logger.debug("building in %s", dir)
+            return dir
+
+    return None
+
+
+def get_scratch_roots():
+    """Return all the directories where build dirs may have been created."""
+    rv = [tempfile.gettempdir()]
+    for dir in [os.environ.get('PGXN_WORKDIR')] + get_ram_dirs():
+        if dir and dir not in rv:
+            rv.append(dir)
+    return rv
+
+
+def get_ram_dirs():
+    """
+    Return the writable temp directories on a RAM-backed filesystem.
+
+    Filesystems mounted ``noexec`` are skipped, as the builds must run
+    scripts such as :file:`configure`.
+    """
+    mounts = _get_mounts()
+    if not mounts:
+        return []
+
+    rv = []
+    for dir in (
+        tempfile.gettempdir(),
+        '/dev/shm',
+        os.environ.get('XDG_RUNTIME_DIR'),
+    ):
+        if not dir or dir in rv or not os.path.isdir(dir):
+            continue
+        if not os.access(dir, os.W_OK | os.X_OK):
+            continue
+
+        # Find the mount point containing the directory
+        path = os.path.realpath(dir)
+        mps = [
+            mp
+            for mp in mounts
+            if path == mp or path.startswith(mp.rstrip('/') + '/')
+        ]
+        if not mps:
+            continue
+        fstype, opts = mounts[max(mps, key=len)]
+        if fstype in RAM_FS_TYPES and 'noexec' not in opts:
+            rv.append(dir)
+
+    return rv
+
+
+def _get_mounts():
+    """
+    Return the mounted filesystems as a dict mountpoint -> (type, options).
+
+    The options are returned as a set of strings.
+    """
+    rv = {}
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                bits = line.split()
+                if len(bits) < 4:
+                    continue
+                # spaces and other chars are escaped as octal
+                mp = re.sub(
+                    r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), bits[1]
+                )
+                rv[mp] = (bits[2], frozenset(bits[3].split(',')))
+    except (IOError, OSError):
+        pass
+
+    return rv
+
+
+def _spawn_rmtree(dir):
+    """Delete *dir* in a process detached from the current one."""
+    cmdline = [
+        sys.executable,
+        '-c',
+        'import sys, shutil; shutil.rmtree(sys.argv[1], True)',
+        dir,
+    ]
+    kwargs = {}
+    if six.PY3:
+        kwargs['start_new_session'] = True
+    elif hasattr(os, 'setsid'):
+        kwargs['preexec_fn'] = os.setsid
+
+    devnull = open(os.devnull, 'r+b')
+    try:
+        subprocess.Popen(
+            cmdline,
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+            **kwargs
+        )
+    except OSError as e:
+        # The leftovers can be deleted by 'pgxn cache gc'
+        logger.debug("can't spawn cleanup process: %s", e)
+    finally:
+        devnull.close()
@@ -33,7 +33,7 @@ import re
 import six
 from six.moves.urllib.parse import quote
 
-__all__ = ["expand_template", "TemplateSyntaxError"]
+__all__ = ["expand_template", "compile_template", "TemplateSyntaxError"]
 
 
 class TemplateSyntaxError(Exception):
@@ -45,23 +45,83 @@ _template_pattern = re.compile(r"{([^}]+)}")
 
 def expand_template(template, values={}, **kwargs):
     """Expand a URI template."""
-    values = values.copy()
-    values.update(kwargs)
-    values = percent_encode(values)
-    return _template_pattern.sub(lambda m: _handle_match(m, values), template)
-
-
-def _handle_match(match, values):
-    op, arg, variables = parse_expansion(match.group(1))
-    if op:
-        try:
-            return getattr(_operators, op)(variables, arg, values)
-        except AttributeError:
-            raise TemplateSyntaxError("Unexpected operator: %r" % op)
-    else:
-        assert len(variables) == 1
-        key, default = list(variables.items())[0]
-        return values.get(key, default)
+    nodes, names = compile_template(template)
+    if kwargs:
+        values = dict(values, **kwargs)
+
+    # Only encode the values used by the template
+    encoded = {}
+    for k in names:
+        if k in values:
+            encoded[k] = _encode(values[k])
+
+    parts = []
+    for node in nodes:
+        if isinstance(node, six.string_types):
+            parts.append(node)
+            continue
+
+        func, arg, variables = node
+        if func is not None:
+            v = func(variables, arg, encoded)
+        else:
+            key, default = list(variables.items())[0]
+            v = encoded.get(key, default)
+        if v:
+            parts.append(v)
+
+    return ''.join(parts)
+
+
+# The templates already compiled
+_compiled = {}
+
+
+def compile_template(template):
+    """
+    Parse a URI template.
+
+    Return a pair (nodes, names) where *nodes* is a list of literal strings
+    and of (operator function, argument, variables) tuples for the
+    expansions, and *names* is the set of the variables used. The result is
+    cached, so that each template is only parsed once.
+
+        >>> compile_template("http://example.org/{-prefix|/|a}{b}")[0][0]
+        'http://example.org/'
+        >>> sorted(compile_template("http://example.org/{-prefix|/|a}{b}")[1])
+        ['a', 'b']
+
+    """
+    try:
+        return _compiled[template]
+    except KeyError:
+        pass
+
+    nodes = []
+    names = set()
+    pos = 0
+    for m in _template_pattern.finditer(template):
+        if m.start() > pos:
+            nodes.append(template[pos : m.start()])
+        pos = m.end()
+
+        op, arg, variables = parse_expansion(m.group(1))
+        if op:
+            func = getattr(_operators, op, None)
+            if func is None:
+                raise TemplateSyntaxError("Unexpected operator: %r" % op)
+        else:
+            assert len(variables) == 1
+            func = None
+
+        nodes.append((func, arg, variables))
+        names.update(variables)
+
+    if pos < len(template):
+        nodes.append(template[pos:])
+
+    rv = _compiled[template] = (nodes, frozenset(names))
+    return rv
 
 
 #
@@ -120,13 +180,17 @@ def parse_expansion(expansion):
 def percent_encode(values):
     rv = {}
     for k, v in values.items():
-        if isinstance(v, six.string_types):
-            rv[k] = quote(v)
-        else:
-            rv[k] = [quote(s) for s in v]
+        rv[k] = _encode(v)
     return rv
 
 
+def _encode(v):
+    if isinstance(v, six.string_types):
+        return quote(v)
+    else:
+        return [quote(s) for s in v]
+
+
 #
 # Operators; see Section 3.3.
 # Shoved into a class just so we have an ad hoc namespace.
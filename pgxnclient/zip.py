@@ -22,6 +22,7 @@ logger = logging.getLogger('pgxnclient.zip')
 class ZipArchive(Archive):
     """Handle .zip archives"""
 
+    type = 'zip'
     _file = None
 
     def can_open(self):
@@ -49,6 +50,14 @@ class ZipArchive(Archive):
         assert self._file, "archive not open"
         return self._file.read(fn)
 
+    def get_unpacked_size(self):
+        # The sizes are in the zip central directory: no need to decompress
+        self.open()
+        try:
+            return sum(i.file_size for i in self._file.infolist())
+        finally:
+            self.close()
+
     def unpack(self, destdir):
         zipname = self.filename
         logger.info(_("unpacking: %s"), zipname)
@@ -10,8 +10,15 @@ in order to correctly set up the pythonpath.
 # This file is part of the PGXN client
 
 
+import os
+import atexit
+import shutil
+import tempfile
 import unittest
 
+# Don't mess with the user cache
+os.environ['PGXN_CACHE_DIR'] = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, os.environ['PGXN_CACHE_DIR'], True)
 
 # fix unittest maintainers stubborness: see Python issue #9424
 if unittest.TestCase.assert_ is not unittest.TestCase.assertTrue:
@@ -0,0 +1,99 @@
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import patch
+
+from pgxnclient import aioapi
+from pgxnclient.errors import NotFound, ResourceNotFound
+
+from .test_commands import fake_get_file
+
+
+@unittest.skipIf(aioapi.asyncio is None, "asyncio not available")
+class AsyncApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = aioapi.asyncio.new_event_loop()
+        aioapi.asyncio.set_event_loop(self.loop)
+        self.api = aioapi.AsyncApi('https://api.pgxn.org/', concurrency=3)
+
+        p = patch('pgxnclient.network.get_file', self.get_file)
+        p.start()
+        self.addCleanup(p.stop)
+
+        self.lock = threading.Lock()
+        self.running = self.max_running = 0
+
+    def tearDown(self):
+        self.api.close()
+        aioapi.asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def get_file(self, url, **kwargs):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(0.02)
+            return fake_get_file(url, **kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def gather(self, *aws):
+        return self.loop.run_until_complete(
+            aioapi.asyncio.gather(*aws, return_exceptions=True)
+        )
+
+    def test_gather(self):
+        rv = self.gather(
+            self.api.dist('foobar'),
+            self.api.dist('pyrseas'),
+            self.api.meta('foobar', '0.42.1'),
+            self.api.ext('amqp'),
+            self.api.dist('nosuchdist'),
+        )
+        self.assertEqual(rv[0]['name'], 'foobar')
+        self.assertEqual(rv[1]['name'], 'Pyrseas')
+        self.assertEqual(rv[2]['version'], '0.42.1')
+        self.assertEqual(rv[3]['extension'], 'amqp')
+        self.assert_(isinstance(rv[4], NotFound))
+
+    def test_concurrency(self):
+        names = ['foobar', 'pyrseas', 'first_last_agg'] * 2
+        rv = self.gather(*[self.api.dist(n) for n in names])
+        self.assertEqual(
+            [d['name'] for d in rv],
+            ['foobar', 'Pyrseas', 'first_last_agg'] * 2,
+        )
+        self.assert_(1 < self.max_running <= 3, self.max_running)
+
+    def test_trail_fallback(self):
+        # the version in the url is changed into 0.43.2b1
+        (meta,) = self.gather(self.api.meta('foobar', '0.43.2-b1'))
+        self.assertEqual(meta['version'], '0.43.2b1')
+
+        (e,) = self.gather(self.api.meta('foobar', '0.43.3'))
+        self.assert_(isinstance(e, ResourceNotFound))
+
+    def test_download(self):
+        tdir = tempfile.mkdtemp()
+        try:
+            (fn,) = self.gather(self.api.download('foobar', '0.42.1', tdir))
+            self.assert_(fn.endswith('/foobar-0.42.1.zip'), fn)
+        finally:
+            shutil.rmtree(tdir)
+
+    @unittest.skipIf(
+        not hasattr(aioapi.asyncio, 'get_running_loop'),
+        "get_running_loop not available",
+    )
+    def test_running_loop(self):
+        rv = []
+        with patch('asyncio.get_event_loop', side_effect=AssertionError):
+            self.loop.call_soon(lambda: rv.append(self.api.dist('foobar')))
+            self.loop.run_until_complete(aioapi.asyncio.sleep(0))
+            (dist,) = self.gather(rv[0])
+        self.assertEqual(dist['name'], 'foobar')
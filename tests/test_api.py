@@ -0,0 +1,121 @@
+import time
+import threading
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from mock import patch
+
+from pgxnclient import SemVer
+from pgxnclient.api import Api
+from pgxnclient.errors import NotFound
+
+from .test_commands import fake_get_file
+
+
+class MemoTestCase(unittest.TestCase):
+    def setUp(self):
+        self.api = Api('https://api.pgxn.org/')
+        self.urls = []
+        self.lock = threading.Lock()
+
+        p = patch('pgxnclient.network.get_file', self.get_file)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def get_file(self, url, **kwargs):
+        if not url.endswith('/index.json'):
+            with self.lock:
+                self.urls.append(url)
+        time.sleep(0.02)
+        return fake_get_file(url, **kwargs)
+
+    def test_memo(self):
+        d1 = self.api.dist('foobar')
+        d2 = self.api.dist('foobar')
+        self.assert_(d1 is d2)
+
+        m1 = self.api.dist('foobar', SemVer('0.42.1'))
+        m2 = self.api.meta('foobar', '0.42.1')
+        self.assert_(m1 is m2)
+
+        self.api.ext('amqp')
+        self.api.ext('amqp')
+        self.assertEqual(len(self.urls), 3)
+
+    def test_memo_expiry(self):
+        d1 = self.api.dist('foobar')
+        later = time.time() + self.api.MEMO_TTL
+        with patch('pgxnclient.api.time.time', return_value=later):
+            d2 = self.api.dist('foobar')
+        self.assert_(d1 is not d2)
+        self.assertEqual(len(self.urls), 2)
+
+    def test_no_memo_text(self):
+        self.api.meta('foobar', '0.42.1', as_json=False)
+        self.api.meta('foobar', '0.42.1', as_json=False)
+        self.assertEqual(len(self.urls), 2)
+
+    def test_no_memo_errors(self):
+        self.assertRaises(NotFound, self.api.dist, 'nosuchdist')
+        self.assertRaises(NotFound, self.api.dist, 'nosuchdist')
+        self.assertEqual(len(self.urls), 2)
+
+    def test_single_flight(self):
+        pool = ThreadPool(8)
+        try:
+            rv = pool.map(lambda i: self.api.dist('foobar'), range(8))
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(len(self.urls), 1)
+        self.assert_(all(d is rv[0] for d in rv))
+
+    def test_single_flight_error(self):
+        def dist(i):
+            try:
+                self.api.dist('nosuchdist')
+            except NotFound as e:
+                return e
+
+        pool = ThreadPool(8)
+        try:
+            rv = pool.map(dist, range(8))
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assert_(all(isinstance(e, NotFound) for e in rv))
+        self.assert_(len(self.urls) < 8, len(self.urls))
+
+    def test_prefetch(self):
+        rv = self.api.prefetch(
+            [
+                ('foobar', ''),
+                ('foobar', SemVer('0.42.1')),
+                ('pyrseas', ''),
+                ('nosuchdist', ''),
+            ]
+        )
+        self.assertEqual(rv[0]['name'], 'foobar')
+        self.assertEqual(rv[1]['version'], '0.42.1')
+        self.assertEqual(rv[2]['name'], 'Pyrseas')
+        self.assert_(rv[3] is None)
+
+        n = len(self.urls)
+        self.api.dist('foobar')
+        self.api.meta('foobar', '0.42.1')
+        self.api.dist('pyrseas')
+        self.assertEqual(len(self.urls), n)
+
+
+class IndexTestCase(unittest.TestCase):
+    def test_set_index(self):
+        api = Api('https://api.pgxn.org/')
+        api.set_index(b'{"dist": "/other/{dist}.json"}')
+        with patch('pgxnclient.network.get_file') as mock:
+            self.assertEqual(api.get_index(), {'dist': '/other/{dist}.json'})
+            self.assertEqual(
+                api.get_path('dist', {'dist': 'foobar'}), '/other/foobar.json'
+            )
+        self.assertEqual(mock.call_count, 0)
@@ -1,11 +1,18 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
 import unittest
 
+from mock import patch
+
 from pgxnclient import tar
 from pgxnclient import zip
 from pgxnclient import archive
 
 from pgxnclient.errors import PgxnClientException
-from .testutils import get_test_filename
+from .testutils import get_test_filename, CacheDirPatcher
 
 
 class TestArchive(unittest.TestCase):
@@ -46,6 +53,22 @@ class TestZipArchive(unittest.TestCase):
         a = zip.ZipArchive(fn)
         self.assert_(not a.can_open())
 
+    def test_unpacked_size(self):
+        fn = get_test_filename('foobar-0.42.1.zip')
+        a = zip.ZipArchive(fn)
+        tdir = tempfile.mkdtemp()
+        try:
+            a.unpack(tdir)
+            size = sum(
+                os.path.getsize(os.path.join(d, f))
+                for d, _, fs in os.walk(tdir)
+                for f in fs
+            )
+        finally:
+            shutil.rmtree(tdir)
+
+        self.assertEqual(a.get_unpacked_size(), size)
+
 
 class TestTarArchive(unittest.TestCase):
     def test_can_open(self):
@@ -66,3 +89,127 @@ class TestTarArchive(unittest.TestCase):
         fn = get_test_filename('foobar-0.42.1.zip')
         a = tar.TarArchive(fn)
         self.assert_(not a.can_open())
+
+    def test_unpacked_size(self):
+        fn = get_test_filename('foobar-0.42.1.tar.gz')
+        a = tar.TarArchive(fn)
+        a.open()
+        try:
+            size = sum(m.size for m in a._file.getmembers())
+        finally:
+            a.close()
+
+        # the size of the tar, including headers and padding
+        self.assert_(size < a.get_unpacked_size() < size + 100 * 1024)
+
+
+class TestTarUnpack(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.destdir = os.path.join(self.tdir, 'dest')
+        os.mkdir(self.destdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def make_tar(self, *members):
+        fn = os.path.join(self.tdir, 'test.tar.gz')
+        with tarfile.open(fn, 'w:gz') as f:
+            for name, type, linkname in members:
+                ti = tarfile.TarInfo(name)
+                ti.type = type
+                ti.linkname = linkname
+                if type == tarfile.REGTYPE:
+                    ti.size = 4
+                    f.addfile(ti, io.BytesIO(b'data'))
+                else:
+                    f.addfile(ti)
+
+        return tar.TarArchive(fn)
+
+    def _test_unpack(self):
+        a = self.make_tar(
+            ('foo', tarfile.DIRTYPE, ''),
+            ('foo/Makefile', tarfile.REGTYPE, ''),
+            ('foo/link', tarfile.SYMTYPE, 'Makefile'),
+            ('foo/dev', tarfile.CHRTYPE, ''),
+        )
+        self.assertEqual(
+            a.unpack(self.destdir), os.path.join(self.destdir, 'foo')
+        )
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.destdir, 'foo'))),
+            ['Makefile', 'link'],
+        )
+
+    def _test_escape(self):
+        for member in [
+            ('../foo', tarfile.REGTYPE, ''),
+            ('foo', tarfile.SYMTYPE, '../bar'),
+            ('foo', tarfile.LNKTYPE, '../bar'),
+        ]:
+            a = self.make_tar(member)
+            self.assertRaises(PgxnClientException, a.unpack, self.destdir)
+            self.assertEqual(os.listdir(self.destdir), [])
+
+    def test_unpack(self):
+        self._test_unpack()
+
+    def test_escape(self):
+        self._test_escape()
+
+    def test_unpack_nofilter(self):
+        with patch('pgxnclient.tar.data_filter', None):
+            self._test_unpack()
+
+    def test_escape_nofilter(self):
+        with patch('pgxnclient.tar.data_filter', None):
+            self._test_escape()
+
+
+class TestArchiveIndex(unittest.TestCase):
+    def setUp(self):
+        self._p1 = CacheDirPatcher()
+        self._p1.start()
+        self.tdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self._p1.stop()
+        shutil.rmtree(self.tdir)
+
+    def _copy(self, name):
+        fn = os.path.join(self.tdir, name)
+        shutil.copyfile(get_test_filename(name), fn)
+        return fn
+
+    def test_meta_indexed(self):
+        for name in ('foobar-0.42.1.zip', 'foobar-0.42.1.tar.gz'):
+            fn = self._copy(name)
+            meta = archive.from_file(fn, indexed=True).get_meta()
+            self.assertEqual(meta['name'], 'foobar')
+
+            a = archive.from_file(fn, indexed=True)
+            with patch.object(type(a), 'open') as mock_open:
+                self.assertEqual(a.get_meta(), meta)
+                self.assertEqual(mock_open.call_count, 0)
+
+            self.assertEqual(sorted(a.index.data), ['key', 'meta', 'type'])
+
+    def test_no_cache(self):
+        fn = self._copy('foobar-0.42.1.zip')
+        with patch.dict(
+            os.environ, {'PGXN_CACHE_DIR': os.path.join(fn, 'cache')}
+        ):
+            a = archive.from_file(fn, indexed=True)
+            self.assertEqual(a.get_meta()['name'], 'foobar')
+            self.assertEqual(a.index.data, None)
+
+    def test_index_invalidated(self):
+        fn = self._copy('foobar-0.42.1.zip')
+        archive.from_file(fn, indexed=True).get_meta()
+        self.assert_(archive.ArchiveIndex(fn).load())
+
+        shutil.copyfile(get_test_filename('foobar-0.42.1.tar.gz'), fn)
+        self.assert_(not archive.ArchiveIndex(fn).load())
+        a = archive.from_file(fn, indexed=True)
+        self.assert_(isinstance(a, tar.TarArchive))
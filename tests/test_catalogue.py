@@ -0,0 +1,80 @@
+import json
+import unittest
+
+from pgxnclient import Spec, SemVer
+from pgxnclient.catalogue import VersionIndex, Catalogue, best_versions
+
+from .testutils import get_test_filename
+
+VERSIONS = [
+    '0.9.10',
+    '1.0.0',
+    '1.0.0-b1',
+    '1.0.1',
+    '1.2.0-RC1',
+    '1.2.0',
+    '2.0.0',
+]
+
+
+class VersionIndexTestCase(unittest.TestCase):
+    def test_sorted(self):
+        idx = VersionIndex(VERSIONS + ['1.2.0-rc1'])
+        self.assertEqual(list(idx), sorted(set(map(SemVer, VERSIONS))))
+
+    def test_find(self):
+        idx = VersionIndex(VERSIONS)
+        vs = [SemVer(v) for v in VERSIONS]
+        for ver in VERSIONS + ['0.0.1', '1.1.0', '1.2.0-rc1', '3.0.0']:
+            for op in ('==', '<', '<=', '>', '>=', None):
+                spec = Spec('foo', op, SemVer(ver))
+                lo, hi = idx.find(op, ver)
+                self.assertEqual(
+                    sorted(idx.versions[lo:hi]),
+                    sorted(v for v in vs if spec.accepted(v)),
+                    "%s%s" % (op, ver),
+                )
+
+    def test_best(self):
+        idx = VersionIndex(VERSIONS)
+        self.assertEqual(idx.best(Spec.parse('foo')), '2.0.0')
+        self.assertEqual(idx.best(Spec.parse('foo<1.2')), '1.2.0-RC1')
+        self.assertEqual(idx.best(Spec.parse('foo<0.9')), None)
+
+
+class CatalogueTestCase(unittest.TestCase):
+    def setUp(self):
+        fn = get_test_filename(
+            'https%3A%2F%2Fapi.pgxn.org%2Fdist%2Ffoobar.json'
+        )
+        with open(fn) as f:
+            self.data = json.load(f)
+
+    def test_best(self):
+        cat = Catalogue(self.data['releases'])
+        self.assertEqual(cat.best(Spec.parse('foobar')), '0.42.1')
+        self.assertEqual(
+            cat.best(Spec.parse('foobar'), Spec.TESTING), '0.43.2b1'
+        )
+        self.assertEqual(
+            cat.best_by_status(Spec.parse('foobar<0.42.1')),
+            [None, None, '0.42.0'],
+        )
+
+    def test_best_versions(self):
+        specs = [
+            Spec.parse(s)
+            for s in ['foobar', 'foobar>0.42.1', 'foobar=0.42.0', 'nodist']
+        ]
+        self.assertEqual(
+            best_versions({'foobar': self.data}, specs),
+            ['0.42.1', None, '0.42.0', None],
+        )
+        self.assertEqual(
+            best_versions({'foobar': self.data}, specs, Spec.UNSTABLE),
+            ['0.43.2b1', '0.43.2b1', '0.42.0', None],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
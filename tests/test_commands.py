@@ -13,7 +13,7 @@ from pgxnclient.errors import (
     ResourceNotFound,
     InsufficientPrivileges,
 )
-from .testutils import ifunlink, get_test_filename
+from .testutils import ifunlink, get_test_filename, CacheDirPatcher
 
 
 class FakeFile(object):
@@ -32,7 +32,7 @@ class FakeFile(object):
         return getattr(self._f, attr)
 
 
-def fake_get_file(url, urlmap=None):
+def fake_get_file(url, urlmap=None, **kwargs):
     if urlmap:
         url = urlmap.get(url, url)
     fn = get_test_filename(quote(url, safe=""))
@@ -159,6 +159,90 @@ notes:
         assert out < 127
 
 
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.fn = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.fn)
+
+    def _run(self, lines, *args):
+        with open(self.fn, 'w') as f:
+            f.write(lines)
+
+        @patch('sys.stdout')
+        @patch('pgxnclient.network.get_file')
+        def do(mock, stdout):
+            stdout.encoding = 'UTF-8'
+            mock.side_effect = fake_get_file
+
+            from pgxnclient.cli import main
+
+            main(['batch'] + list(args) + [self.fn])
+            urls = [c[0][0] for c in mock.call_args_list]
+            return get_stdout_data(stdout), urls
+
+        return do()
+
+    def test_batch(self):
+        output, urls = self._run(
+            "# comment\n"
+            "info --versions foobar>0.42.0\n"
+            "\n"
+            "info --versions 'foobar<0.42.1'  # another comment\n"
+        )
+        self.assertEqual(
+            output,
+            b"""\
+foobar 0.43.2b1 testing
+foobar 0.42.1 stable
+foobar 0.42.0 stable
+""",
+        )
+        # The index is only fetched once
+        self.assertEqual(
+            len([u for u in urls if u.endswith('/index.json')]), 1
+        )
+
+    def test_parallel(self):
+        output, urls = self._run(
+            "info --versions foobar\n" * 4, '--parallel', '3'
+        )
+        self.assertEqual(len(output.splitlines()), 12)
+
+    def test_failure(self):
+        self.assertRaises(
+            PgxnClientException,
+            self._run,
+            "info --versions foobar\ninfo --versions nosuchdist\n",
+        )
+
+    def test_not_allowed(self):
+        self.assertRaises(PgxnClientException, self._run, "batch foo\n")
+
+    @patch('pgxnclient.commands.WithPgConfig.call_pg_config')
+    @patch('pgxnclient.commands.Popen')
+    def test_make_per_command(self, mock_popen, mock_pgconfig):
+        mock_popen.return_value.returncode = 0
+        mock_pgconfig.side_effect = fake_pg_config()
+
+        tdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tdir)
+        makes = [os.path.join(tdir, 'make1'), os.path.join(tdir, 'make2')]
+        for make in makes:
+            open(make, 'w').close()
+
+        cache = CacheDirPatcher()
+        cache.start()
+        self.addCleanup(cache.stop)
+        self._run(''.join('check --make %s foobar\n' % m for m in makes))
+
+        self.assertEqual(
+            [c[0][0][0] for c in mock_popen.call_args_list], makes
+        )
+
+
 class CommandTestCase(unittest.TestCase):
     def test_popen_raises(self):
         from pgxnclient.commands import Command
@@ -182,6 +266,63 @@ class CommandTestCase(unittest.TestCase):
         out_help = get_stdout_data(stdout)
         assert out == out_help
 
+    def test_commands_manifest(self):
+        from pgxnclient.commands import COMMANDS, CommandType, load_commands
+
+        load_commands()
+        names = set(cls.name for cls in CommandType.subclasses if cls.name)
+        self.assertEqual(names, set(COMMANDS))
+
+    @patch('os.execv')
+    @patch('pgxnclient.cli.run_script')
+    def test_dispatch_builtin(self, mock_run, mock_exec):
+        from pgxnclient.cli import command_dispatch
+
+        command_dispatch(['--verbose', 'info', 'foobar'])
+        self.assertEqual(mock_exec.call_count, 0)
+        self.assertEqual(
+            mock_run.call_args[0][0], ['info', '--verbose', 'foobar']
+        )
+
+    @patch('os.execv')
+    @patch('pgxnclient.cli.run_script')
+    def test_dispatch_external(self, mock_run, mock_exec):
+        from pgxnclient.cli import command_dispatch
+
+        tdir = tempfile.mkdtemp()
+        try:
+            fn = os.path.join(tdir, 'pgxn-foo')
+            with open(fn, 'w') as f:
+                f.write('#!/bin/sh\n')
+            os.chmod(fn, 0o755)
+            with patch.dict(os.environ, {'PATH': tdir}):
+                command_dispatch(['foo', '--bar'])
+        finally:
+            shutil.rmtree(tdir)
+
+        self.assertEqual(mock_run.call_count, 0)
+        self.assertEqual(mock_exec.call_args[0], (fn, [fn, '--bar']))
+
+    def test_session_api(self):
+        from pgxnclient.commands import Command, Session
+
+        opts = Mock(mirror='https://api.pgxn.org/', session=Session())
+        c1 = Command(opts)
+        c2 = Command(opts)
+        self.assert_(c1.api is c2.api)
+
+        opts.mirror = 'https://example.org/'
+        self.assert_(Command(opts).api is not c1.api)
+
+    def test_parser_subset(self):
+        from pgxnclient.commands import get_option_parser, load_commands
+
+        load_commands(['info'])
+        parser = get_option_parser(['info'])
+        opts = parser.parse_args(['info', 'foobar'])
+        self.assertEqual(opts.cmd.name, 'info')
+        self.assertRaises(SystemExit, parser.parse_args, ['install', 'foo'])
+
 
 class DownloadTestCase(unittest.TestCase):
     @patch('pgxnclient.network.get_file')
@@ -285,7 +426,7 @@ class DownloadTestCase(unittest.TestCase):
 
     @patch('pgxnclient.network.get_file')
     def test_download_bad_sha1(self, mock):
-        def fakefake(url):
+        def fakefake(url, **kwargs):
             return fake_get_file(
                 url,
                 urlmap={
@@ -435,6 +576,119 @@ class DownloadTestCase(unittest.TestCase):
             self.assertEqual(res, cmd.get_best_version(data, spec))
 
 
+class FetchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = CacheDirPatcher()
+        self.cache.start()
+        self.addCleanup(self.cache.stop)
+
+        fd, self.fn = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.fn)
+
+    def fetch(self, lines, *args):
+        with open(self.fn, 'w') as f:
+            f.write(lines)
+
+        from pgxnclient.cli import main
+
+        with patch('pgxnclient.network.get_file') as mock:
+            mock.side_effect = fake_get_file
+            try:
+                main(['fetch', '-r', self.fn] + list(args))
+            finally:
+                self.urls = [c[0][0] for c in mock.call_args_list]
+
+    def test_fetch(self):
+        from pgxnclient.cli import main
+        from pgxnclient.api import ApiCache
+
+        self.fetch("# comment\nfoobar\n\npyrseas  # another comment\n")
+        self.assertEqual(
+            len([u for u in self.urls if u.endswith('/index.json')]), 1
+        )
+        self.assert_(
+            os.path.exists(
+                ApiCache().get_filename('/dist/foobar/0.42.1/META.json')
+            )
+        )
+
+        # The build can happen without network
+        from pgxnclient import network
+
+        def get_file(url, _get_file=network.get_file, **kwargs):
+            # the offline cache is read as a file:// mirror
+            self.assert_(url.startswith('file://'), url)
+            return _get_file(url, **kwargs)
+
+        tdir = tempfile.mkdtemp()
+        try:
+            with patch('pgxnclient.network.get_file', get_file):
+                main(['download', '--offline', '--target', tdir, 'foobar'])
+                main(['download', '--offline', '--target', tdir, 'pyrseas'])
+
+            self.assertEqual(
+                sorted(os.listdir(tdir)),
+                ['foobar-0.42.1.zip', 'pyrseas-0.4.1.zip'],
+            )
+        finally:
+            shutil.rmtree(tdir)
+
+    def test_fetch_cached(self):
+        self.fetch("foobar\n")
+        self.fetch("foobar\n")
+        self.assert_(not [u for u in self.urls if u.endswith('.zip')])
+
+    def test_fetch_error(self):
+        self.assertRaises(
+            PgxnClientException, self.fetch, "nosuchdist\nfoobar\n"
+        )
+        self.assert_(
+            [u for u in self.urls if u.endswith('/foobar-0.42.1.zip')]
+        )
+
+    def test_bad_requirements(self):
+        self.assertRaises(
+            PgxnClientException, self.fetch, "foobar\nhttp://example.org/\n"
+        )
+        self.assertEqual(self.urls, [])
+
+    def test_no_spec(self):
+        from pgxnclient.cli import main
+
+        self.assertRaises(SystemExit, main, ['fetch'])
+
+    def test_bad_parallel(self):
+        from pgxnclient.cli import main
+
+        for n in ['0', '-1', 'x']:
+            with patch('sys.stderr'):
+                self.assertRaises(
+                    SystemExit, main, ['fetch', '--parallel', n, 'foobar']
+                )
+
+    def test_fetch_os_error(self):
+        from pgxnclient.commands.install import Download
+
+        download_dist = Download.download_dist
+
+        def fake_download_dist(self, data, target=None):
+            if data['name'] == 'foobar':
+                raise OSError("disk full")
+            return download_dist(self, data, target=target)
+
+        # the test archives have the same sha1: fetch them in order
+        with patch.object(Download, 'download_dist', fake_download_dist):
+            self.assertRaises(
+                PgxnClientException,
+                self.fetch,
+                "foobar\npyrseas\n",
+                '--parallel',
+                '1',
+            )
+        self.assert_([u for u in self.urls if u.endswith('.zip')])
+
+
 class Assertions(object):
 
     make = object()
@@ -471,10 +725,14 @@ class InstallTestCase(unittest.TestCase, Assertions):
         self.mock_pgconfig = self._p3.start()
         self.mock_pgconfig.side_effect = fake_pg_config(libdir='/', bindir='/')
 
+        self._p4 = CacheDirPatcher()
+        self._p4.start()
+
     def tearDown(self):
         self._p1.stop()
         self._p2.stop()
         self._p3.stop()
+        self._p4.stop()
 
     def test_install_latest(self):
         from pgxnclient.cli import main
@@ -546,7 +804,7 @@ class InstallTestCase(unittest.TestCase, Assertions):
         self.assertEquals(self.mock_popen.call_count, 1)
 
     def test_install_bad_sha1(self):
-        def fakefake(url):
+        def fakefake(url, **kwargs):
             return fake_get_file(
                 url,
                 urlmap={
@@ -638,6 +896,21 @@ class InstallTestCase(unittest.TestCase, Assertions):
         (tmpdir,) = mock_unpack.call_args[0]
         self.assertEqual(make_cwd, os.path.join(tmpdir, 'foobar-0.42.1'))
 
+    @patch('pgxnclient.zip.ZipArchive.unpack')
+    def test_install_reuse_tree(self, mock_unpack):
+        fn = get_test_filename('foobar-0.42.1.zip')
+        mock_unpack.side_effect = ZipArchive(fn).unpack_orig
+
+        from pgxnclient.cli import main
+
+        main(['check', fn])
+        main(['install', '--sudo', '--', fn])
+
+        self.assertEquals(mock_unpack.call_count, 1)
+        self.assertEquals(self.mock_popen.call_count, 3)
+        make_cwd = self.mock_popen.call_args_list[2][1]['cwd']
+        self.assertEqual(os.path.basename(make_cwd), 'foobar-0.42.1')
+
     def test_install_url_file(self):
         fn = get_test_filename('foobar-0.42.1.zip')
         url = 'file://' + os.path.abspath(fn).replace("f", '%%%2x' % ord('f'))
@@ -695,10 +968,14 @@ class CheckTestCase(unittest.TestCase, Assertions):
         self.mock_pgconfig = self._p3.start()
         self.mock_pgconfig.side_effect = fake_pg_config(libdir='/', bindir='/')
 
+        self._p4 = CacheDirPatcher()
+        self._p4.start()
+
     def tearDown(self):
         self._p1.stop()
         self._p2.stop()
         self._p3.stop()
+        self._p4.stop()
 
     def test_check_latest(self):
         from pgxnclient.cli import main
@@ -725,6 +1002,19 @@ class CheckTestCase(unittest.TestCase, Assertions):
             [self.make], self.mock_popen.call_args_list[0][0][0][:1]
         )
 
+    def test_check_no_cache(self):
+        from pgxnclient.cli import main
+
+        # the cache dir can't be created: work without the tree store
+        fd, fn = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, fn)
+        cachedir = os.path.join(fn, 'cache')
+        with patch.dict('os.environ', {'PGXN_CACHE_DIR': cachedir}):
+            main(['check', 'foobar'])
+
+        self.assertEquals(self.mock_popen.call_count, 1)
+
     def test_check_fails(self):
         self.mock_popen.return_value.returncode = 1
 
@@ -765,7 +1055,7 @@ class CheckTestCase(unittest.TestCase, Assertions):
             ifunlink('regression.diffs')
 
     def test_check_bad_sha1(self):
-        def fakefake(url):
+        def fakefake(url, **kwargs):
             return fake_get_file(
                 url,
                 urlmap={
@@ -0,0 +1,490 @@
+import os
+import json
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+from io import BytesIO
+from gzip import GzipFile
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
+
+from mock import Mock, patch
+from six.moves import queue
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.parse import quote
+from six.moves.urllib.request import Request, urlopen
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from pgxnclient import network
+from pgxnclient.api import Api, AutoApi
+from pgxnclient.utils import sha1
+from pgxnclient.mirror import MirrorSync, MirrorServer
+from pgxnclient.errors import (
+    PgxnClientException,
+    NotFound,
+    NetworkError,
+    BadChecksum,
+)
+
+from .testutils import get_test_filename, CacheDirPatcher
+
+UPSTREAM = 'https://api.pgxn.org'
+
+# sha1 of foobar-0.42.1.zip
+CHK = '6ae083946254210f6bfc9c5b2cae538bbaf59142'
+
+
+class MirrorTestCase(unittest.TestCase):
+    """Create an upstream mirror to be read from a file:// url."""
+
+    def setUp(self):
+        self.upstream = tempfile.mkdtemp()
+        self.dest = tempfile.mkdtemp()
+        for path in [
+            '/index.json',
+            '/dist/foobar/0.42.1/META.json',
+            '/dist/foobar/0.42.1/foobar-0.42.1.zip',
+            '/dist/foobar/0.43.2b1/META.json',
+            '/dist/foobar/0.43.2b1/foobar-0.43.2b1.zip',
+        ]:
+            self.copy(path)
+
+        self.write('/users/p.json', [{'user': 'piro', 'name': 'Piro'}])
+        self.write('/user/piro.json', {'releases': {'foobar': {}}})
+        self.write(
+            '/dist/foobar.json',
+            {
+                'name': 'foobar',
+                'releases': {
+                    'stable': [{'version': '0.42.1'}],
+                    'testing': [{'version': '0.43.2b1'}],
+                },
+            },
+        )
+        self.write('/extension/foobar.json', {'extension': 'foobar'})
+
+    def tearDown(self):
+        shutil.rmtree(self.upstream)
+        shutil.rmtree(self.dest)
+
+    def copy(self, path):
+        fn = self.upstream + path
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        shutil.copy(get_test_filename(quote(UPSTREAM + path, safe='')), fn)
+
+    def write(self, path, data):
+        fn = self.upstream + path
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        with open(fn, 'w') as f:
+            json.dump(data, f)
+
+    def sync(self, parallel=2):
+        api = Api('file://' + self.upstream)
+        return MirrorSync(api, self.dest, parallel=parallel).sync()
+
+    def listdir(self, dir):
+        rv = []
+        for root, dirs, files in os.walk(dir):
+            for fn in files:
+                rv.append(os.path.relpath(os.path.join(root, fn), dir))
+        return sorted(rv)
+
+
+class MirrorSyncTestCase(MirrorTestCase):
+    def test_sync(self):
+        stats = self.sync()
+        self.assertEqual(self.listdir(self.dest), self.listdir(self.upstream))
+        self.assertEqual(stats['written'], 9)
+        for fn in self.listdir(self.upstream):
+            with open(os.path.join(self.upstream, fn), 'rb') as f1:
+                with open(os.path.join(self.dest, fn), 'rb') as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+        # The copy can be used as a mirror
+        api = Api('file://' + self.dest)
+        self.assertEqual(api.dist('foobar')['name'], 'foobar')
+
+    def test_incremental(self):
+        self.sync(parallel=1)
+        stats = self.sync(parallel=1)
+        self.assertEqual((stats['written'], stats['unchanged']), (0, 9))
+
+        self.write('/extension/foobar.json', {'extension': 'foobaz'})
+        os.unlink(
+            os.path.join(self.dest, 'dist/foobar/0.42.1/foobar-0.42.1.zip')
+        )
+        stats = self.sync(parallel=1)
+        self.assertEqual((stats['written'], stats['unchanged']), (2, 7))
+        self.assertEqual(self.listdir(self.dest), self.listdir(self.upstream))
+
+    def test_bad_checksum(self):
+        fn = 'dist/foobar/0.42.1/foobar-0.42.1.zip'
+        shutil.copy(
+            get_test_filename('foobar-0.42.1.tar.gz'),
+            os.path.join(self.upstream, fn),
+        )
+        self.assertRaises(PgxnClientException, self.sync)
+        # neither the bad file nor temp files are left around
+        self.assertEqual(
+            os.listdir(os.path.join(self.dest, 'dist/foobar/0.42.1')),
+            ['META.json'],
+        )
+
+
+class MirrorServerTestCase(MirrorTestCase):
+    def setUp(self):
+        super(MirrorServerTestCase, self).setUp()
+        self.server = MirrorServer(
+            ('127.0.0.1', 0), self.dest, upstream='file://' + self.upstream
+        )
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super(MirrorServerTestCase, self).tearDown()
+
+    def get(self, path, headers=(), method=None):
+        req = Request(self.url + path, headers=dict(headers))
+        if method:
+            req.get_method = lambda: method
+        try:
+            return urlopen(req)
+        except HTTPError as e:
+            return e
+
+    def test_serve(self):
+        self.sync()
+        api = Api(self.url)
+        self.assertEqual(api.dist('foobar')['name'], 'foobar')
+        self.assertEqual(api.meta('foobar', '0.42.1')['version'], '0.42.1')
+        with api.download('foobar', '0.42.1') as f:
+            self.assertEqual(sha1(f.read()).hexdigest(), CHK)
+
+        f = self.get('/dist/foobar/0.42.1/foobar-0.42.1.zip', method='HEAD')
+        self.assertEqual(f.code, 200)
+        self.assertEqual(f.headers['Content-Type'], 'application/zip')
+        self.assertEqual(f.read(), b'')
+
+        for path in ['/nothere.json', '/../etc/passwd', '/search/docs/?q=x']:
+            self.assertEqual(self.get(path).code, 404, path)
+
+    def test_etag_gzip(self):
+        with open(os.path.join(self.upstream, 'index.json'), 'rb') as f:
+            data = f.read()
+
+        f = self.get('/index.json')
+        self.assertEqual(f.read(), data)
+        etag = f.headers['ETag']
+        self.assertEqual(f.headers.get('Content-Encoding'), None)
+        f = self.get('/index.json', [('If-None-Match', etag)])
+        self.assertEqual(f.code, 304)
+
+        f = self.get('/index.json', [('Accept-Encoding', 'gzip')])
+        self.assertEqual(f.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(GzipFile(fileobj=BytesIO(f.read())).read(), data)
+        self.assertNotEqual(f.headers['ETag'], etag)
+        f = self.get('/index.json', [('If-None-Match', etag)])
+        self.assertEqual(f.code, 304)
+
+    def test_pull_through(self):
+        path = '/dist/foobar/0.42.1/foobar-0.42.1.zip'
+        calls = []
+        get_file = network.get_file
+
+        def counting_get_file(url, **kwargs):
+            calls.append(url)
+            time.sleep(0.1)
+            return get_file(url, **kwargs)
+
+        with patch('pgxnclient.network.get_file', counting_get_file):
+            pool = ThreadPool(4)
+            try:
+                rvs = pool.map(lambda i: self.get(path).read(), range(4))
+            finally:
+                pool.close()
+                pool.join()
+
+        self.assertEqual(calls, ['file://' + self.upstream + path])
+        for rv in rvs:
+            self.assertEqual(sha1(rv).hexdigest(), CHK)
+        self.assert_(os.path.exists(self.dest + path))
+
+    def test_pull_through_bad_path(self):
+        def get_file(url, **kwargs):
+            raise AssertionError("upstream accessed: %s" % url)
+
+        with patch('pgxnclient.network.get_file', get_file):
+            for path in [
+                '@evil.example/index.json',
+                '/@evil.example/index.json',
+                '/dist/../index.json',
+                '/dist/%2e%2e/index.json',
+            ]:
+                self.assertEqual(self.raw_get(path), 404, path)
+        self.assertEqual(os.listdir(self.dest), [])
+
+        fn = os.path.join(self.dest, 'dist', 'foo bar.json')
+        self.assertEqual(
+            self.server.get_upstream_url(fn),
+            'file://' + self.upstream + '/dist/foo%20bar.json',
+        )
+
+    def raw_get(self, path):
+        addr = self.server.server_address
+        with closing(socket.create_connection(addr)) as s:
+            s.sendall(('GET %s HTTP/1.0\r\n\r\n' % path).encode('ascii'))
+            with closing(s.makefile('rb')) as f:
+                return int(f.readline().split()[1])
+
+    def test_pull_through_revalidate(self):
+        meta = '/dist/foobar/0.42.1/META.json'
+        self.assertEqual(self.get('/dist/foobar.json').code, 200)
+        self.assertEqual(self.get(meta).code, 200)
+
+        self.write('/dist/foobar.json', {'name': 'foobar', 'releases': {}})
+        os.unlink(self.upstream + meta)
+        f = self.get('/dist/foobar.json')
+        self.assertEqual(
+            json.loads(f.read().decode('utf8'))['releases'],
+            {
+                'stable': [{'version': '0.42.1'}],
+                'testing': [{'version': '0.43.2b1'}],
+            },
+        )
+
+        calls = []
+        get_file = network.get_file
+
+        def counting_get_file(url, **kwargs):
+            calls.append(url)
+            return get_file(url, **kwargs)
+
+        later = time.time() + MirrorServer.REVALIDATE_TTL
+        with patch('pgxnclient.network.get_file', counting_get_file):
+            with patch('pgxnclient.mirror.time.time', return_value=later):
+                f = self.get('/dist/foobar.json')
+                self.assertEqual(
+                    json.loads(f.read().decode('utf8'))['releases'], {}
+                )
+                self.assertEqual(self.get(meta).code, 200)
+
+        self.assertEqual(
+            calls, ['file://' + self.upstream + '/dist/foobar.json']
+        )
+
+
+class AutoApiTestCase(MirrorTestCase):
+    def setUp(self):
+        super(AutoApiTestCase, self).setUp()
+        self.cache = CacheDirPatcher()
+        self.cache.start()
+
+        self.origin = 'file://' + self.upstream + '/'
+        self.good = 'file://' + self.dest + '/'
+        self.bad = 'file://' + self.dest + '/nothere/'
+        self.write(
+            '/meta/mirrors.json',
+            [{'uri': self.bad}, {'uri': self.good}, {'uri': self.origin}],
+        )
+        self.sync()
+
+    def tearDown(self):
+        self.cache.stop()
+        super(AutoApiTestCase, self).tearDown()
+
+    def fake_probe(self, times):
+        def probe(url, timeout=None):
+            self.probed.append(url)
+            return times.get(url[: -len('index.json')])
+
+        self.probed = []
+        return patch('pgxnclient.network.probe', probe)
+
+    def test_ranking(self):
+        with self.fake_probe({self.good: 0.1, self.origin: 0.2}):
+            api = AutoApi(origin=self.origin)
+            self.assertEqual(api.get_mirrors(), [self.good, self.origin])
+            self.assertEqual(api.mirror, self.good)
+        self.assertEqual(len(self.probed), 3)
+
+        # The ranking is reused
+        with self.fake_probe({}):
+            api = AutoApi(origin=self.origin)
+            self.assertEqual(api.get_mirrors(), [self.good, self.origin])
+        self.assertEqual(self.probed, [])
+
+        # ...until expired
+        with self.fake_probe({self.good: 0.3, self.origin: 0.2}):
+            api = AutoApi(origin=self.origin, ttl=0)
+            self.assertEqual(api.get_mirrors(), [self.origin, self.good])
+        self.assertEqual(len(self.probed), 3)
+
+    def test_real_probe(self):
+        api = AutoApi(origin=self.origin)
+        self.assertEqual(
+            sorted(api.get_mirrors()), sorted([self.good, self.origin])
+        )
+
+    def test_failover(self):
+        # the bad mirror was healthy when probed
+        with self.fake_probe({self.bad: 0.1, self.good: 0.2}):
+            api = AutoApi(origin=self.origin)
+            self.assertEqual(api.dist('foobar')['name'], 'foobar')
+        self.assertEqual(api.get_mirrors(), [self.good])
+        self.assertRaises(NotFound, api.dist, 'nothere')
+
+        # the failed mirror is not used anymore
+        api = AutoApi(origin=self.origin)
+        self.assertEqual(api.get_mirrors(), [self.good])
+
+
+class SlowFile(BytesIO):
+    def __init__(self, data, url, delay):
+        BytesIO.__init__(self, data)
+        self.url = url
+        self.delay = delay
+
+    def read(self, n=-1):
+        time.sleep(self.delay)
+        return BytesIO.read(self, n)
+
+
+class HedgedDownloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        with open(get_test_filename('foobar-0.42.1.zip'), 'rb') as f:
+            self.data = f.read()
+
+        self.calls = []
+        self.patcher = patch('pgxnclient.network.get_file', self.get_file)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tdir)
+
+    def get_file(self, url, **kwargs):
+        # the url is http://<speed>/file.zip
+        self.calls.append(url)
+        speed = url.split('/')[2]
+        if speed == 'fail':
+            time.sleep(0.5)
+            raise NetworkError("download failed")
+        data = self.data
+        if speed == 'bad':
+            data = data[:-1]
+        delay = {'slow': 0.2}.get(speed, 0)
+        return closing(SlowFile(data, url, delay))
+
+    def download(self, *speeds, **kwargs):
+        urls = ['http://%s/foobar.zip' % s for s in speeds]
+        return network.download_hedged(urls, self.tdir, CHK, **kwargs)
+
+    def check_dir(self):
+        # let the cancelled downloads terminate
+        time.sleep(0.3)
+        self.assertEqual(os.listdir(self.tdir), ['foobar.zip'])
+        with open(os.path.join(self.tdir, 'foobar.zip'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_hedge(self):
+        fn = self.download('slow', 'fast', after=0.1, min_rate=1e9)
+        self.assertEqual(fn, os.path.join(self.tdir, 'foobar.zip'))
+        self.assertEqual(len(self.calls), 2)
+        self.check_dir()
+
+    def test_fast(self):
+        self.download('fast', 'slow', after=1, min_rate=1e3)
+        self.assertEqual(self.calls, ['http://fast/foobar.zip'])
+        self.check_dir()
+
+    def test_failover(self):
+        self.download('bad', 'fast', after=10)
+        self.assertEqual(len(self.calls), 2)
+        self.check_dir()
+
+    def test_fail_before_success_reported(self):
+        class SlowQueue(queue.Queue):
+            # report the successful downloads late
+            def put(self, a):
+                if a.error is None:
+                    time.sleep(0.3)
+                queue.Queue.put(self, a)
+
+        # the slow download completes while the fast mirror is failing
+        mock_queue = Mock(Queue=SlowQueue, Empty=queue.Empty)
+        with patch('pgxnclient.network.queue', mock_queue):
+            fn = self.download('slow', 'fail', after=0.1, min_rate=1e9)
+        self.assertEqual(fn, os.path.join(self.tdir, 'foobar.zip'))
+        self.check_dir()
+
+    def test_fail(self):
+        self.assertRaises(
+            BadChecksum, self.download, 'bad', 'bad', after=0.1, min_rate=1e9
+        )
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(os.listdir(self.tdir), [])
+
+
+class StallingHandler(BaseHTTPRequestHandler):
+    """Serve the file quickly from /fast/, or stall after a few bytes."""
+
+    def do_GET(self):
+        data = self.server.data
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.path.startswith('/fast/'):
+            self.wfile.write(data)
+        else:
+            self.wfile.write(data[:100])
+            self.wfile.flush()
+            self.server.stall.wait(30)
+
+    def log_message(self, *args):
+        pass
+
+
+class StallingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class HedgedSocketTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.server = StallingServer(('127.0.0.1', 0), StallingHandler)
+        with open(get_test_filename('foobar-0.42.1.zip'), 'rb') as f:
+            self.server.data = f.read()
+        self.server.stall = threading.Event()
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def tearDown(self):
+        self.server.stall.set()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tdir)
+
+    def test_stalled_loser(self):
+        base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        urls = [base + '/slow/foobar.zip', base + '/fast/foobar.zip']
+        t0 = time.time()
+        with patch.dict('os.environ', {'no_proxy': '*'}):
+            fn = network.download_hedged(
+                urls, self.tdir, CHK, after=0.2, min_rate=1e6
+            )
+        # the stalled download doesn't hold the winner
+        self.assert_(time.time() - t0 < 5, time.time() - t0)
+        with open(fn, 'rb') as f:
+            self.assertEqual(f.read(), self.server.data)
@@ -0,0 +1,211 @@
+import os
+import zlib
+import time
+import errno
+import socket
+import unittest
+from io import BytesIO
+from gzip import GzipFile
+from email.message import Message
+from email.utils import formatdate
+
+from mock import patch, Mock
+from six.moves import http_client
+from six.moves.urllib.error import HTTPError, URLError
+
+from pgxnclient import network
+from pgxnclient.errors import NetworkError, ResourceNotFound
+
+URL = 'https://api.pgxn.org/index.json'
+
+
+def http_error(code, headers=None):
+    msg = Message()
+    for k, v in (headers or {}).items():
+        msg[k] = v
+    return HTTPError(URL, code, 'error', msg, None)
+
+
+class GetFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.opener = Mock()
+        p = patch('pgxnclient.network.get_opener', lambda: self.opener)
+        p.start()
+        self.addCleanup(p.stop)
+
+        p = patch('pgxnclient.network.time.sleep')
+        self.sleep = p.start()
+        self.addCleanup(p.stop)
+
+    def test_retry(self):
+        ok = Mock()
+        self.opener.open.side_effect = [
+            http_error(503),
+            URLError(socket.error(errno.ECONNRESET, 'connection reset')),
+            ok,
+        ]
+        with network.get_file(URL) as f:
+            self.assert_(f is ok)
+        self.assertEqual(self.opener.open.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        for (delay,), kw in self.sleep.call_args_list:
+            self.assert_(0 <= delay <= network.RETRY_BACKOFF_MAX)
+
+    def test_no_retry(self):
+        self.opener.open.side_effect = [http_error(404)]
+        self.assertRaises(ResourceNotFound, network.get_file, URL)
+        self.assertEqual(self.opener.open.call_count, 1)
+
+        # permanent network errors
+        for e in [
+            URLError(socket.gaierror(-2, 'Name or service not known')),
+            URLError(socket.error(errno.ECONNREFUSED, 'connection refused')),
+            URLError('unknown url type'),
+        ]:
+            self.opener.open.reset_mock()
+            self.opener.open.side_effect = [e, Mock()]
+            self.assertRaises(NetworkError, network.get_file, URL)
+            self.assertEqual(self.opener.open.call_count, 1)
+
+    def test_retry_response_error(self):
+        ok = Mock()
+        self.opener.open.side_effect = [
+            socket.timeout('timed out'),
+            http_client.BadStatusLine(''),
+            ok,
+        ]
+        with network.get_file(URL) as f:
+            self.assert_(f is ok)
+        self.assertEqual(self.opener.open.call_count, 3)
+
+    def test_bad_env(self):
+        self.opener.open.side_effect = [http_error(500)] * 10
+        env = {'PGXN_RETRIES': 'many', 'PGXN_RETRY_TIME': '-1'}
+        with patch.dict('os.environ', env):
+            with patch('pgxnclient.network._bad_env', set()):
+                with patch('pgxnclient.network.logger') as logger:
+                    self.assertRaises(NetworkError, network.get_file, URL)
+                    self.assertRaises(NetworkError, network.get_file, URL)
+        self.assertEqual(
+            self.opener.open.call_count, 2 * (network.RETRIES + 1)
+        )
+        # warned once per variable
+        self.assertEqual(logger.warning.call_count, 2)
+
+    def test_give_up(self):
+        self.opener.open.side_effect = [http_error(500)] * 3
+        self.assertRaises(NetworkError, network.get_file, URL, retries=2)
+        self.assertEqual(self.opener.open.call_count, 3)
+
+        self.opener.open.reset_mock()
+        self.opener.open.side_effect = [http_error(500)] * 10
+        with patch.dict('os.environ', {'PGXN_RETRIES': '0'}):
+            self.assertRaises(NetworkError, network.get_file, URL)
+        self.assertEqual(self.opener.open.call_count, 1)
+
+    def test_retry_after(self):
+        date = formatdate(time.time() + 20, usegmt=True)
+        self.opener.open.side_effect = [
+            http_error(429, {'Retry-After': '5'}),
+            http_error(503, {'Retry-After': date}),
+            Mock(),
+        ]
+        network.get_file(URL)
+        delays = [c[0][0] for c in self.sleep.call_args_list]
+        self.assertEqual(delays[0], 5)
+        self.assert_(18 < delays[1] <= 20, delays)
+
+    def test_max_time(self):
+        self.opener.open.side_effect = [
+            http_error(503, {'Retry-After': '120'}),
+            Mock(),
+        ]
+        self.assertRaises(NetworkError, network.get_file, URL, max_time=60)
+        self.assertEqual(self.sleep.call_count, 0)
+
+
+class FakeResponse(BytesIO):
+    def __init__(self, data, headers=None):
+        BytesIO.__init__(self, data)
+        self.url = URL
+        self.headers = Message()
+        for k, v in (headers or {}).items():
+            self.headers[k] = v
+
+    def info(self):
+        return self.headers
+
+
+class CompressTestCase(unittest.TestCase):
+    data = b'{"dist": "/dist/{dist}.json"}' * 100
+
+    def setUp(self):
+        self.opener = Mock()
+        p = patch('pgxnclient.network.get_opener', lambda: self.opener)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def get(self, data, encoding):
+        self.opener.open.return_value = FakeResponse(
+            data, encoding and {'Content-Encoding': encoding}
+        )
+        with network.get_file(URL, compress=True) as f:
+            # read in small chunks to check the streaming
+            rv = b''
+            while 1:
+                chunk = f.read(100)
+                if not chunk:
+                    break
+                rv += chunk
+
+        req = self.opener.open.call_args[0][0]
+        self.assertEqual(req.get_header('Accept-encoding'), 'gzip, deflate')
+        return rv
+
+    def test_gzip(self):
+        buf = BytesIO()
+        with GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(self.data)
+        self.assertEqual(self.get(buf.getvalue(), 'gzip'), self.data)
+
+    def test_deflate(self):
+        self.assertEqual(
+            self.get(zlib.compress(self.data), 'deflate'), self.data
+        )
+
+    def test_raw_deflate(self):
+        z = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = z.compress(self.data) + z.flush()
+        self.assertEqual(self.get(data, 'deflate'), self.data)
+
+    def test_large(self):
+        data = os.urandom(1024) * 4096
+        self.opener.open.return_value = FakeResponse(
+            zlib.compress(data), {'Content-Encoding': 'deflate'}
+        )
+        with network.get_file(URL, compress=True) as f:
+            rv = f.read()
+        self.assertEqual(type(rv), bytes)
+        self.assertEqual(rv, data)
+
+    def test_identity(self):
+        self.assertEqual(self.get(self.data, None), self.data)
+
+    def test_bad_data(self):
+        self.assertRaises(NetworkError, self.get, self.data, 'gzip')
+
+    def test_truncated(self):
+        buf = BytesIO()
+        with GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(self.data)
+        data = buf.getvalue()
+        self.assertRaises(NetworkError, self.get, data[:-10], 'gzip')
+
+        data = zlib.compress(self.data)
+        self.assertRaises(NetworkError, self.get, data[:-10], 'deflate')
+
+    def test_no_compress(self):
+        self.opener.open.return_value = FakeResponse(self.data)
+        with network.get_file(URL) as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(self.opener.open.call_args[0][0], URL)
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from pgxnclient import network
+from pgxnclient.api import ApiCache, OfflineApi
+from pgxnclient.archive import ArchiveIndex
+from pgxnclient.cli import main
+from pgxnclient.store import ArchiveStore
+from pgxnclient.errors import NotCached
+
+from .test_commands import fake_get_file
+from .testutils import CacheDirPatcher
+
+
+def no_network(url, _get_file=network.get_file, **kwargs):
+    # the offline cache is read as a file:// mirror
+    if not url.startswith('file://'):
+        raise AssertionError("network accessed: %s" % url)
+    return _get_file(url, **kwargs)
+
+
+class OfflineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = CacheDirPatcher()
+        self.cache.start()
+        self.addCleanup(self.cache.stop)
+
+        self.tdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tdir)
+
+    def warm(self):
+        with patch('pgxnclient.network.get_file', fake_get_file):
+            main(['download', '--target', self.tdir, 'foobar'])
+        os.unlink(os.path.join(self.tdir, 'foobar-0.42.1.zip'))
+
+    @patch('pgxnclient.network.get_file', no_network)
+    def test_download(self):
+        self.warm()
+        main(['download', '--offline', '--target', self.tdir, 'foobar'])
+        self.assert_(
+            os.path.exists(os.path.join(self.tdir, 'foobar-0.42.1.zip'))
+        )
+
+    @patch('pgxnclient.network.get_file', no_network)
+    def test_env(self):
+        self.warm()
+        with patch.dict('os.environ', {'PGXN_OFFLINE': '1'}):
+            main(['download', '--target', self.tdir, 'foobar'])
+            self.assertRaises(NotCached, main, ['download', 'pyrseas'])
+
+    @patch('pgxnclient.network.get_file', no_network)
+    def test_not_cached(self):
+        self.assertRaises(NotCached, main, ['info', '--offline', 'foobar'])
+
+        self.warm()
+        main(['info', '--offline', 'foobar'])
+        self.assertRaises(NotCached, main, ['info', '--offline', 'pyrseas'])
+        self.assertRaises(
+            NotCached, main, ['info', '--offline', '--readme', 'foobar']
+        )
+        self.assertRaises(
+            NotCached,
+            main,
+            ['download', '--offline', 'http://example.org/foo.zip'],
+        )
+
+    @patch('pgxnclient.network.get_file', no_network)
+    def test_archive_missing(self):
+        self.warm()
+        store = ArchiveStore()
+        os.unlink(store.get_path(os.listdir(store.root)[0]))
+        self.assertRaises(NotCached, main, ['download', '--offline', 'foobar'])
+
+    @patch('pgxnclient.network.get_file', no_network)
+    def test_gc(self):
+        self.warm()
+        store = ArchiveStore()
+        self.assertNotEqual(store.root, ArchiveIndex.get_index_dir())
+        names = os.listdir(store.root)
+
+        main(['cache', 'gc'])
+        self.assertEqual(os.listdir(store.root), names)
+        main(['download', '--offline', '--target', self.tdir, 'foobar'])
+
+    def test_api(self):
+        api = OfflineApi()
+        self.assertRaises(NotCached, api.search, 'docs', ['foo'])
+
+        cache = ApiCache()
+        self.assertEqual(cache.get_filename('/../foo.json'), None)
+        self.assertEqual(
+            cache.get_filename('/dist/foo%20bar.json'),
+            os.path.join(cache.root, 'dist', 'foo bar.json'),
+        )
+
+
+class NoCacheTestCase(unittest.TestCase):
+    """The cache directory can't be created."""
+
+    def setUp(self):
+        fd, fn = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, fn)
+        p = patch.dict(
+            'os.environ', {'PGXN_CACHE_DIR': os.path.join(fn, 'cache')}
+        )
+        p.start()
+        self.addCleanup(p.stop)
+
+        self.tdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tdir)
+
+    @patch('pgxnclient.network.get_file', fake_get_file)
+    def test_online(self):
+        main(['info', 'foobar'])
+        main(['download', '--target', self.tdir, 'foobar'])
+        self.assertEqual(os.listdir(self.tdir), ['foobar-0.42.1.zip'])
+
+    def test_offline(self):
+        self.assertRaises(NotCached, main, ['info', '--offline', 'foobar'])
@@ -0,0 +1,154 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from pgxnclient.search import SearchIndex
+
+from .testutils import CacheDirPatcher
+from .test_commands import get_stdout_data
+
+TEMPLATES = {
+    'dist': '/dist/{dist}.json',
+    'meta': '/dist/{dist}/{version}/META.json',
+    'readme': '/dist/{dist}/{version}/README.txt',
+}
+
+
+class SearchMirrorTestCase(unittest.TestCase):
+    """Create a small local mirror and an empty index."""
+
+    def setUp(self):
+        self.mirror = tempfile.mkdtemp()
+        self.write('index.json', TEMPLATES)
+        self.add_release(
+            'pair',
+            '0.1.0',
+            abstract='A key/value pair data type',
+            provides={'pair': {'abstract': 'An ordered pair type'}},
+            readme="The pair extension provides an ordered pair type.",
+        )
+        self.add_release(
+            'semver',
+            '0.2.0',
+            abstract='A semantic version data type',
+            provides={'semver': {'abstract': 'Semantic versions'}},
+            readme="Store semantic versions in the database.",
+        )
+
+        self.dbdir = tempfile.mkdtemp()
+        self.index = SearchIndex(os.path.join(self.dbdir, 'search.sqlite'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.mirror)
+        shutil.rmtree(self.dbdir)
+
+    def write(self, path, data):
+        fn = os.path.join(self.mirror, path.lstrip('/'))
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        with open(fn, 'w') as f:
+            if isinstance(data, str):
+                f.write(data)
+            else:
+                json.dump(data, f)
+
+    def add_release(self, dist, version, readme=None, **meta):
+        args = {'dist': dist, 'version': version}
+        meta.update(name=dist, version=version)
+        self.write(TEMPLATES['meta'].format(**args), meta)
+        if readme:
+            self.write(TEMPLATES['readme'].format(**args), readme)
+        self.write(
+            TEMPLATES['dist'].format(**args),
+            {'name': dist, 'version': version},
+        )
+
+
+class SearchIndexTestCase(SearchMirrorTestCase):
+    def test_search(self):
+        self.assertEqual(self.index.update(self.mirror), 2)
+
+        data = self.index.search('dists', ['data', 'type'])
+        self.assertEqual(data['count'], 2)
+        data = self.index.search('dists', ['semantic'])
+        self.assertEqual(
+            [(h['dist'], h['version']) for h in data['hits']],
+            [('semver', '0.2.0')],
+        )
+        self.assert_('<strong>semantic</strong>' in data['hits'][0]['excerpt'])
+
+        data = self.index.search('extensions', ['ordered'])
+        self.assertEqual([h['dist'] for h in data['hits']], ['pair'])
+        data = self.index.search('docs', ['database'])
+        self.assertEqual([h['dist'] for h in data['hits']], ['semver'])
+        data = self.index.search('docs', ['database', 'nothing'])
+        self.assertEqual([h['dist'] for h in data['hits']], ['semver'])
+        data = self.index.search('docs', ['nothing'])
+        self.assertEqual(data['hits'], [])
+
+    def test_phrase(self):
+        self.index.update(self.mirror)
+        data = self.index.search('docs', ['ordered pair'])
+        self.assertEqual([h['dist'] for h in data['hits']], ['pair'])
+        data = self.index.search('docs', ['pair ordered'])
+        self.assertEqual(data['hits'], [])
+        data = self.index.search('docs', ['"pair'])
+        self.assertEqual([h['dist'] for h in data['hits']], ['pair'])
+
+    def test_update(self):
+        self.assertEqual(self.index.update(self.mirror), 2)
+        self.assertEqual(self.index.update(self.mirror), 0)
+
+        self.add_release(
+            'pair',
+            '0.2.0',
+            abstract='A key/value pair data type',
+            provides={'pair': {'abstract': 'An unordered pair type'}},
+        )
+        # make sure the mtime changes
+        fn = os.path.join(self.mirror, 'dist', 'pair.json')
+        st = os.stat(fn)
+        os.utime(fn, (st.st_atime, st.st_mtime + 10))
+
+        self.assertEqual(self.index.update(self.mirror), 1)
+        data = self.index.search('extensions', ['pair'])
+        self.assertEqual(
+            [(h['dist'], h['version']) for h in data['hits']],
+            [('pair', '0.2.0')],
+        )
+        data = self.index.search('extensions', ['unordered'])
+        self.assertEqual(data['count'], 1)
+        # the old release is no more indexed
+        self.assertEqual(self.index.search('docs', ['pair'])['count'], 0)
+
+
+class SearchCommandTestCase(SearchMirrorTestCase):
+    def setUp(self):
+        super(SearchCommandTestCase, self).setUp()
+        self.cache = CacheDirPatcher()
+        self.cache.start()
+
+    def tearDown(self):
+        self.cache.stop()
+        super(SearchCommandTestCase, self).tearDown()
+
+    @patch('sys.stdout')
+    @patch('pgxnclient.network.get_file')
+    def test_offline(self, mock_get, stdout):
+        stdout.encoding = 'UTF-8'
+        mock_get.side_effect = AssertionError("no network expected")
+
+        from pgxnclient.cli import main
+
+        main(['search', '--update-index', self.mirror])
+        self.assertEqual(get_stdout_data(stdout), b'')
+
+        main(['search', '--offline', '--ext', 'semantic'])
+        out = get_stdout_data(stdout)
+        self.assert_(out.startswith(b'semver 0.2.0\n'), out)
+        self.assert_(b'*Semantic*' in out, out)
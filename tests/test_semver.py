@@ -101,6 +101,49 @@ class SemVerTestCase(unittest.TestCase):
                 SemVer(s2) <= SemVer(s1), "%s <= %s failed" % (s2, s1)
             )
             self.assert_(SemVer(s2) < SemVer(s1), "%s < %s failed" % (s2, s1))
+            self.assert_(SemVer(s2).key < SemVer(s1).key)
+
+    def test_sort_key(self):
+        vs = [
+            SemVer(s)
+            for s in '2.2.2 1.0.0 2.2.2-b 2.2.2-RC-1 0.9.10 2.2.2-c'.split()
+        ]
+        self.assertEqual(sorted(vs, key=lambda v: v.key), sorted(vs))
+        self.assertEqual(max(vs, key=lambda v: v.key), '2.2.2')
+
+    def test_interned(self):
+        info = SemVer.cache_info()['parse']
+        v1 = SemVer('1.2.3-interned')
+        v2 = SemVer('1.2.3-interned')
+        self.assert_(v1 is v2)
+        self.assert_(SemVer(v1) is v1)
+        info2 = SemVer.cache_info()['parse']
+        self.assertEqual(info2.hits, info.hits + 1)
+        self.assertEqual(info2.misses, info.misses + 1)
+
+        info = SemVer.cache_info()['clean']
+        self.assertEqual(SemVer.clean('1.2b'), '1.2.0-b')
+        self.assertEqual(SemVer.clean('1.2b'), '1.2.0-b')
+        self.assertEqual(SemVer.cache_info()['clean'].hits, info.hits + 1)
+
+    def test_intern_table(self):
+        from pgxnclient.utils.semver import InternTable
+
+        t = InternTable(2)
+        t.put('a', 1)
+        t.put('b', 2)
+        self.assertEqual(t.get('a'), 1)
+        t.put('c', 3)
+        self.assertEqual(t.get('b'), None)
+        self.assertEqual(t.get('a'), 1)
+        self.assertEqual(t.get('c'), 3)
+        self.assertEqual(t.cache_info(), (3, 1, 2, 2))
+
+    def test_cmp_str(self):
+        self.assert_(SemVer('1.2.3') == '1.2.3')
+        self.assert_(SemVer('1.2.3-a') == '1.2.3-A')
+        self.assert_(SemVer('1.2.3') < '1.2.4')
+        self.assertRaises(ValueError, lambda: SemVer('1.2.3') == 'foo')
 
     def test_clean(self):
         for s1, s2 in [
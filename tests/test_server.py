@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import patch
+
+from pgxnclient import server
+from pgxnclient.errors import PgxnClientException
+
+try:
+    server.check_support()
+except PgxnClientException:
+    supported = False
+else:
+    supported = True
+
+
+@unittest.skipIf(not supported, "command server not supported")
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tdir, 'sock')
+        self.server = server.Server(self.path)
+        self.server.bind()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tdir)
+
+    def handle_one(self):
+        def target():
+            conn, addr = self.server.sock.accept()
+            try:
+                self.server.handle(conn)
+            finally:
+                conn.close()
+
+        t = threading.Thread(target=target)
+        t.start()
+        return t
+
+    def test_call(self):
+        calls = []
+
+        def run_main(args, session=None):
+            calls.append((args, os.getcwd(), os.environ.get('PGXN_TEST')))
+            return 3
+
+        with patch('pgxnclient.cli.run_main', run_main):
+            with patch.dict(os.environ, {'PGXN_TEST': 'foo'}):
+                t = self.handle_one()
+                rv = server.call(self.path, ['info', 'foobar'])
+                t.join()
+
+        self.assertEqual(rv, 3)
+        self.assertEqual(calls, [(['info', 'foobar'], os.getcwd(), 'foo')])
+        self.assertEqual(os.environ.get('PGXN_TEST'), None)
+
+    def test_call_no_response(self):
+        def target():
+            conn, addr = self.server.sock.accept()
+            server._recv_request(conn)
+            conn.close()
+
+        t = threading.Thread(target=target)
+        t.start()
+        try:
+            self.assertRaises(
+                server.ServerError, server.call, self.path, ['info', 'foobar']
+            )
+        finally:
+            t.join()
+
+    def test_call_server_fallback(self):
+        from pgxnclient.cli import _call_server
+
+        # Not listening: the command must be run locally
+        self.server.close()
+        with patch.dict(os.environ, {'PGXN_SOCKET': self.path}):
+            with patch('sys.stderr', encoding='UTF-8'):
+                self.assertEqual(_call_server(['info', 'foobar']), None)
+
+        # Request sent: the command must not be run again
+        with patch('pgxnclient.server.call') as call:
+            call.side_effect = server.ServerError('oops')
+            with patch.dict(os.environ, {'PGXN_SOCKET': self.path}):
+                with patch('sys.stderr', encoding='UTF-8'):
+                    self.assertEqual(_call_server(['info', 'foobar']), 1)
+
+    def test_permissions(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+        # the umask is only changed while binding
+        self.server.close()
+        mask = os.umask(0o022)
+        try:
+            self.server.bind()
+            self.assertEqual(os.umask(mask), 0o022)
+        except BaseException:
+            os.umask(mask)
+            raise
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    @unittest.skipIf(
+        not hasattr(server.socket, 'SO_PEERCRED'), "SO_PEERCRED not available"
+    )
+    def test_other_user(self):
+        errors = []
+
+        def target():
+            conn, addr = self.server.sock.accept()
+            try:
+                with patch('os.getuid', return_value=os.getuid() + 1):
+                    self.server.handle(conn)
+            except PgxnClientException as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+        with patch('pgxnclient.cli.run_main') as run_main:
+            t = threading.Thread(target=target)
+            t.start()
+            try:
+                # the connection may be closed before the request is sent
+                self.assertRaises(
+                    (server.ServerError, server.socket.error),
+                    server.call,
+                    self.path,
+                    ['info', 'foobar'],
+                )
+            finally:
+                t.join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(run_main.call_count, 0)
+
+    def test_already_listening(self):
+        self.assertRaises(PgxnClientException, server.Server(self.path).bind)
+
+    def test_stale_socket(self):
+        self.server.close()
+        open(self.path, 'w').close()
+        self.server.bind()
+        self.assert_(server.is_listening(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,20 @@
 import unittest
 
-from pgxnclient import Spec
+from pgxnclient import Spec, SemVer
+from pgxnclient.errors import BadSpecError
+from pgxnclient.catalogue import VersionIndex
+
+VERSIONS = [
+    '0.9.0',
+    '1.0.0',
+    '1.2.0-b1',
+    '1.2.0',
+    '1.5.0',
+    '1.9.9',
+    '2.0.0-rc1',
+    '2.0.0',
+    '2.1.0',
+]
 
 
 class SpecTestCase(unittest.TestCase):
@@ -11,6 +25,61 @@ class SpecTestCase(unittest.TestCase):
         self.assertEqual(str(Spec(dirname='/foo')), '/foo')
         self.assertEqual(str(Spec(dirname='/foo/foo.zip')), '/foo/foo.zip')
 
+        self.assertEqual(
+            str(Spec.parse('foo>=1.2,<2.0,!=1.5.0')),
+            'foo>=1.2.0,<2.0.0,!=1.5.0',
+        )
+
+    def test_parse(self):
+        spec = Spec.parse('foo')
+        self.assertEqual(spec.constraints, [])
+        self.assertEqual(spec.op, None)
+
+        spec = Spec.parse('foo=1.0')
+        self.assertEqual(spec.constraints, [('==', '1.0.0')])
+        self.assertEqual((spec.op, spec.ver), ('==', '1.0.0'))
+        self.assert_(isinstance(spec.ver, SemVer))
+
+        spec = Spec.parse('foo>=1.2, <2.0,!=1.5.0')
+        self.assertEqual(spec.name, 'foo')
+        self.assertEqual(
+            spec.constraints,
+            [('>=', '1.2.0'), ('<', '2.0.0'), ('!=', '1.5.0')],
+        )
+        self.assertEqual((spec.op, spec.ver), ('>=', '1.2.0'))
+
+        self.assertRaises(BadSpecError, Spec.parse, 'foo>1.0,2.0')
+
+    def test_accepted(self):
+        for s, ok in [
+            ('foo', VERSIONS),
+            ('foo>=1.2,<2.0,!=1.5.0', ['1.2.0', '1.9.9', '2.0.0-rc1']),
+            (
+                'foo!=1.0,!=2.0',
+                [v for v in VERSIONS if v not in ('1.0.0', '2.0.0')],
+            ),
+            ('foo>1.0,<=1.0', []),
+            ('foo>=1.0,<=1.0', ['1.0.0']),
+            ('foo=1.5,>1.2', ['1.5.0']),
+            ('foo<1.2,>2.0', []),
+        ]:
+            spec = Spec.parse(s)
+            self.assertEqual(
+                [v for v in VERSIONS if spec.accepted(SemVer(v))], ok, s
+            )
+
+    def test_best(self):
+        idx = VersionIndex(VERSIONS)
+        for s, best in [
+            ('foo', '2.1.0'),
+            ('foo>=1.2,<2.0,!=1.5.0', '2.0.0-rc1'),
+            ('foo!=2.1,!=2.0', '2.0.0-rc1'),
+            ('foo<1.2,>=1.0', '1.2.0-b1'),
+            ('foo<1.0,>=2.1', None),
+            ('foo>2.1', None),
+        ]:
+            self.assertEqual(idx.best(Spec.parse(s)), best, s)
+
 
 if __name__ == '__main__':
     unittest.main()
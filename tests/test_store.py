@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pgxnclient.zip import unpack
+from pgxnclient.store import TreeStore
+from .testutils import get_test_filename
+
+
+class TreeStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.store = TreeStore(os.path.join(self.tdir, 'store'))
+        os.mkdir(self.store.root)
+        self.src = os.path.join(self.tdir, 'src')
+        os.mkdir(self.src)
+        unpack(get_test_filename('foobar-0.42.1.zip'), self.src)
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_add(self):
+        self.assert_(not self.store.has('abc'))
+        self.store.add('abc', self.src)
+        self.assert_(self.store.has('abc'))
+
+        fn = os.path.join(self.store.get_path('abc'), 'foobar-0.42.1')
+        fn = os.path.join(fn, 'Makefile')
+        self.assert_(os.path.isfile(fn))
+        self.assert_(not os.stat(fn).st_mode & 0o222)
+
+    def test_materialize(self):
+        self.store.add('abc', self.src)
+        dest = os.path.join(self.tdir, 'dest')
+        os.mkdir(dest)
+        self.store.materialize('abc', dest)
+
+        for dir, dirnames, filenames in os.walk(self.src):
+            rel = os.path.relpath(dir, self.src)
+            for fn in filenames:
+                with open(os.path.join(dir, fn), 'rb') as f:
+                    data1 = f.read()
+                with open(os.path.join(dest, rel, fn), 'rb') as f:
+                    data2 = f.read()
+                self.assertEqual(data1, data2)
+
+    def test_no_shared_files(self):
+        self.store.add('abc', self.src)
+        dest = os.path.join(self.tdir, 'dest')
+        os.mkdir(dest)
+        self.store.materialize('abc', dest)
+
+        rel = os.path.join('foobar-0.42.1', 'Makefile')
+        src = os.path.join(self.src, rel)
+        stored = os.path.join(self.store.get_path('abc'), rel)
+        copy = os.path.join(dest, rel)
+        inodes = set(os.stat(fn).st_ino for fn in (src, stored, copy))
+        self.assertEqual(len(inodes), 3)
+
+        # A build modifying the working copy doesn't affect the store
+        with open(copy, 'a') as f:
+            f.write('# changed\n')
+        with open(stored) as f1, open(src) as f2:
+            self.assertEqual(f1.read(), f2.read())
+        self.assert_(os.stat(src).st_mode & 0o200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from mock import patch, mock_open
+
+from pgxnclient.utils import temp
+
+
+class TempDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self._p1 = patch('tempfile.tempdir', self.root)
+        self._p1.start()
+
+    def tearDown(self):
+        self._p1.stop()
+        shutil.rmtree(self.root)
+
+    def test_sync(self):
+        with temp.temp_dir() as dir:
+            self.assert_(os.path.isdir(dir))
+        self.assert_(not os.path.exists(dir))
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_thread(self):
+        with temp.temp_dir(cleanup=temp.THREAD) as dir:
+            open(os.path.join(dir, 'f'), 'w').close()
+        self.assert_(not os.path.exists(dir))
+        self.assertEqual(os.listdir(self.root), [temp.get_trash_name()])
+
+        trash = os.path.join(self.root, temp.get_trash_name())
+        for i in range(50):
+            if not os.listdir(trash):
+                break
+            time.sleep(0.1)
+        self.assertEqual(os.listdir(trash), [])
+
+    def test_sweep(self):
+        with patch('pgxnclient.utils.temp._spawn_rmtree') as mock_spawn:
+            with temp.temp_dir(cleanup=temp.PROCESS):
+                pass
+        self.assertEqual(mock_spawn.call_count, 1)
+
+        trash = os.path.join(self.root, temp.get_trash_name())
+        self.assertEqual(len(os.listdir(trash)), 1)
+        self.assertEqual(len(temp.sweep_trash()), 1)
+        self.assertEqual(os.listdir(trash), [])
+
+    def test_trash_private(self):
+        trash = temp.get_trash_dir(self.root)
+        self.assertEqual(os.stat(trash).st_mode & 0o777, 0o700)
+
+        # the trash of other users is not swept
+        other = os.path.join(self.root, temp.TRASH_DIR + '-other')
+        os.makedirs(os.path.join(other, 'tmpfoo'))
+        self.assertEqual(temp.sweep_trash(), [])
+        self.assertEqual(os.listdir(other), ['tmpfoo'])
+
+    def test_trash_not_owned(self):
+        # a trash dir created by someone else is neither written nor swept
+        with patch('os.getuid', return_value=os.getuid() + 1):
+            trash = os.path.join(self.root, temp.get_trash_name())
+            os.makedirs(os.path.join(trash, 'tmpfoo'))
+            self.assertRaises(OSError, temp.get_trash_dir, self.root)
+            with temp.temp_dir(cleanup=temp.THREAD) as dir:
+                pass
+            self.assertEqual(temp.sweep_trash(), [])
+
+        self.assert_(not os.path.exists(dir))
+        self.assertEqual(os.listdir(trash), ['tmpfoo'])
+
+
+class ScratchRootTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self._p1 = patch(
+            'pgxnclient.utils.temp._get_mounts',
+            return_value={
+                '/': ('ext4', frozenset(['rw'])),
+                self.root: ('tmpfs', frozenset(['rw', 'nosuid'])),
+            },
+        )
+        self._p1.start()
+        self._p2 = patch.dict(
+            os.environ,
+            {'XDG_RUNTIME_DIR': self.root, 'PGXN_RAMDISK_MAX': '1'},
+        )
+        self._p2.start()
+
+    def tearDown(self):
+        self._p2.stop()
+        self._p1.stop()
+        shutil.rmtree(self.root)
+
+    def test_ram_dirs(self):
+        self.assert_(self.root in temp.get_ram_dirs())
+
+    def test_noexec(self):
+        mounts = {
+            '/': ('ext4', frozenset(['rw'])),
+            self.root: ('tmpfs', frozenset(['rw', 'noexec'])),
+        }
+        with patch('pgxnclient.utils.temp._get_mounts', return_value=mounts):
+            self.assert_(self.root not in temp.get_ram_dirs())
+
+    def test_small(self):
+        self.assertEqual(temp.get_scratch_root(1024), self.root)
+
+    def test_too_large(self):
+        self.assertEqual(temp.get_scratch_root(1024 * 1024), None)
+        self.assertEqual(temp.get_scratch_root(None), None)
+
+    def test_no_space(self):
+        with patch('os.statvfs') as mock_statvfs:
+            mock_statvfs.return_value.f_bavail = 1
+            mock_statvfs.return_value.f_frsize = 4096
+            self.assertEqual(temp.get_scratch_root(1024 * 2), None)
+
+
+class MountsTestCase(unittest.TestCase):
+    def test_get_mounts(self):
+        data = (
+            "/dev/sda1 / ext4 rw,relatime 0 0\n"
+            "shm /dev/shm tmpfs rw,nosuid,nodev,noexec,size=65536k 0 0\n"
+            "tmpfs /run/my\\040dir tmpfs rw 0 0\n"
+        )
+        f = mock_open(read_data=data)
+        with patch('pgxnclient.utils.temp.open', f, create=True):
+            mounts = temp._get_mounts()
+
+        self.assertEqual(mounts['/'][0], 'ext4')
+        self.assertEqual(mounts['/dev/shm'][0], 'tmpfs')
+        self.assert_('noexec' in mounts['/dev/shm'][1])
+        self.assert_('noexec' not in mounts['/run/my dir'][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+
+from mock import patch
+
+from pgxnclient.utils import uri
+from pgxnclient.utils.uri import (
+    expand_template,
+    compile_template,
+    TemplateSyntaxError,
+)
+
+
+class CompileTemplateTestCase(unittest.TestCase):
+    def test_compile(self):
+        nodes, names = compile_template('/dist/{dist}/{version}/META.json')
+        self.assertEqual(names, frozenset(['dist', 'version']))
+        self.assertEqual(nodes[0], '/dist/')
+        self.assertEqual(nodes[2], '/')
+        self.assertEqual(nodes[4], '/META.json')
+        self.assertEqual(nodes[1], (None, None, {'dist': None}))
+
+    def test_no_expansion(self):
+        self.assertEqual(
+            compile_template('/index.json'), (['/index.json'], frozenset())
+        )
+        self.assertEqual(
+            expand_template('/index.json', {'a': 'b'}), '/index.json'
+        )
+
+    def test_cache(self):
+        template = '/test_cache/{dist}.json'
+        with patch(
+            'pgxnclient.utils.uri.parse_expansion', wraps=uri.parse_expansion
+        ) as mock:
+            rv = compile_template(template)
+            self.assert_(compile_template(template) is rv)
+            self.assertEqual(
+                expand_template(template, dist='foo'), '/test_cache/foo.json'
+            )
+            self.assertEqual(
+                expand_template(template, dist='bar'), '/test_cache/bar.json'
+            )
+        self.assertEqual(mock.call_count, 1)
+
+    def test_unknown_operator(self):
+        template = '/{-nosuch|/|dist}.json'
+        self.assertRaises(TemplateSyntaxError, compile_template, template)
+
+        # the error is raised at compile time and the template is not cached
+        self.assertRaises(TemplateSyntaxError, compile_template, template)
+        self.assertRaises(
+            TemplateSyntaxError, expand_template, template, dist='foo'
+        )
+
+
+class ExpandTemplateTestCase(unittest.TestCase):
+    def test_encode_used_only(self):
+        with patch('pgxnclient.utils.uri._encode', wraps=uri._encode) as mock:
+            # 42 can't be encoded: it would fail if used
+            self.assertEqual(
+                expand_template(
+                    '/dist/{dist}.json', {'dist': 'foo bar', 'other': 42}
+                ),
+                '/dist/foo%20bar.json',
+            )
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(mock.call_args[0], ('foo bar',))
+
+    def test_kwargs(self):
+        self.assertEqual(
+            expand_template('/{a}/{b}', {'a': 'x', 'b': 'y'}, b='z'), '/x/z'
+        )
+
+    def test_missing(self):
+        self.assertEqual(expand_template('/dist/{dist}.json'), '/dist/.json')
+        self.assertEqual(
+            expand_template('/dist/{dist}.json', {'version': '1.0'}),
+            '/dist/.json',
+        )
+
+    def test_default(self):
+        self.assertEqual(
+            expand_template('/dist/{dist=foo}.json'), '/dist/foo.json'
+        )
+        self.assertEqual(
+            expand_template('/dist/{dist=foo}.json', dist='bar'),
+            '/dist/bar.json',
+        )
+
+    def test_empty(self):
+        self.assertEqual(
+            expand_template('/dist/{dist}.json', dist=''), '/dist/.json'
+        )
+        self.assertEqual(expand_template('/a{-prefix|/|b}', b=''), '/a')
+        self.assertEqual(expand_template('/a{-opt|/|b}', {}), '/a')
+        self.assertEqual(expand_template('/a{-listjoin|/|b}', b=[]), '/a')
@@ -7,6 +7,8 @@ pgxnclient -- unit test utilities
 # This file is part of the PGXN client
 
 import os
+import shutil
+import tempfile
 
 
 def ifunlink(fn):
@@ -18,3 +20,19 @@ def ifunlink(fn):
 def get_test_filename(*parts):
     """Return the complete file name for a testing file."""
     return os.path.join(os.path.dirname(__file__), 'testdata', *parts)
+
+
+class CacheDirPatcher(object):
+    """Run the client with a new empty cache directory until stopped."""
+
+    def start(self):
+        self.olddir = os.environ.get('PGXN_CACHE_DIR')
+        self.dir = os.environ['PGXN_CACHE_DIR'] = tempfile.mkdtemp()
+        return self.dir
+
+    def stop(self):
+        if self.olddir is None:
+            del os.environ['PGXN_CACHE_DIR']
+        else:
+            os.environ['PGXN_CACHE_DIR'] = self.olddir
+        shutil.rmtree(self.dir)